@@ -1 +1,3 @@
-from .db import get_db
\ No newline at end of file
+from .db import get_db, sqlite_client, DB_MODE
+from .lessons import get_lesson, list_audio_keys, LESSON_SOURCE
+from .events import write_session_events, get_events_db
@@ -2,12 +2,29 @@ import os
 from libsql_client import create_client
 from dotenv import load_dotenv
 
+from .replica import EmbeddedReplica
+
 load_dotenv()
 
 DB_URL = os.environ.get("TURSO_EXPLANATION_DB_URL")
 DB_TOKEN = os.environ.get("TURSO_EXPLANATION_DB_TOKEN")
 
-sqlite_client = create_client(url=DB_URL, auth_token=DB_TOKEN)
+DB_MODE = os.environ.get("DB_MODE", "remote")  # "remote" | "replica"
+DB_REPLICA_PATH = os.environ.get("DB_REPLICA_PATH", "/tmp/explanation-replica.db")
+DB_SYNC_INTERVAL = float(os.environ.get("DB_SYNC_INTERVAL", 60))
+DB_PRIMARY_PATH = os.environ.get("DB_PRIMARY_PATH")  # local sqlite file as primary (dev/tests)
+
+if DB_MODE == "replica":
+    # one replica file per web process, they can't share a connection
+    sqlite_client = EmbeddedReplica(
+        replica_path=f"{DB_REPLICA_PATH}.{os.getpid()}",
+        sync_interval=DB_SYNC_INTERVAL,
+        sync_url=DB_URL if not DB_PRIMARY_PATH else None,
+        auth_token=DB_TOKEN,
+        primary_path=DB_PRIMARY_PATH,
+    )
+else:
+    sqlite_client = create_client(url=DB_URL, auth_token=DB_TOKEN)
 
 
 async def get_db():
@@ -0,0 +1,61 @@
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import lazy_singleton
+
+from .db import sqlite_client, DB_MODE, DB_URL, DB_TOKEN
+
+EVENT_COLUMNS = ("session_id", "lesson_id", "kind", "ts", "data")
+# 5 columns x 100 rows stays under sqlite's default limit of 999 parameters
+ROWS_PER_INSERT = 100
+
+
+class PrimaryFile:
+    """Writes to the SQLite file a file-mode replica syncs from, on a thread of its own.
+
+    Args:
+        path(str): The primary's SQLite file (`DB_PRIMARY_PATH`).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events-db")
+
+    def _execute(self, sql: str, args: tuple) -> list:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:  # commits, so the next sync picks the rows up
+            return self._conn.execute(sql, args).fetchall()
+
+    async def execute(self, sql: str, args: tuple = ()) -> list:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, sql, args)
+
+
+@lazy_singleton
+def get_events_db():
+    """Client the session events are written with. Replicas are read-only copies, so in
+    replica mode the events go to the primary the replica syncs from, over a client of
+    their own: the sqlite file in file mode, the remote database otherwise."""
+    if DB_MODE != "replica":
+        return sqlite_client
+    if sqlite_client.primary_path:
+        return PrimaryFile(sqlite_client.primary_path)
+    from libsql_client import create_client
+
+    return create_client(url=DB_URL, auth_token=DB_TOKEN)
+
+
+async def write_session_events(db, rows: list) -> None:
+    """Inserts session events with multi-row INSERTs (migration 4).
+
+    Args:
+        db: Database client with an async `execute(sql, args)`.
+        rows(list): (session_id, lesson_id, kind, ts, data) tuples, data a json string.
+    """
+    for start in range(0, len(rows), ROWS_PER_INSERT):
+        batch = rows[start : start + ROWS_PER_INSERT]
+        placeholders = ", ".join(["(?, ?, ?, ?, ?)"] * len(batch))
+        args = tuple(value for row in batch for value in row)
+        await db.execute(f"INSERT INTO session_events ({', '.join(EVENT_COLUMNS)}) VALUES {placeholders}", args)
@@ -0,0 +1,156 @@
+import os
+import asyncio
+
+from utils import get_s3_client, logger
+from metrics import LESSON_DB_LOAD_SECONDS, S3_LIST_SECONDS
+
+from . import queries
+from .snapshot import LessonSnapshot
+
+S3_BUCKET = "explanation-dev"
+
+LESSON_SOURCE = os.environ.get("LESSON_SOURCE", "db")  # "db" | "snapshot"
+LESSON_SNAPSHOT_PATH = os.environ.get("LESSON_SNAPSHOT_PATH", "lessons.snap")
+
+# mapped once per worker, lessons are decoded lazily on request
+lesson_snapshot = LessonSnapshot(LESSON_SNAPSHOT_PATH) if LESSON_SOURCE == "snapshot" else None
+_summaries_missing_logged = False
+
+
+async def get_lesson(db, concept_id: int) -> dict:
+    """Loads a lesson and its diagram keys from the configured source.
+
+    Args:
+        db: Database client with an async `execute(sql, args)` (unused for snapshots).
+        concept_id(int): id of the lesson.
+
+    Returns:
+        dict: The lesson as returned by `load_lesson`, plus "diagram_keys" and
+            "diagram_sizes" (key -> bytes).
+    """
+    if lesson_snapshot is not None:
+        return lesson_snapshot.get(concept_id)
+
+    with LESSON_DB_LOAD_SECONDS.time():
+        lesson = await load_lesson(db, concept_id)
+    with S3_LIST_SECONDS.time():
+        lesson["diagram_sizes"] = await asyncio.to_thread(list_diagram_objects, concept_id)
+    lesson["diagram_keys"] = list(lesson["diagram_sizes"])
+    return lesson
+
+
+async def load_lesson(db, concept_id: int) -> dict:
+    """Loads everything needed to teach a lesson from the database.
+
+    Args:
+        db: Database client with an async `execute(sql, args)`.
+        concept_id(int): id of the lesson.
+
+    Returns:
+        dict: name, context, conclusion, context_snippets, conclusion_snippets and
+            explanation_steps ({step_num: {"tts_text", "sub_text", "snippets", "summary"}}).
+            Summaries ({"text", "tokens", "source_hash"}) are only there once
+            `scripts.lesson_summaries` has run.
+    """
+    concept_name_obj = await db.execute(queries.LESSON_NAME, (concept_id,))
+    conclusion_obj = await db.execute(queries.CONCLUSION, (concept_id,))
+    context_obj = await db.execute(queries.CONTEXT, (concept_id,))
+    explanation_steps_obj = await db.execute(queries.EXPLANATION_STEPS, (concept_id,))
+    snippet_obj = await db.execute(queries.STEP_SNIPPETS, (concept_id,))
+    tts_steps_obj = await db.execute(queries.TTS_STEPS, (concept_id,))
+    tts_context_obj = await db.execute(queries.CONTEXT_SNIPPETS, (concept_id,))
+    tts_conclusion_obj = await db.execute(queries.CONCLUSION_SNIPPETS, (concept_id,))
+    summary_rows = await load_summaries(db, concept_id)
+
+    # get all snippets for conclusion
+    conclusion_snippets = []
+    for snippet_text, snippet_num in tts_conclusion_obj.rows:
+        conclusion_snippets.append((snippet_num, snippet_text))
+
+    # get all snippets for context
+    context_snippets = []
+    for snippet_text, snippet_num in tts_context_obj.rows:
+        context_snippets.append((snippet_num, snippet_text))
+
+    # get the tts data for all explanation steps
+    explanation_steps = {}
+    for step_num, step_text in tts_steps_obj.rows:
+        explanation_steps.setdefault(int(step_num), {})["tts_text"] = step_text
+
+    # get all the steps in a list in sorted order
+    for step_num, step_text in explanation_steps_obj.rows:
+        explanation_steps[step_num]["sub_text"] = step_text
+
+    # get all snippets in a list in sorted order
+    for step_num, snippet_num, snippet_text in snippet_obj.rows:
+        explanation_steps[step_num].setdefault("snippets", []).append(
+            (snippet_num, snippet_text)
+        )
+
+    # precomputed summaries (scripts.lesson_summaries) for the voicebot context
+    context_summary = None
+    for part, step_num, summary_text, summary_tokens, source_hash in summary_rows:
+        summary = {"text": summary_text, "tokens": summary_tokens, "source_hash": source_hash}
+        if part == "context":
+            context_summary = summary
+        elif step_num in explanation_steps:
+            explanation_steps[step_num]["summary"] = summary
+
+    return {
+        "name": concept_name_obj[0][0],
+        "context": context_obj[0][0],
+        "context_summary": context_summary,
+        "conclusion": conclusion_obj[0][0],
+        "context_snippets": context_snippets,
+        "conclusion_snippets": conclusion_snippets,
+        "explanation_steps": explanation_steps,
+    }
+
+
+async def load_summaries(db, concept_id: int) -> list:
+    """Rows of `queries.SUMMARIES`, none while the schema predates migration 3
+    (no lesson_summaries table): the voicebot then uses the full text."""
+    global _summaries_missing_logged
+    try:
+        return (await db.execute(queries.SUMMARIES, (concept_id,))).rows
+    except Exception as e:
+        if "no such table" not in str(e):
+            raise
+        if not _summaries_missing_logged:
+            _summaries_missing_logged = True
+            logger.warning(f"No lesson summaries, run `python -m Database.migrations migrate`: {e}")
+        return []
+
+
+def list_objects(prefix: str) -> dict:
+    """key -> size in bytes of the files under `prefix` (folders and metadata skipped)."""
+    response = get_s3_client().list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)
+
+    objects = {}
+    for obj in response.get("Contents", []):
+        key = obj["Key"]
+        if key == prefix or "metadata" in key or "." not in key.split("/")[-1]:
+            continue
+        objects[key] = obj.get("Size")
+    return objects
+
+
+def list_keys(prefix: str) -> list:
+    """Object storage keys of the files under `prefix` (folders and metadata skipped)."""
+    return list(list_objects(prefix))
+
+
+def list_diagram_objects(concept_id: int) -> dict:
+    """key -> size in bytes of a lesson's diagrams."""
+    return list_objects(f"Diagrams/{concept_id}/")
+
+
+def list_diagram_keys(concept_id: int) -> list:
+    """Object storage keys of a lesson's diagrams (`Diagrams/{concept_id}/...`)."""
+    return list_keys(f"Diagrams/{concept_id}/")
+
+
+def list_audio_keys(concept_id: int) -> list:
+    """Keys of a lesson's pre-rendered narration (`Audio/{concept_id}/context.pcm`,
+    `step_{n}.pcm`, `conclusion.pcm`), if any were rendered."""
+    return list_keys(f"Audio/{concept_id}/")
@@ -0,0 +1,230 @@
+"""Lesson schema migrations and query-plan checks.
+
+Usage:
+    cd app
+    python -m Database.migrations migrate --sqlite lessons.db   # local sqlite file
+    python -m Database.migrations migrate --turso               # TURSO_EXPLANATION_DB_* env vars
+    python -m Database.migrations check                         # CI: fresh in-memory schema
+    python -m Database.migrations check --sqlite lessons.db     # check against a copy of a file
+
+`check` exits with a non-zero status if any of the route's queries does a full
+table scan.
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+
+from .queries import LESSON_QUERIES
+
+# (version, description, statements). Never edit an applied migration, add a new one.
+MIGRATIONS = [
+    (
+        1,
+        "lesson schema",
+        [
+            """CREATE TABLE IF NOT EXISTS lessons (
+                ID INTEGER PRIMARY KEY,
+                name TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS contexts (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                context_text TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS conclusions (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                conclusion_text TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS explanation_steps (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                step_num INTEGER NOT NULL,
+                step_text TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS step_snippets (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                step_num INTEGER NOT NULL,
+                snippet_num INTEGER NOT NULL,
+                snippet_text TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS tts_steps (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                step_num INTEGER NOT NULL,
+                tts_text TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS context_snippets (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                snippet_num INTEGER NOT NULL,
+                snippet_text TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS conclusion_snippets (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                snippet_num INTEGER NOT NULL,
+                snippet_text TEXT NOT NULL
+            )""",
+        ],
+    ),
+    (
+        2,
+        "lesson indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_contexts_lesson ON contexts (lesson_id)",
+            "CREATE INDEX IF NOT EXISTS idx_conclusions_lesson ON conclusions (lesson_id)",
+            "CREATE INDEX IF NOT EXISTS idx_explanation_steps_lesson_step ON explanation_steps (lesson_id, step_num)",
+            "CREATE INDEX IF NOT EXISTS idx_step_snippets_lesson_step_snippet ON step_snippets (lesson_id, step_num, snippet_num)",
+            "CREATE INDEX IF NOT EXISTS idx_tts_steps_lesson_step ON tts_steps (lesson_id, step_num)",
+            "CREATE INDEX IF NOT EXISTS idx_context_snippets_lesson_snippet ON context_snippets (lesson_id, snippet_num)",
+            "CREATE INDEX IF NOT EXISTS idx_conclusion_snippets_lesson_snippet ON conclusion_snippets (lesson_id, snippet_num)",
+        ],
+    ),
+    (
+        3,
+        "lesson summaries for the voicebot context",
+        [
+            # written by scripts.lesson_summaries; part is "context" (step_num -1) or "step"
+            """CREATE TABLE IF NOT EXISTS lesson_summaries (
+                lesson_id INTEGER NOT NULL REFERENCES lessons(ID),
+                part TEXT NOT NULL,
+                step_num INTEGER NOT NULL,
+                summary_text TEXT NOT NULL,
+                summary_tokens INTEGER NOT NULL,
+                source_tokens INTEGER NOT NULL,
+                source_hash TEXT NOT NULL
+            )""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_lesson_summaries_lesson_part_step ON lesson_summaries (lesson_id, part, step_num)",
+        ],
+    ),
+    (
+        4,
+        "session analytics events",
+        [
+            # written in batches by services.analytics; data is a json object,
+            # session_id is null for events recorded outside a client session
+            """CREATE TABLE IF NOT EXISTS session_events (
+                session_id TEXT,
+                lesson_id INTEGER,
+                kind TEXT NOT NULL,
+                ts REAL NOT NULL,
+                data TEXT NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_session_events_ts ON session_events (ts)",
+            "CREATE INDEX IF NOT EXISTS idx_session_events_session ON session_events (session_id)",
+        ],
+    ),
+]
+
+
+def _rows(conn, sql: str, args: tuple = ()) -> list:
+    """Runs a statement on a sqlite3 connection or a sync libsql_client client."""
+    result = conn.execute(sql, args)
+    if hasattr(result, "rows"):  # libsql_client ResultSet
+        return list(result.rows)
+    return result.fetchall()
+
+
+def apply_migrations(conn) -> list:
+    """Applies every migration that hasn't been applied yet.
+
+    Args:
+        conn: A sqlite3 connection or a sync `libsql_client` client.
+
+    Returns:
+        list: The versions that were applied.
+    """
+    _rows(
+        conn,
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""",
+    )
+    applied = {row[0] for row in _rows(conn, "SELECT version FROM schema_migrations")}
+
+    newly_applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        for statement in statements:
+            _rows(conn, statement)
+        _rows(
+            conn,
+            "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+            (version, description),
+        )
+        newly_applied.append(version)
+
+    if hasattr(conn, "commit"):
+        conn.commit()
+    return newly_applied
+
+
+def check_query_plans(conn: sqlite3.Connection) -> tuple:
+    """Runs EXPLAIN QUERY PLAN on every lesson query.
+
+    Args:
+        conn(sqlite3.Connection): Connection to a migrated sqlite database.
+
+    Returns:
+        tuple: (failures, warnings). A full table scan is a failure, a temporary
+            b-tree for sorting is a warning.
+    """
+    failures, warnings = [], []
+    for name, sql in LESSON_QUERIES.items():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", (1,)).fetchall():
+            detail = row[-1]
+            if detail.startswith("SCAN"):
+                failures.append(f"{name}: {detail}")
+            elif "TEMP B-TREE" in detail:
+                warnings.append(f"{name}: {detail}")
+    return failures, warnings
+
+
+def local_copy(path: str = None) -> sqlite3.Connection:
+    """In-memory copy of a sqlite file (or an empty db) with all migrations applied."""
+    conn = sqlite3.connect(":memory:")
+    if path:
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        source.backup(conn)
+        source.close()
+    apply_migrations(conn)
+    conn.execute("ANALYZE")
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["migrate", "check"])
+    parser.add_argument("--sqlite", help="path to a local sqlite file")
+    parser.add_argument("--turso", action="store_true", help="migrate the Turso database")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        if args.turso:
+            from libsql_client import create_client_sync
+
+            conn = create_client_sync(
+                url=os.environ.get("TURSO_EXPLANATION_DB_URL"),
+                auth_token=os.environ.get("TURSO_EXPLANATION_DB_TOKEN"),
+            )
+        elif args.sqlite:
+            conn = sqlite3.connect(args.sqlite)
+        else:
+            parser.error("migrate needs --sqlite or --turso")
+
+        print(f"Applied migrations: {apply_migrations(conn) or 'none'}")
+        conn.close()
+        return
+
+    failures, warnings = check_query_plans(local_copy(args.sqlite))
+    for warning in warnings:
+        print(f"WARNING {warning}")
+    for failure in failures:
+        print(f"FULL SCAN {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"All {len(LESSON_QUERIES)} lesson queries use indexes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# Queries used to load a lesson. Kept in one place so the query-plan check in
+# `Database.migrations` runs exactly what the route runs.
+
+LESSON_NAME = "SELECT name FROM lessons WHERE ID=?"
+CONCLUSION = "SELECT conclusion_text FROM conclusions WHERE lesson_id=?"
+CONTEXT = "SELECT context_text FROM contexts WHERE lesson_id=?"
+EXPLANATION_STEPS = """SELECT step_num,step_text FROM explanation_steps
+                        WHERE lesson_id=? ORDER BY step_num ASC"""
+STEP_SNIPPETS = """SELECT step_num, snippet_num, snippet_text FROM step_snippets
+                    WHERE lesson_id=? ORDER BY step_num ASC, snippet_num ASC"""
+TTS_STEPS = """SELECT step_num,tts_text FROM tts_steps
+                WHERE lesson_id=? ORDER BY step_num ASC"""
+CONTEXT_SNIPPETS = """SELECT snippet_text,snippet_num FROM context_snippets
+                       WHERE lesson_id=? ORDER BY snippet_num ASC"""
+CONCLUSION_SNIPPETS = """SELECT snippet_text,snippet_num FROM conclusion_snippets
+                          WHERE lesson_id=? ORDER BY snippet_num ASC"""
+SUMMARIES = """SELECT part, step_num, summary_text, summary_tokens, source_hash
+                FROM lesson_summaries WHERE lesson_id=?"""
+
+LESSON_QUERIES = {
+    "lesson_name": LESSON_NAME,
+    "conclusion": CONCLUSION,
+    "context": CONTEXT,
+    "explanation_steps": EXPLANATION_STEPS,
+    "step_snippets": STEP_SNIPPETS,
+    "tts_steps": TTS_STEPS,
+    "context_snippets": CONTEXT_SNIPPETS,
+    "conclusion_snippets": CONCLUSION_SNIPPETS,
+    "summaries": SUMMARIES,
+}
@@ -0,0 +1,169 @@
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import logger
+from metrics import REPLICA_LAG_SECONDS
+
+
+class ReplicaResultSet:
+    """Mimics the `libsql_client` ResultSet the routes use (`.rows`, `rs[0][0]`)."""
+
+    def __init__(self, columns: tuple, rows: list):
+        self.columns = columns
+        self.rows = rows
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class EmbeddedReplica:
+    """Serves reads from a local SQLite replica that is synced from the primary.
+
+    The primary is either Turso (synced with libsql's embedded replica support) or,
+    for local development and tests, a plain SQLite file that is copied over with
+    the sqlite backup API. All access to the local connection runs on one dedicated
+    thread, so syncs and reads never overlap.
+
+    Args:
+        replica_path(str): Where to keep the local replica file.
+        sync_interval(float): Seconds between background syncs.
+        sync_url(str): Turso database url (libsql mode).
+        auth_token(str): Turso auth token (libsql mode).
+        primary_path(str): SQLite file acting as the primary (file mode).
+        on_synced(Callable): Called on the event loop after every successful sync
+            but the first, e.g. to drop caches built from the previous content.
+    """
+
+    def __init__(
+        self,
+        replica_path: str,
+        sync_interval: float = 60,
+        sync_url: str = None,
+        auth_token: str = None,
+        primary_path: str = None,
+        on_synced=None,
+    ):
+        if not sync_url and not primary_path:
+            raise ValueError("Either sync_url or primary_path is required for a replica")
+
+        self.replica_path = replica_path
+        self.sync_interval = sync_interval
+        self.sync_url = sync_url
+        self.auth_token = auth_token
+        self.primary_path = primary_path
+        self.on_synced = on_synced
+
+        self.last_sync: float = None  # monotonic time of the last successful sync
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-replica")
+        self._sync_task: asyncio.Task = None
+        self._sync_requested: asyncio.Event = None
+        self._started: asyncio.Future = None
+
+    # --- runs on the replica thread ---
+    def _connect(self):
+        if self.primary_path:
+            self._conn = sqlite3.connect(self.replica_path, check_same_thread=False)
+        else:
+            import libsql
+
+            self._conn = libsql.connect(
+                self.replica_path, sync_url=self.sync_url, auth_token=self.auth_token
+            )
+
+    def _sync(self):
+        if self._conn is None:
+            self._connect()
+
+        if self.primary_path:
+            primary = sqlite3.connect(f"file:{self.primary_path}?mode=ro", uri=True)
+            try:
+                primary.backup(self._conn)
+            finally:
+                primary.close()
+        else:
+            self._conn.sync()
+
+        self.last_sync = time.monotonic()
+
+    def _query(self, sql: str, args: tuple) -> ReplicaResultSet:
+        cursor = self._conn.execute(sql, args)
+        columns = tuple(d[0] for d in cursor.description or ())
+        return ReplicaResultSet(columns, cursor.fetchall())
+
+    # --- runs on the event loop ---
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._sync_requested.wait(), timeout=self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._sync_requested.clear()
+
+            start = time.perf_counter()
+            try:
+                await self._run(self._sync)
+                logger.info(f"Replica synced in {time.perf_counter() - start:.3f}s")
+            except Exception as e:
+                logger.error(f"Replica sync failed (lag {self.lag_seconds():.1f}s): {e}")
+            else:
+                self._synced()
+            REPLICA_LAG_SECONDS.set(self.lag_seconds())
+
+    async def _ensure_started(self):
+        if self._started is None:
+            self._started = asyncio.get_running_loop().create_future()
+            try:
+                await self._run(self._sync)  # first sync before serving any reads
+                REPLICA_LAG_SECONDS.set(self.lag_seconds())
+                self._sync_requested = asyncio.Event()
+                self._sync_task = asyncio.create_task(self._sync_loop())
+                self._started.set_result(True)
+            except Exception as e:
+                self._started.set_exception(e)
+                self._started = None
+                raise
+        else:
+            await asyncio.shield(self._started)
+
+    async def execute(self, sql: str, args: tuple = ()) -> ReplicaResultSet:
+        """Runs a read query against the local replica."""
+        await self._ensure_started()
+        return await self._run(self._query, sql, tuple(args))
+
+    def _synced(self):
+        if self.on_synced is None:
+            return
+        try:
+            self.on_synced()
+        except Exception as e:
+            logger.error(f"Replica on_synced callback failed: {e!r}")
+
+    def invalidate(self):
+        """Requests an immediate sync, e.g. after lesson content was published."""
+        if self._sync_requested is not None:
+            self._sync_requested.set()
+
+    def lag_seconds(self) -> float:
+        """Seconds since the replica last synced successfully (inf before the first sync)."""
+        if self.last_sync is None:
+            return float("inf")
+        return time.monotonic() - self.last_sync
+
+    async def close(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
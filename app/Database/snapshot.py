@@ -0,0 +1,168 @@
+"""Compiled lesson snapshots: serve lessons with no database at all.
+
+Usage:
+    cd app
+    python -m Database.snapshot export --out lessons.snap                 # from Turso
+    python -m Database.snapshot export --out lessons.snap --sqlite l.db   # from a sqlite file
+    python -m Database.snapshot info lessons.snap
+
+File layout (little endian):
+    header  magic b"LSNP" | u16 format version | u32 lesson count | u64 created (unix s)
+    index   count x (u32 concept_id | u64 offset | u32 length), sorted by concept_id
+    blobs   zlib compressed json, one per lesson
+
+Workers memory-map the file and only decompress a lesson when it's requested.
+"""
+
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import asyncio
+import argparse
+
+MAGIC = b"LSNP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHIQ")
+INDEX_ENTRY = struct.Struct("<IQI")
+
+
+def _encode_lesson(lesson: dict) -> bytes:
+    data = dict(lesson)
+    # json keys must be strings, keep steps as ordered [step_num, step] pairs instead
+    data["explanation_steps"] = sorted(lesson["explanation_steps"].items())
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _decode_lesson(blob: bytes) -> dict:
+    data = json.loads(zlib.decompress(blob))
+    data["explanation_steps"] = {int(num): step for num, step in data["explanation_steps"]}
+    return data
+
+
+def write_snapshot(path: str, lessons: dict) -> None:
+    """Writes lessons to a snapshot file.
+
+    Args:
+        path(str): Output file, written atomically.
+        lessons(dict): concept_id -> lesson dict as returned by `load_lesson`, plus
+            a "diagram_keys" list and "diagram_sizes" (key -> bytes).
+    """
+    blobs = [(concept_id, _encode_lesson(lesson)) for concept_id, lesson in sorted(lessons.items())]
+
+    offset = HEADER.size + INDEX_ENTRY.size * len(blobs)
+    index = []
+    for concept_id, blob in blobs:
+        index.append(INDEX_ENTRY.pack(concept_id, offset, len(blob)))
+        offset += len(blob)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(blobs), int(time.time())))
+        file.write(b"".join(index))
+        for _, blob in blobs:
+            file.write(blob)
+    os.replace(tmp_path, path)
+
+
+class LessonSnapshot:
+    """Read-only, memory-mapped view of a snapshot file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, created = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lesson snapshot")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} (expected {FORMAT_VERSION})")
+
+        self.created = created
+        self._index = {}
+        for i in range(count):
+            concept_id, offset, length = INDEX_ENTRY.unpack_from(
+                self._mmap, HEADER.size + i * INDEX_ENTRY.size
+            )
+            self._index[concept_id] = (offset, length)
+
+    def __contains__(self, concept_id: int) -> bool:
+        return concept_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, concept_id: int) -> dict:
+        """Returns a lesson, raising KeyError if the snapshot doesn't have it."""
+        offset, length = self._index[concept_id]
+        return _decode_lesson(self._mmap[offset : offset + length])
+
+    def close(self):
+        self._mmap.close()
+
+
+async def export_lessons(db, with_diagrams: bool = True) -> dict:
+    """Loads every lesson (and its diagram keys) from the database."""
+    from .lessons import load_lesson, list_diagram_objects
+
+    lessons = {}
+    for (concept_id,) in (await db.execute("SELECT ID FROM lessons ORDER BY ID")).rows:
+        lesson = await load_lesson(db, concept_id)
+        lesson["diagram_sizes"] = (
+            await asyncio.to_thread(list_diagram_objects, concept_id) if with_diagrams else {}
+        )
+        lesson["diagram_keys"] = list(lesson["diagram_sizes"])
+        lessons[concept_id] = lesson
+    return lessons
+
+
+async def _export(args):
+    if args.sqlite:
+        from .replica import EmbeddedReplica
+
+        replica_path = f"{args.sqlite}.export"
+        db = EmbeddedReplica(replica_path, primary_path=args.sqlite)
+    else:
+        from libsql_client import create_client
+
+        db = create_client(
+            url=os.environ.get("TURSO_EXPLANATION_DB_URL"),
+            auth_token=os.environ.get("TURSO_EXPLANATION_DB_TOKEN"),
+        )
+    try:
+        lessons = await export_lessons(db, with_diagrams=not args.no_diagrams)
+    finally:
+        await db.close()
+        if args.sqlite and os.path.exists(replica_path):
+            os.remove(replica_path)
+
+    write_snapshot(args.out, lessons)
+    print(f"Wrote {len(lessons)} lessons to {args.out} ({os.path.getsize(args.out)} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export")
+    export.add_argument("--out", required=True)
+    export.add_argument("--sqlite", help="read lessons from a sqlite file instead of Turso")
+    export.add_argument("--no-diagrams", action="store_true", help="skip listing object storage")
+    info = sub.add_parser("info")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        asyncio.run(_export(args))
+    else:
+        snapshot = LessonSnapshot(args.path)
+        print(
+            f"{args.path}: format v{FORMAT_VERSION}, {len(snapshot)} lessons, "
+            f"created {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(snapshot.created))} UTC"
+        )
+
+
+if __name__ == "__main__":
+    main()
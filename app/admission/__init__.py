@@ -0,0 +1,3 @@
+from .limiter import (admission, AdmissionController, ServerBusy,
+                      HIGH, NORMAL, LOW, TTS_RESOURCES, REALTIME_RESOURCES,
+                      CODEGEN_RESOURCES, ADMISSION_CONTROL)
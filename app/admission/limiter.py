@@ -0,0 +1,332 @@
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+
+from redis.exceptions import RedisError
+
+from utils import logger, lazy_singleton
+from metrics import ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+
+REDIS_ENDPOINT = os.environ.get("REDIS_ENDPOINT")
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1" if REDIS_ENDPOINT else "0") == "1"
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 10))  # seconds queued before "server busy"
+ADMISSION_RETRY_AFTER = float(os.environ.get("ADMISSION_RETRY_AFTER", 15))  # suggested when slots are full
+ADMISSION_LEASE_TTL = 30  # seconds a lease outlives a crashed holder
+# a Redis that stops answering fails open after this many seconds instead of holding every request
+ADMISSION_REDIS_TIMEOUT = float(os.environ.get("ADMISSION_REDIS_TIMEOUT", 0.5))
+ADMISSION_POLL_INTERVAL = 0.25
+ADMISSION_KEY_PREFIX = "admission"
+
+# priorities: lower ones can't use the capacity reserved for the ones above them
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# concurrency: leases held at once (0 = unlimited); rate/burst: token bucket of
+# acquisitions per second (rate 0 = unlimited); reserve: fraction of the capacity
+# every priority step down gives up. Override with ADMISSION_LIMITS (JSON, same shape).
+DEFAULT_LIMITS = {
+    "openai": {"concurrency": 200, "rate": 50, "burst": 100, "reserve": 0.1},
+    "openai:tts": {"concurrency": 100, "rate": 20, "burst": 40, "reserve": 0.1},
+    "openai:realtime": {"concurrency": 50, "rate": 5, "burst": 10, "reserve": 0.1},
+    "gemini": {"concurrency": 100, "rate": 20, "burst": 40, "reserve": 0.1},
+    "gemini:live": {"concurrency": 50, "rate": 5, "burst": 10, "reserve": 0.1},
+    "gemini:codegen": {"concurrency": 32, "rate": 5, "burst": 10, "reserve": 0.1},
+}
+
+# what each caller acquires: the provider-wide limit and the model's own
+TTS_RESOURCES = ("openai", "openai:tts")
+REALTIME_RESOURCES = {
+    "openai": ("openai", "openai:realtime"),
+    "gemini": ("gemini", "gemini:live"),
+}
+CODEGEN_RESOURCES = ("gemini", "gemini:codegen")
+
+# KEYS: (leases zset, bucket hash) per resource
+# ARGV: lease id, lease ttl, priority, then (concurrency, rate, burst, reserve) per resource
+# Returns {1, "0"} when admitted, else {0, seconds until a token is due ("-1" when slots are full)}.
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local lease, ttl, priority = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS / 2 do
+  local leases, bucket = KEYS[2 * i - 1], KEYS[2 * i]
+  local base = 3 + (i - 1) * 4
+  local cap, rate = tonumber(ARGV[base + 1]), tonumber(ARGV[base + 2])
+  local burst, reserve = tonumber(ARGV[base + 3]), tonumber(ARGV[base + 4])
+
+  redis.call('ZREMRANGEBYSCORE', leases, '-inf', now)
+  if cap > 0 then
+    local allowed = math.max(1, math.floor(cap * (1 - reserve * priority)))
+    if redis.call('ZCARD', leases) >= allowed then
+      return {0, '-1'}
+    end
+  end
+  if rate > 0 then
+    local state = redis.call('HMGET', bucket, 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local last = tonumber(state[2]) or now
+    available = math.min(burst, available + math.max(0, now - last) * rate)
+    local need = math.min(burst, 1 + burst * reserve * priority)
+    if available < need then
+      wait = math.max(wait, (need - available) / rate)
+    end
+    tokens[i] = available
+  end
+end
+if wait > 0 then
+  return {0, tostring(wait)}
+end
+for i = 1, #KEYS / 2 do
+  local leases, bucket = KEYS[2 * i - 1], KEYS[2 * i]
+  if tokens[i] then
+    redis.call('HSET', bucket, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', bucket, 3600)
+  end
+  redis.call('ZADD', leases, now + ttl, lease)
+  redis.call('EXPIRE', leases, math.ceil(ttl) * 2)
+end
+return {1, '0'}
+"""
+
+# KEYS: leases zsets; ARGV: lease id, lease ttl
+RENEW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+for i = 1, #KEYS do
+  redis.call('ZADD', KEYS[i], 'XX', now + tonumber(ARGV[2]), ARGV[1])
+  redis.call('EXPIRE', KEYS[i], math.ceil(tonumber(ARGV[2])) * 2)
+end
+return 1
+"""
+
+
+class ServerBusy(Exception):
+    """Raised when a request waited `max_wait` seconds without being admitted.
+
+    Args:
+        resources(tuple): The resources that were at capacity.
+        retry_after(float): Suggested seconds before retrying.
+    """
+
+    def __init__(self, resources: tuple, retry_after: float):
+        self.resources = tuple(resources)
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{', '.join(self.resources)} at capacity, retry in {self.retry_after} s")
+
+    def to_client(self) -> dict:
+        """The message sent to the client instead of the response it asked for."""
+        return {
+            "type": "SERVER_BUSY",
+            "status": "busy",
+            "retry_after": self.retry_after,
+            "message": f"The server is busy, please retry in {self.retry_after} s",
+        }
+
+
+@lazy_singleton
+def get_async_redis():
+    import redis.asyncio
+
+    return redis.asyncio.Redis.from_url(
+        REDIS_ENDPOINT, socket_timeout=ADMISSION_REDIS_TIMEOUT, socket_connect_timeout=ADMISSION_REDIS_TIMEOUT
+    )
+
+
+@lazy_singleton
+def get_sync_redis():
+    import redis
+
+    return redis.Redis.from_url(
+        REDIS_ENDPOINT, socket_timeout=ADMISSION_REDIS_TIMEOUT, socket_connect_timeout=ADMISSION_REDIS_TIMEOUT
+    )
+
+
+class AdmissionController:
+    """Token bucket + concurrency caps per provider/model, shared by every process through Redis.
+
+    A request acquires a list of resources (e.g. the provider and the model) at once:
+    it is admitted only when all of them have a free slot and a token, and holds a
+    lease on each until it's done. Leases expire after `ADMISSION_LEASE_TTL` seconds
+    unless renewed, so a crashed worker doesn't hold its slots forever; async holders
+    renew theirs in the background. Requests that aren't admitted wait (polling, up to
+    `max_wait`) and then get `ServerBusy`. Lower priorities can't use the last
+    `reserve * priority` share of a resource, which is what lets narration of a
+    running lesson through while new voicebot sessions are turned away.
+
+    If Redis can't be reached, or doesn't answer within `ADMISSION_REDIS_TIMEOUT`,
+    requests are let through: the limiter must not be the reason the service is down.
+
+    Args:
+        limits(dict): resource -> {"concurrency", "rate", "burst", "reserve"}.
+        enabled(bool): When False every acquire is admitted right away.
+        key_prefix(str): Prefix of the Redis keys.
+    """
+
+    def __init__(
+        self,
+        limits: dict = None,
+        enabled: bool = ADMISSION_CONTROL,
+        key_prefix: str = ADMISSION_KEY_PREFIX,
+    ):
+        if limits is None:
+            limits = {**DEFAULT_LIMITS, **json.loads(os.environ.get("ADMISSION_LIMITS", "{}"))}
+        self.limits = limits
+        self.enabled = enabled
+        self.key_prefix = key_prefix
+        self._scripts = {}
+
+    # --- redis ---
+    def _script(self, client, name: str):
+        key = (id(client), name)
+        if key not in self._scripts:
+            self._scripts[key] = client.register_script(ACQUIRE_SCRIPT if name == "acquire" else RENEW_SCRIPT)
+        return self._scripts[key]
+
+    def _keys(self, resources: tuple) -> tuple:
+        """(acquire keys, lease keys, per resource args) of the limited resources."""
+        keys, lease_keys, args = [], [], []
+        for resource in resources:
+            limit = self.limits.get(resource)
+            if not limit:
+                continue
+            lease_key = f"{self.key_prefix}:{resource}:leases"
+            keys += [lease_key, f"{self.key_prefix}:{resource}:bucket"]
+            lease_keys.append(lease_key)
+            args += [
+                limit.get("concurrency", 0),
+                limit.get("rate", 0),
+                limit.get("burst", max(1, limit.get("rate", 0))),
+                limit.get("reserve", 0),
+            ]
+        return keys, lease_keys, args
+
+    # --- waiting ---
+    def _next_delay(self, resources: tuple, priority: int, result, start: float, max_wait: float):
+        """None once admitted, else seconds to wait before trying again. Raises ServerBusy."""
+        labels = (resources[-1], PRIORITY_NAMES[priority])
+        admitted, hint = int(result[0]), float(result[1])
+        waited = time.monotonic() - start
+        if admitted:
+            ADMISSION_WAIT_SECONDS.labels(*labels, "admitted").observe(waited)
+            return None
+
+        retry = hint if hint > 0 else ADMISSION_POLL_INTERVAL
+        if waited + retry > max_wait:
+            ADMISSION_WAIT_SECONDS.labels(*labels, "busy").observe(waited)
+            ADMISSION_REJECTED.labels(*labels).inc()
+            raise ServerBusy(resources, hint if hint > 0 else ADMISSION_RETRY_AFTER)
+        return retry + random.uniform(0, ADMISSION_POLL_INTERVAL / 2)
+
+    # --- async (web app) ---
+    async def _keepalive(self, lease_keys: list, lease_id: str, ttl: float):
+        client = get_async_redis()
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                await self._script(client, "renew")(keys=lease_keys, args=[lease_id, ttl])
+            except RedisError as e:
+                logger.warning(f"Couldn't renew admission lease {lease_id}: {e}")
+
+    @asynccontextmanager
+    async def acquire(
+        self,
+        resources: tuple,
+        priority: int = NORMAL,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        lease_ttl: float = ADMISSION_LEASE_TTL,
+    ):
+        """Holds a slot of every resource for the duration of the block.
+
+        Args:
+            resources(tuple): Resource names, e.g. TTS_RESOURCES.
+            priority(int): HIGH, NORMAL or LOW.
+            max_wait(float): Seconds to wait for a slot before raising ServerBusy.
+            lease_ttl(float): Seconds a lease lasts without being renewed.
+        """
+        keys, lease_keys, args = self._keys(resources)
+        if not self.enabled or not keys:
+            yield
+            return
+
+        client = get_async_redis()
+        lease_id = uuid.uuid4().hex
+        start = time.monotonic()
+        admitted = False
+        while True:
+            try:
+                result = await self._script(client, "acquire")(keys=keys, args=[lease_id, lease_ttl, priority, *args])
+            except RedisError as e:
+                logger.error(f"Admission control unavailable, letting the request through: {e}")
+                break
+            delay = self._next_delay(resources, priority, result, start, max_wait)
+            if delay is None:
+                admitted = True
+                break
+            await asyncio.sleep(delay)
+
+        keepalive = asyncio.create_task(self._keepalive(lease_keys, lease_id, lease_ttl)) if admitted else None
+        try:
+            yield
+        finally:
+            if keepalive is not None:
+                keepalive.cancel()
+                try:
+                    pipe = client.pipeline()
+                    for key in lease_keys:
+                        pipe.zrem(key, lease_id)
+                    await pipe.execute()
+                except RedisError as e:
+                    logger.warning(f"Couldn't release admission lease {lease_id}, it expires in {lease_ttl}s: {e}")
+
+    # --- sync (celery workers) ---
+    @contextmanager
+    def acquire_sync(
+        self,
+        resources: tuple,
+        priority: int = NORMAL,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        lease_ttl: float = ADMISSION_LEASE_TTL,
+    ):
+        """`acquire` for threads. Leases aren't renewed: `lease_ttl` must cover the block."""
+        keys, lease_keys, args = self._keys(resources)
+        if not self.enabled or not keys:
+            yield
+            return
+
+        client = get_sync_redis()
+        lease_id = uuid.uuid4().hex
+        start = time.monotonic()
+        admitted = False
+        while True:
+            try:
+                result = self._script(client, "acquire")(keys=keys, args=[lease_id, lease_ttl, priority, *args])
+            except RedisError as e:
+                logger.error(f"Admission control unavailable, letting the request through: {e}")
+                break
+            delay = self._next_delay(resources, priority, result, start, max_wait)
+            if delay is None:
+                admitted = True
+                break
+            time.sleep(delay)
+
+        try:
+            yield
+        finally:
+            if admitted:
+                try:
+                    pipe = client.pipeline()
+                    for key in lease_keys:
+                        pipe.zrem(key, lease_id)
+                    pipe.execute()
+                except RedisError as e:
+                    logger.warning(f"Couldn't release admission lease {lease_id}, it expires in {lease_ttl}s: {e}")
+
+
+admission = AdmissionController()
@@ -1 +1 @@
-from .celery_tasks import generate_diagram, celery_
\ No newline at end of file
+from .app import celery_, generate_diagram
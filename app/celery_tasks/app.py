@@ -0,0 +1,56 @@
+import os
+from celery import Celery
+from celery.signals import worker_init
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_ENDPOINT = os.environ.get("REDIS_ENDPOINT")
+CELERY_METRICS_PORT = int(os.environ.get("CELERY_METRICS_PORT", 9100))
+
+# The web app only sends tasks and reads results, so it imports this module alone.
+# Workers load the task code (sandbox, genai, boto3) through `include`.
+celery_ = Celery(
+    "worker",
+    broker=REDIS_ENDPOINT,
+    backend=REDIS_ENDPOINT,
+    include=["celery_tasks.celery_tasks"],
+)
+celery_.conf.task_always_eager = False
+
+
+@worker_init.connect
+def serve_worker_metrics(**kwargs):
+    from metrics import start_metrics_server
+
+    start_metrics_server(CELERY_METRICS_PORT)
+
+
+class TaskHandle:
+    """Sends a registered task by name, without importing the module that defines it.
+
+    Args:
+        app(Celery): The celery app.
+        name(str): Registered task name.
+    """
+
+    def __init__(self, app: Celery, name: str):
+        self.app = app
+        self.name = name
+
+    def delay(self, *args, **kwargs):
+        return self.app.send_task(self.name, args=args, kwargs=kwargs)
+
+    def apply_async(self, args: tuple = (), kwargs: dict = None, **options):
+        return self.app.send_task(self.name, args=args, kwargs=kwargs, **options)
+
+    def revoke(self, task_ids: list):
+        """Revokes tasks with one broadcast: queued ones are dropped, running ones
+        see it in the worker state (the threads pool can't terminate them)."""
+        self.app.control.revoke(task_ids)
+
+    def AsyncResult(self, task_id: str):
+        return self.app.AsyncResult(task_id)
+
+
+generate_diagram = TaskHandle(celery_, "celery_tasks.celery_tasks.generate_diagram")
@@ -3,22 +3,24 @@ import io
 import time
 import random
 import base64
-from e2b_code_interpreter import Sandbox
-from celery import Celery
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from llm.prompts import PromptManager
-from llm.clients import google_client
-from utils import parse_code, s3_client
+from celery.worker import state as worker_state
 
-load_dotenv()
+from llm.registry import registry
+from utils import (parse_code, get_s3_client, logger, validate_code,
+                   CodeValidationError, validation_stats, diagram_variants,
+                   CONTENT_TYPES, DIAGRAM_DPI)
+from metrics import (DIAGRAM_STAGE_SECONDS, DIAGRAM_CODE_REJECTED,
+                     DIAGRAM_TASKS_ABORTED, DIAGRAM_SANDBOX_CLEANUP)
+from admission import ServerBusy
+from .app import celery_
+from .codegen import generate_code, hedge_stats
 
-REDIS_ENDPOINT = os.environ.get("REDIS_ENDPOINT")
 S3_BUCKET = "explanation-dev"
-
-celery_ = Celery("worker", broker=REDIS_ENDPOINT, backend=REDIS_ENDPOINT)
-celery_.conf.task_always_eager = False
-
+MAX_CODEGEN_ATTEMPTS = int(os.environ.get("MAX_CODEGEN_ATTEMPTS", 3))
+# sandbox lifetime, in case the worker dies before killing it
+DIAGRAM_SANDBOX_TIMEOUT = int(os.environ.get("DIAGRAM_SANDBOX_TIMEOUT", 120))
 
 CODE = """
 import matplotlib
@@ -69,47 +71,169 @@ plt.savefig("./9830.png", bbox_inches='tight', dpi=300)
 plt.close(fig)"""
 
 
-@celery_.task
-def generate_diagram(prompt: str) -> dict:
-    try:
-        pm = PromptManager(type_="CODER")
-        system_prompt = pm.get_sys_prompt(version="1.0")
+class DiagramCancelled(Exception):
+    """The task was revoked because the voice session that asked for it ended."""
 
-        diag_name = random.randint(0, 10000) + random.randint(99, 1000)
-        s3_path = f"temp/diagrams/fig_{diag_name}.png"
-
-        response = google_client.models.generate_content(
-            model="gemini-3-pro-preview",
-            contents=prompt + f"\n Figure_name: fig_{diag_name}",
-            config={"system_instruction": system_prompt},
-        )
-        generated_code = response.text
-        parsed_code = "import matplotlib\nmatplotlib.use('Agg')\n" + parse_code(
-            generated_code=generated_code
-        )
-
-        sbx = Sandbox.create(template="diag-gen", allow_internet_access=False)
-        execution = sbx.run_code(code=parsed_code, language="python")
 
-        content = sbx.files.read(f"/home/user/fig_{diag_name}.png", format="bytes")
-        buffer = io.BytesIO(content)
-        buffer.seek(0)
+def raise_if_revoked(task_id: str, stage: str) -> None:
+    """Stops a revoked task before its next stage.
+
+    The worker runs the threads pool, which can't terminate a running task, but the
+    revoke broadcast lands in this process' worker state.
+    """
+    if task_id in worker_state.revoked:
+        DIAGRAM_TASKS_ABORTED.labels(stage).inc()
+        raise DiagramCancelled(f"Task {task_id} revoked before {stage}")
 
-        s3_client.upload_fileobj(
-            buffer,
-            Bucket=S3_BUCKET,
-            Key=s3_path,
-            ExtraArgs={"ContentType": "image/png"},
-        )
 
-        presigned_url = s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": S3_BUCKET, "Key": s3_path},
-            ExpiresIn=30,
-        )
+def kill_sandbox(sbx) -> None:
+    try:
+        sbx.kill()
+        DIAGRAM_SANDBOX_CLEANUP.labels("killed").inc()
+    except Exception as e:
+        DIAGRAM_SANDBOX_CLEANUP.labels("failed").inc()
+        logger.warning(f"Couldn't kill sandbox {sbx.sandbox_id}, it expires after {DIAGRAM_SANDBOX_TIMEOUT}s: {e}")
+
+
+def upload_diagram_file(sbx, file_name: str, s3_prefix: str) -> tuple:
+    """Copies one rendered file from the sandbox to object storage.
+
+    Returns:
+        tuple: (presigned url, {"bytes": size, "upload_s": seconds})
+    """
+    start = time.perf_counter()
+    content = sbx.files.read(f"/home/user/{file_name}", format="bytes")
+    buffer = io.BytesIO(content)
+    buffer.seek(0)
+
+    s3_path = f"{s3_prefix}{file_name}"
+    s3_client = get_s3_client()
+    s3_client.upload_fileobj(
+        buffer,
+        Bucket=S3_BUCKET,
+        Key=s3_path,
+        ExtraArgs={"ContentType": CONTENT_TYPES[file_name.rsplit(".", 1)[-1]]},
+    )
+
+    presigned_url = s3_client.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={"Bucket": S3_BUCKET, "Key": s3_path},
+        ExpiresIn=30,
+    )
+    return presigned_url, {
+        "bytes": len(content),
+        "upload_s": round(time.perf_counter() - start, 3),
+    }
+
+
+@celery_.task(bind=True)
+def generate_diagram(self, prompt: str) -> dict:
+    task_id = self.request.id
+    sbx = None
+    try:
+        system_prompt = registry.prompt("CODER", version="1.0").text
 
-        print(presigned_url)
-        return {"status": "success", "data": presigned_url}
+        diag_name = random.randint(0, 10000) + random.randint(99, 1000)
+        variants = diagram_variants(f"fig_{diag_name}")
+
+        def validate(generated_code: str) -> str:
+            try:
+                code = validate_code(
+                    parse_code(generated_code=generated_code),
+                    fig_name=f"fig_{diag_name}",
+                    dpi=DIAGRAM_DPI,
+                    extra_outputs=list(variants.values()),
+                )
+            except CodeValidationError:
+                validation_stats.record_validation(passed=False)
+                DIAGRAM_CODE_REJECTED.inc()
+                raise
+            validation_stats.record_validation(passed=True)
+            return code
+
+        # re-prompt straight away when the code can't pass validation instead of
+        # paying for a sandbox run that is bound to fail.
+        contents = prompt + f"\n Figure_name: fig_{diag_name}"
+        for attempt in range(1, MAX_CODEGEN_ATTEMPTS + 1):
+            raise_if_revoked(task_id, "codegen")
+            try:
+                # takes an admission lease per upstream request (hedges included)
+                with DIAGRAM_STAGE_SECONDS.labels("codegen").time():
+                    parsed_code = generate_code(
+                        contents=contents, system_prompt=system_prompt, validate=validate
+                    )
+                break
+            except CodeValidationError as e:
+                logger.warning(f"Generated code rejected (attempt {attempt}): {e}")
+                if attempt == MAX_CODEGEN_ATTEMPTS:
+                    raise
+                contents = (
+                    prompt
+                    + f"\n Figure_name: fig_{diag_name}"
+                    + f"\n Your previous code was rejected: {e}. Fix it and return the full code."
+                )
+        logger.info(f"Codegen hedging stats: {hedge_stats.snapshot()}")
+
+        from e2b_code_interpreter import Sandbox  # slow to import, keep it out of worker boot
+
+        raise_if_revoked(task_id, "sandbox")
+        with DIAGRAM_STAGE_SECONDS.labels("sandbox_create").time():
+            sbx = Sandbox.create(template="diag-gen", allow_internet_access=False, timeout=DIAGRAM_SANDBOX_TIMEOUT)
+        sandbox_start = time.perf_counter()
+        execution = sbx.run_code(code=parsed_code, language="python")
+        sandbox_seconds = time.perf_counter() - sandbox_start
+        validation_stats.record_sandbox_run(sandbox_seconds)
+        DIAGRAM_STAGE_SECONDS.labels("sandbox_run").observe(sandbox_seconds)
+        logger.info(f"Code validation stats: {validation_stats.snapshot()}")
+
+        raise_if_revoked(task_id, "upload")
+
+        # upload every rendered file in parallel; the small preview usually lands
+        # first and is published right away so the client can show it early.
+        upload_start = time.perf_counter()
+        files = {"full": f"fig_{diag_name}.png"}
+        files.update({label: file_name for label, (file_name, _) in variants.items()})
+        urls, metrics = {}, {}
+
+        with ThreadPoolExecutor(max_workers=len(files)) as pool:
+            futures = {
+                pool.submit(upload_diagram_file, sbx, file_name, "temp/diagrams/"): label
+                for label, file_name in files.items()
+            }
+            for future in as_completed(futures):
+                label = futures[future]
+                try:
+                    urls[label], metrics[label] = future.result()
+                except Exception as e:
+                    if label == "full":
+                        raise
+                    logger.warning(f"Couldn't upload {label} variant: {e}")
+                    continue
+
+                if label == "preview":
+                    self.update_state(state="PREVIEW", meta={"preview": urls[label]})
+
+        DIAGRAM_STAGE_SECONDS.labels("upload").observe(time.perf_counter() - upload_start)
+        logger.info(f"Diagram outputs: {metrics}")
+        return {
+            "status": "success",
+            "data": urls.pop("full"),
+            "preview": urls.pop("preview", None),
+            "formats": urls,
+            "metrics": metrics,
+        }
+
+    except DiagramCancelled as e:
+        logger.info(str(e))
+        return {"status": "cancelled", "data": str(e)}
+
+    except ServerBusy as e:
+        return {"status": "error", "data": e.to_client()["message"], "retry_after": e.retry_after}
 
     except Exception as e:
         return {"status": "error", "data": str(e)}
+
+    finally:
+        # the sandbox would otherwise live until its timeout
+        if sbx is not None:
+            kill_sandbox(sbx)
@@ -0,0 +1,325 @@
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+from contextlib import asynccontextmanager, nullcontext
+from typing import Optional, Callable, Awaitable
+
+from llm.clients import get_google_client
+from utils import logger, CodeValidationError
+from metrics import CODEGEN_REQUESTS, CODEGEN_SECONDS
+from admission import admission, ServerBusy, CODEGEN_RESOURCES, NORMAL, LOW
+
+DIAGRAM_CODEGEN_MODE = os.environ.get("DIAGRAM_CODEGEN_MODE", "async")  # "async" | "sync"
+DIAGRAM_CODEGEN_CONCURRENCY = int(os.environ.get("DIAGRAM_CODEGEN_CONCURRENCY", 16))
+DIAGRAM_CODEGEN_TIMEOUT = float(os.environ.get("DIAGRAM_CODEGEN_TIMEOUT", 90))
+# primary model first, then the (faster) backups raced against it
+DIAGRAM_CODEGEN_MODELS = [
+    m.strip()
+    for m in os.environ.get(
+        "DIAGRAM_CODEGEN_MODELS", "gemini-3-pro-preview,gemini-2.5-flash"
+    ).split(",")
+    if m.strip()
+]
+# seconds before a backup model is started; 0 races all models at once, empty disables hedging
+DIAGRAM_HEDGE_DELAY = os.environ.get("DIAGRAM_HEDGE_DELAY", "10")
+# diagrams are generated in the background, they can queue longer than a live request
+DIAGRAM_ADMISSION_WAIT = float(os.environ.get("DIAGRAM_ADMISSION_WAIT", 60))
+
+
+class AsyncCodegenRunner:
+    """Runs code generation on one background event loop per worker process.
+
+    Celery tasks are synchronous, so every task thread submits its request to the
+    shared loop and blocks on the result. All requests share the async Gemini client
+    (and its pooled http connections). Upstream requests are capped by a semaphore
+    (`slot`), so a hedged call holds one slot per model it's waiting on.
+    """
+
+    def __init__(self, max_concurrency: int = DIAGRAM_CODEGEN_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        # prefork children inherit the object but not the thread, so start per pid.
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="codegen-loop", daemon=True).start()
+                ready.wait()
+                self._loop = loop
+                self._pid = os.getpid()
+                logger.info(
+                    f"Started codegen loop (pid={self._pid}, concurrency={self.max_concurrency})"
+                )
+        return self._loop
+
+    def run(self, coro_fn: Callable[[], Awaitable], timeout: float = DIAGRAM_CODEGEN_TIMEOUT):
+        """Runs a coroutine on the shared loop, blocking the calling thread until it's done.
+
+        Args:
+            coro_fn(Callable): Zero-arg callable returning the coroutine to run.
+            timeout(float): Seconds to wait before giving up on the request.
+
+        Returns:
+            The coroutine's result.
+        """
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(coro_fn(), loop)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def slot(self) -> asyncio.Semaphore:
+        """What one upstream request holds while it runs. Only usable on the shared loop."""
+        return self._semaphore
+
+
+class GeminiProvider:
+    """Codegen provider backed by a Gemini model on the shared async client.
+
+    Any object with a `name` and an async `generate(contents, system_prompt)`
+    returning the raw model text can be used as a provider.
+    """
+
+    def __init__(self, model: str, client=None):
+        self.name = model
+        self.client = client
+
+    async def generate(self, contents: str, system_prompt: str) -> str:
+        client = self.client or get_google_client()
+        response = await client.aio.models.generate_content(
+            model=self.name,
+            contents=contents,
+            config={"system_instruction": system_prompt},
+        )
+        return response.text
+
+
+class HedgeStats:
+    """Per-model win rates and latency histograms for tuning the hedging policy.
+
+    Everything recorded also goes to the `codegen_requests` and `codegen_seconds`
+    metrics (the worker's metrics server), which outlive the process and add up across
+    workers; the in-memory copy is what the logs and perf.codegen_load print.
+    """
+
+    BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, float("inf"))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models: dict[str, dict] = {}
+
+    def _model(self, name: str) -> dict:
+        return self.models.setdefault(
+            name,
+            {
+                "launched": 0,
+                "wins": 0,
+                "invalid": 0,
+                "errors": 0,
+                "busy": 0,
+                "latency_buckets": [0] * len(self.BUCKETS),
+            },
+        )
+
+    def record(self, name: str, event: str):
+        CODEGEN_REQUESTS.labels(name, event).inc()
+        with self._lock:
+            self._model(name)[event] += 1
+
+    def record_latency(self, name: str, seconds: float):
+        CODEGEN_SECONDS.labels(name).observe(seconds)
+        with self._lock:
+            buckets = self._model(name)["latency_buckets"]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    **{k: v for k, v in data.items() if k != "latency_buckets"},
+                    "win_rate": round(data["wins"] / data["launched"], 3) if data["launched"] else 0.0,
+                    "latency_le": dict(zip(map(str, self.BUCKETS), data["latency_buckets"])),
+                }
+                for name, data in self.models.items()
+            }
+
+
+class HedgedCodegen:
+    """Races codegen providers and returns the first response that passes validation.
+
+    The primary provider starts immediately; each backup starts once `hedge_delay`
+    seconds pass without a valid response (or right away when the previous response
+    was rejected). `hedge_delay=0` races every provider in parallel, `None` disables
+    hedging. Losing requests are cancelled.
+
+    Every provider request holds its own `slot(hedge)` (`upstream_slot`) while it runs,
+    so a hedged call counts once per model it's waiting on. A backup that gets
+    ServerBusy from its slot is skipped.
+    """
+
+    def __init__(
+        self, providers: list, hedge_delay: Optional[float], stats: HedgeStats = None, slot: Callable = None
+    ):
+        self.providers = providers if hedge_delay is not None else providers[:1]
+        self.hedge_delay = hedge_delay
+        self.stats = stats or HedgeStats()
+        self.slot = slot or (lambda hedge: nullcontext())
+
+    async def _timed(self, provider, contents: str, system_prompt: str) -> str:
+        async with self.slot(provider is not self.providers[0]):
+            start = time.perf_counter()
+            text = await provider.generate(contents, system_prompt)
+        self.stats.record_latency(provider.name, time.perf_counter() - start)
+        return text
+
+    async def generate(
+        self, contents: str, system_prompt: str, validate: Callable[[str], str]
+    ) -> str:
+        """Generates code with hedging.
+
+        Args:
+            contents(str): The user prompt.
+            system_prompt(str): System instruction for the coder.
+            validate(Callable): Turns raw model text into runnable code, raising
+                CodeValidationError when it can't.
+
+        Returns:
+            str: Validated code from the winning provider.
+        """
+        pending: dict[asyncio.Task, object] = {}
+        backups = list(self.providers[1:])
+        last_error: Exception = None
+
+        def launch(provider):
+            self.stats.record(provider.name, "launched")
+            task = asyncio.create_task(self._timed(provider, contents, system_prompt))
+            pending[task] = provider
+
+        launch(self.providers[0])
+        if self.hedge_delay == 0:
+            while backups:
+                launch(backups.pop(0))
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay if backups else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:  # deadline passed, start the next model
+                    launch(backups.pop(0))
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        code = validate(task.result())
+                    except CodeValidationError as e:
+                        self.stats.record(provider.name, "invalid")
+                        last_error = e
+                        continue
+                    except ServerBusy as e:
+                        self.stats.record(provider.name, "busy")
+                        last_error = last_error or e
+                        continue
+                    except Exception as e:
+                        self.stats.record(provider.name, "errors")
+                        logger.warning(f"Codegen provider {provider.name} failed: {e}")
+                        last_error = e
+                        continue
+
+                    self.stats.record(provider.name, "wins")
+                    return code
+
+                if backups and not pending:
+                    launch(backups.pop(0))
+
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def _parse_hedge_delay(value: str) -> Optional[float]:
+    return float(value) if value.strip() else None
+
+
+codegen_runner = AsyncCodegenRunner()
+
+
+@asynccontextmanager
+async def upstream_slot(hedge: bool):
+    """What one upstream codegen request holds: a slot of this worker's semaphore and
+    an admission lease on the shared Gemini limits. Backups don't queue for a lease
+    and can't use the capacity kept for the primary requests.
+
+    Args:
+        hedge(bool): The request is a backup raced against the primary model.
+    """
+    async with codegen_runner.slot(), admission.acquire(
+        CODEGEN_RESOURCES,
+        priority=LOW if hedge else NORMAL,
+        max_wait=0 if hedge else DIAGRAM_ADMISSION_WAIT,
+    ):
+        yield
+
+
+hedge_stats = HedgeStats()
+hedged_codegen = HedgedCodegen(
+    providers=[GeminiProvider(model) for model in DIAGRAM_CODEGEN_MODELS],
+    hedge_delay=_parse_hedge_delay(DIAGRAM_HEDGE_DELAY),
+    stats=hedge_stats,
+    slot=upstream_slot,
+)
+
+
+def generate_code(contents: str, system_prompt: str, validate: Callable[[str], str]) -> str:
+    """Generates and validates diagram code using the configured codegen mode.
+
+    Args:
+        contents(str): The user prompt.
+        system_prompt(str): System instruction for the coder.
+        validate(Callable): Turns raw model text into runnable code, raising
+            CodeValidationError when it can't.
+
+    Returns:
+        str: Validated code.
+
+    Raises:
+        ServerBusy: No admission slot within DIAGRAM_ADMISSION_WAIT.
+    """
+    if DIAGRAM_CODEGEN_MODE == "async":
+        return codegen_runner.run(
+            lambda: hedged_codegen.generate(contents, system_prompt, validate),
+            timeout=DIAGRAM_CODEGEN_TIMEOUT + DIAGRAM_ADMISSION_WAIT,
+        )
+
+    with admission.acquire_sync(
+        CODEGEN_RESOURCES, max_wait=DIAGRAM_ADMISSION_WAIT, lease_ttl=DIAGRAM_CODEGEN_TIMEOUT + 30
+    ):
+        response = get_google_client().models.generate_content(
+            model=DIAGRAM_CODEGEN_MODELS[0],
+            contents=contents,
+            config={"system_instruction": system_prompt},
+        )
+    return validate(response.text)
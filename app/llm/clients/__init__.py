@@ -1 +1 @@
-from .client import async_openai_client, google_client
+from .client import get_openai_client, get_google_client
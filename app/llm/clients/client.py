@@ -1,9 +1,39 @@
 import os
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from google.genai import Client
+
+from utils import lazy_singleton
 
 load_dotenv()
 
-async_openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-google_client = Client()
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL")  # point at a fake endpoint for load tests
+GEMINI_MAX_CONNECTIONS = int(os.environ.get("GEMINI_MAX_CONNECTIONS", 32))
+
+# The SDKs are slow to import and nothing needs them at boot, so the clients are
+# created (once per process) on first use.
+
+
+@lazy_singleton
+def get_openai_client():
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+
+@lazy_singleton
+def get_google_client():
+    import httpx
+    from google.genai import Client
+
+    # one pooled (keep-alive) http client per process, shared by every codegen call
+    gemini_http_options = {
+        "async_client_args": {
+            "limits": httpx.Limits(
+                max_connections=GEMINI_MAX_CONNECTIONS,
+                max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+            )
+        }
+    }
+    if GEMINI_BASE_URL:
+        gemini_http_options["base_url"] = GEMINI_BASE_URL
+
+    return Client(http_options=gemini_http_options)
@@ -1,12 +1,17 @@
-import json
 from typing import Literal, Any
 
+from llm.registry import registry
+
 
 class ConfigManager:
+    """A provider's realtime session config, served from the process-wide registry.
+
+    The voice bridges use `registry.session_config(provider).render(prompt)` instead,
+    which doesn't copy the config per session.
+    """
+
     def __init__(self, provider: Literal["gemini", "openai"]):
-        path = f"llm/config/{provider}_config.json"
-        with open(path, "r", encoding="utf-8") as file:
-            self.config: dict[str, Any] = json.load(file)
+        self.config: dict[str, Any] = registry.session_config(provider).config()
 
     def get_config(self) -> dict[str, Any]:
         return self.config
@@ -1 +1,3 @@
-from .prompt_manager import PromptManager
\ No newline at end of file
+from .prompt_manager import PromptManager
+from .voice_context import (compact_voice_context, estimate_tokens, source_hash,
+                            VOICE_CONTEXT_TOKEN_BUDGET)
@@ -0,0 +1,85 @@
+import os
+import hashlib
+
+# lesson text (context + explained steps) allowed in the voicebot's instructions
+VOICE_CONTEXT_TOKEN_BUDGET = int(os.environ.get("VOICE_CONTEXT_TOKEN_BUDGET", 1500))
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English), free to compute per request."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def source_hash(text: str) -> str:
+    """Identifies the text a summary was made from, so edited lessons don't use stale ones."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def fresh_summary(summary: dict, text: str):
+    """The summary's text if it was made from `text`, else None."""
+    if summary and summary["source_hash"] == source_hash(text):
+        return summary["text"]
+    return None
+
+
+def compact_voice_context(lesson: dict, step_index: int, budget: int = VOICE_CONTEXT_TOKEN_BUDGET) -> tuple:
+    """Lesson context and explained steps for the voicebot prompt, within a token budget.
+
+    Everything is kept verbatim while it fits. Otherwise the current step stays
+    verbatim, the context and earlier steps use their precomputed summaries
+    (verbatim where a lesson has none), and the oldest steps are dropped until the
+    rest fits. The current step and the context are always included, even over budget.
+
+    stats["mode"] is "verbatim" (all of it fits), "summarized" (summaries made it fit),
+    "truncated" (earlier steps dropped) or "over_budget" (nothing could be compacted,
+    e.g. the current step alone is over budget and there are no summaries).
+
+    Args:
+        lesson(dict): Lesson as returned by `get_lesson`.
+        step_index(int): Last explained step.
+        budget(int): Token budget for the context and steps.
+
+    Returns:
+        tuple: (fields, stats). fields has the voice prompt's "concept", "context" and
+            "steps_text"; stats has the token counts and what was compacted.
+    """
+    steps = [lesson["explanation_steps"][i] for i in range(step_index + 1)]
+    context = lesson["context"]
+    verbatim = [f"Step {i+1}: {step['sub_text']}" for i, step in enumerate(steps)]
+    verbatim_tokens = estimate_tokens(context) + sum(estimate_tokens(line) for line in verbatim)
+    stats = {"verbatim_tokens": verbatim_tokens, "summarized_steps": 0, "omitted_steps": 0}
+
+    if verbatim_tokens <= budget:
+        stats.update(mode="verbatim", tokens=verbatim_tokens)
+        return {"concept": lesson["name"], "context": context, "steps_text": "\n".join(verbatim)}, stats
+
+    context_summary = fresh_summary(lesson.get("context_summary"), context)
+    context_text = context_summary or context
+    remaining = budget - estimate_tokens(context_text) - estimate_tokens(verbatim[-1])
+
+    # newest earlier steps first, they matter most for the student's next question
+    kept = []
+    for i in range(len(steps) - 2, -1, -1):
+        summary = fresh_summary(steps[i].get("summary"), steps[i]["sub_text"])
+        line = f"Step {i+1} (summary): {summary}" if summary else verbatim[i]
+        if estimate_tokens(line) > remaining:
+            stats["omitted_steps"] = i + 1
+            break
+        remaining -= estimate_tokens(line)
+        stats["summarized_steps"] += summary is not None
+        kept.append(line)
+
+    lines = kept[::-1] + [verbatim[-1]]
+    if stats["omitted_steps"]:
+        lines.insert(0, f"Steps 1-{stats['omitted_steps']}: covered earlier, not repeated here.")
+    steps_text = "\n".join(lines)
+
+    if stats["omitted_steps"]:
+        mode = "truncated"
+    elif stats["summarized_steps"] or context_summary:
+        mode = "summarized"
+    else:
+        mode = "over_budget"
+    stats.update(mode=mode, tokens=estimate_tokens(context_text) + estimate_tokens(steps_text))
+    return {"concept": lesson["name"], "context": context_text, "steps_text": steps_text}, stats
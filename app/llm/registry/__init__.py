@@ -0,0 +1,2 @@
+from .registry import (registry, PromptRegistry, PromptTemplate,
+                       SessionConfigTemplate, PROMPT_REGISTRY_WATCH)
@@ -0,0 +1,254 @@
+import os
+import json
+import string
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Literal, Optional
+
+import yaml
+
+from utils import logger
+
+PROMPT_REGISTRY_WATCH = float(os.environ.get("PROMPT_REGISTRY_WATCH", 0))  # seconds between file checks, 0 = off
+VOICE_PROMPT_CACHE_SIZE = int(os.environ.get("VOICE_PROMPT_CACHE_SIZE", 1024))
+
+LLM_DIR = Path(__file__).resolve().parent.parent
+PROMPT_FILES = {
+    "VOICE_AGENT": LLM_DIR / "prompts" / "system_prompt_voice.yaml",
+    "CODER": LLM_DIR / "prompts" / "system_prompt_coder.yaml",
+    "SUMMARIZER": LLM_DIR / "prompts" / "system_prompt_summary.yaml",
+}
+SESSION_CONFIG_FILES = {
+    "openai": LLM_DIR / "config" / "openai_config.json",
+    "gemini": LLM_DIR / "config" / "gemini_config.json",
+}
+# where each provider's session config takes the system prompt
+INSTRUCTIONS_PATHS = {
+    "openai": ("session", "instructions"),
+    "gemini": ("setup", "systemInstruction", "parts", 0, "text"),
+}
+VOICE_PROMPT_FIELDS = {"concept", "context", "steps_text"}
+# prompts filled in with `render(**fields)`; the others are used as-is, braces and all
+FORMATTED_PROMPTS = {"VOICE_AGENT", "SUMMARIZER"}
+
+_SLOT = "\x00instructions\x00"
+
+
+def version_key(version) -> tuple:
+    # semantic versioning as strings: "1.10" > "1.2"
+    return tuple(map(int, str(version).split(".")))
+
+
+class PromptTemplate:
+    """One version of a system prompt, split into literals and fields once at load.
+
+    Rendering joins the pieces instead of re-parsing the format string on every call.
+
+    Args:
+        version(str): Prompt version, e.g. "1.2".
+        text(str): The `SYSTEM_PROMPT`, in `str.format` syntax if `formatted`.
+        formatted(bool): Whether the prompt has fields. A prompt without them is
+            rendered verbatim, so literal braces (e.g. code examples) are left alone.
+    """
+
+    def __init__(self, version: str, text: str, formatted: bool = True):
+        self.version = version
+        self.text = text
+        self._parts = [] if formatted else [(text, None)]
+        pieces = string.Formatter().parse(text) if formatted else ()
+        for literal, field, spec, conversion in pieces:
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f"Prompt {version}: only plain {{name}} fields are supported, got {{{field}}}")
+            self._parts.append((literal, field))
+        self.fields = frozenset(field for _, field in self._parts if field)
+
+    def render(self, **values) -> str:
+        return "".join([literal + (str(values[field]) if field else "") for literal, field in self._parts])
+
+
+class SessionConfigTemplate:
+    """A provider's realtime session config, serialized once with a slot for the instructions.
+
+    Args:
+        provider(str): "openai" or "gemini".
+        config(dict): The parsed session config.
+    """
+
+    def __init__(self, provider: str, config: dict):
+        self.provider = provider
+        self._config = json.dumps(config)
+
+        slotted = json.loads(self._config)
+        *parents, last = INSTRUCTIONS_PATHS[provider]
+        target = slotted
+        for key in parents:
+            target = target[key]
+        target[last] = _SLOT
+        self._prefix, self._suffix = json.dumps(slotted).split(json.dumps(_SLOT))
+
+    def render(self, instructions: str) -> str:
+        """The session setup message, ready to send upstream."""
+        return self._prefix + json.dumps(instructions) + self._suffix
+
+    def config(self) -> dict:
+        """A fresh, mutable copy of the config as it is on disk."""
+        return json.loads(self._config)
+
+
+class PromptRegistry:
+    """Process-wide store of the system prompts and realtime session configs.
+
+    Everything is read and parsed once (at startup or on first use) instead of on every
+    request. With `PROMPT_REGISTRY_WATCH` set the files are checked for changes every
+    that many seconds and reloaded in place; a file that fails to parse keeps the
+    previous version. Rendered voice prompts are memoized per
+    (concept_id, step index, prompt version).
+    """
+
+    def __init__(self, cache_size: int = VOICE_PROMPT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._prompts = {}  # type -> ({version: PromptTemplate}, latest version)
+        self._session_configs = {}  # provider -> SessionConfigTemplate
+        self._mtimes = {}
+        self._rendered = OrderedDict()
+        self._generation = 0  # bumped on every clear, so renders from before a reload aren't cached
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._watcher: threading.Thread = None
+        self._stopped = threading.Event()
+
+    # --- loading ---
+    def _load_prompts(self, type_: str, path: Path):
+        with open(path, "r", encoding="utf-8") as file:
+            data = yaml.safe_load(file)
+        if not data or "versions" not in data:
+            raise KeyError(f"{path.name} must contain a top-level 'versions' key")
+        if not data["versions"]:
+            raise ValueError(f"No prompt versions found in {path.name}")
+
+        templates = {}
+        for version, entry in data["versions"].items():
+            if entry.get("SYSTEM_PROMPT") is None:
+                raise KeyError(f"'SYSTEM_PROMPT' missing for version '{version}' in {path.name}")
+            templates[str(version)] = PromptTemplate(str(version), entry["SYSTEM_PROMPT"], formatted=type_ in FORMATTED_PROMPTS)
+        if type_ == "VOICE_AGENT":
+            for template in templates.values():
+                if template.fields - VOICE_PROMPT_FIELDS:
+                    raise KeyError(f"Voice prompt {template.version} uses unknown fields {template.fields - VOICE_PROMPT_FIELDS}")
+
+        self._prompts[type_] = (templates, max(templates, key=version_key))
+
+    def _load_session_config(self, provider: str, path: Path):
+        with open(path, "r", encoding="utf-8") as file:
+            self._session_configs[provider] = SessionConfigTemplate(provider, json.load(file))
+
+    def _reload_changed(self, strict: bool) -> list:
+        changed = []
+        sources = [(self._load_prompts, k, p) for k, p in PROMPT_FILES.items()]
+        sources += [(self._load_session_config, k, p) for k, p in SESSION_CONFIG_FILES.items()]
+        for load, key, path in sources:
+            mtime = path.stat().st_mtime
+            if self._mtimes.get(path) == mtime:
+                continue
+            try:
+                load(key, path)
+                changed.append(path.name)
+            except Exception as e:
+                if strict:
+                    raise
+                logger.error(f"Keeping the previous {path.name}, reload failed: {e}")
+            self._mtimes[path] = mtime
+
+        if changed:
+            self.clear_rendered()
+        return changed
+
+    def load(self):
+        """Reads every prompt and session config. Raises if one is missing or invalid."""
+        self._mtimes = {}
+        self._reload_changed(strict=True)
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    # --- hot reload ---
+    def _watch(self, interval: float):
+        while not self._stopped.wait(interval):
+            try:
+                changed = self._reload_changed(strict=False)
+            except OSError as e:
+                logger.error(f"Prompt registry: couldn't check files: {e}")
+                continue
+            if changed:
+                logger.info(f"Prompt registry reloaded {', '.join(changed)}")
+
+    def start_watching(self, interval: float = PROMPT_REGISTRY_WATCH):
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._ensure_loaded()
+        self._stopped.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="prompt-registry", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stopped.set()
+        self._watcher = None
+
+    # --- lookups ---
+    def prompt(self, type_: Literal["VOICE_AGENT", "CODER", "SUMMARIZER"], version: Optional[str] = None) -> PromptTemplate:
+        """The prompt template of `version`, the latest one when missing or unknown."""
+        self._ensure_loaded()
+        templates, latest = self._prompts[type_]
+        return templates.get(version) or templates[latest]
+
+    def versions(self, type_: Literal["VOICE_AGENT", "CODER", "SUMMARIZER"]) -> dict:
+        self._ensure_loaded()
+        return dict(self._prompts[type_][0])
+
+    def session_config(self, provider: Literal["gemini", "openai"]) -> SessionConfigTemplate:
+        self._ensure_loaded()
+        return self._session_configs[provider]
+
+    def voice_prompt(
+        self,
+        concept_id: int,
+        step_index: int,
+        fields: Callable[[], dict],
+        version: Optional[str] = None,
+    ) -> str:
+        """The voice agent's system prompt for a lesson up to a step, memoized.
+
+        Args:
+            concept_id(int): Lesson the prompt is for.
+            step_index(int): Last explained step.
+            fields(Callable): Returns the prompt's "concept", "context" and "steps_text",
+                only called when the prompt isn't cached.
+            version(str): Prompt version, defaults to the latest.
+        """
+        template = self.prompt("VOICE_AGENT", version)
+        key = (concept_id, step_index, template.version)
+        with self._lock:
+            generation = self._generation
+            if key in self._rendered:
+                self._rendered.move_to_end(key)
+                return self._rendered[key]
+
+        prompt = template.render(**fields())
+        with self._lock:
+            if generation == self._generation:
+                self._rendered[key] = prompt
+                if len(self._rendered) > self.cache_size:
+                    self._rendered.popitem(last=False)
+        return prompt
+
+    def clear_rendered(self):
+        """Drops the memoized voice prompts, e.g. after lesson content changed."""
+        with self._lock:
+            self._rendered.clear()
+            self._generation += 1
+
+
+registry = PromptRegistry()
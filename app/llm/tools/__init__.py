@@ -1 +1,7 @@
-from .tools import code_exec_tool
\ No newline at end of file
+def __getattr__(name):
+    # langchain_experimental is slow to import, only load it when a tool is used
+    if name == "code_exec_tool":
+        from .tools import code_exec_tool
+
+        return code_exec_tool
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,14 +1,67 @@
-from fastapi import FastAPI
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from routes import explanation_route
+from routes import explanation_route, admin_route
+from Database import sqlite_client, DB_MODE
+from Database.migrations import check_query_plans, local_copy
+from utils import logger
+from llm.registry import registry
+from services.lessons import bundle_cache
+from services.analytics import session_events
+from services.voice.session_recording import SessionRecordingMiddleware
+from metrics import WebsocketSessionMiddleware, metrics_payload, loop_monitor, LOOP_MONITOR
 
-app = FastAPI()
+DB_CHECK_QUERY_PLANS = os.environ.get("DB_CHECK_QUERY_PLANS", "0") == "1"
+
+
+def clear_lesson_caches():
+    """Drops what was built from the previous lesson content, after a replica sync."""
+    registry.clear_rendered()  # memoized voice prompts embed lesson content
+    bundle_cache.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_CHECK_QUERY_PLANS:
+        # refuse to start if a lesson query would scan a whole table
+        failures, warnings = check_query_plans(local_copy(os.environ.get("DB_PRIMARY_PATH")))
+        for warning in warnings:
+            logger.warning(f"Query plan: {warning}")
+        if failures:
+            raise RuntimeError(f"Lesson queries do full table scans: {failures}")
+
+    # parse the prompts and session configs once, fail fast if one is broken
+    registry.load()
+    registry.start_watching()
+    if DB_MODE == "replica":
+        sqlite_client.on_synced = clear_lesson_caches
+
+    if LOOP_MONITOR != "off":
+        loop_monitor.start(audit=LOOP_MONITOR == "audit", stacks=LOOP_MONITOR in ("on", "audit"))
+    session_events.start()
+    yield
+    await session_events.stop()
+    loop_monitor.stop()
+    registry.stop_watching()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(WebsocketSessionMiddleware)
+app.add_middleware(SessionRecordingMiddleware)
 
 app.include_router(explanation_route.router, prefix="", tags=["Agents"])
+if admin_route.ADMIN_TOKEN:
+    app.include_router(admin_route.router, prefix="", tags=["Admin"])
 
 @app.get("/")
 async def health_check():
-    return {"data":"Working", "status":200}
\ No newline at end of file
+    return {"data":"Working", "status":200}
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
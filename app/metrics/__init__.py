@@ -0,0 +1,47 @@
+from .metrics import (
+    LESSON_DB_LOAD_SECONDS,
+    S3_LIST_SECONDS,
+    S3_PRESIGN_SECONDS,
+    LESSON_BUNDLE_RESPONSES,
+    LESSON_BUNDLE_BUILD_SECONDS,
+    TTS_FIRST_CHUNK_SECONDS,
+    TTS_TOTAL_SECONDS,
+    TTS_CLIENT_LEAD_SECONDS,
+    TTS_AUDIO_DISCARDED_BYTES,
+    VOICEBOT_SETUP_SECONDS,
+    REALTIME_UPSTREAM_RTT_SECONDS,
+    REALTIME_RESPONSE_SECONDS,
+    REALTIME_RECONNECTS,
+    REALTIME_RECONNECT_SECONDS,
+    REALTIME_HELD_AUDIO_DROPPED,
+    VOICE_PROMPT_TOKENS,
+    DIAGRAM_END_TO_END_SECONDS,
+    DIAGRAM_STAGE_SECONDS,
+    DIAGRAM_CODE_REJECTED,
+    CODEGEN_REQUESTS,
+    CODEGEN_SECONDS,
+    DIAGRAM_JOBS_CANCELLED,
+    DIAGRAM_TASKS_ABORTED,
+    DIAGRAM_SANDBOX_CLEANUP,
+    DIAGRAM_CLEANUP_SECONDS,
+    DIAGRAM_CACHE_REQUESTS,
+    DIAGRAM_CACHE_BYTES_SERVED,
+    DIAGRAM_CACHE_FILL_SECONDS,
+    DIAGRAM_PUSHED_BYTES,
+    ANALYTICS_EVENTS_RECORDED,
+    ANALYTICS_EVENTS_DROPPED,
+    ANALYTICS_FLUSH_SECONDS,
+    DIAGRAM_CACHE_SIZE_BYTES,
+    ACTIVE_WEBSOCKET_SESSIONS,
+    ACTIVE_VOICEBOT_SESSIONS,
+    INFLIGHT_DIAGRAM_TASKS,
+    REPLICA_LAG_SECONDS,
+    ADMISSION_WAIT_SECONDS,
+    ADMISSION_REJECTED,
+    EVENT_LOOP_LAG_SECONDS,
+    EVENT_LOOP_STALLS,
+    WebsocketSessionMiddleware,
+    metrics_payload,
+    start_metrics_server,
+)
+from .loop_monitor import LoopStallMonitor, loop_monitor, LOOP_MONITOR
@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from utils import logger
+from .metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+# "off" | "lag" (lag histogram, stall count and blocking call site in the log)
+# | "on" (also keeps the stall stacks for /debug/loop-stalls, which is admin only)
+# | "audit" (also asyncio debug mode, which logs every slow callback; dev only)
+LOOP_MONITOR = os.environ.get("LOOP_MONITOR", "lag")
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", 0.1))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.05))
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LoopStallMonitor:
+    """Measures event-loop lag and captures what the loop was doing when it stalled.
+
+    A heartbeat task on the loop records the lag of every wake-up. A watchdog thread
+    notices when the heartbeat is overdue by more than `threshold` and grabs the
+    loop thread's stack right then, i.e. the stack of the blocking call. Stalls are
+    grouped by the innermost frame of our own code; the stack itself is only kept
+    when `start` is asked to.
+
+    Args:
+        threshold(float): Seconds the loop may block before it counts as a stall.
+        interval(float): Seconds between heartbeats.
+    """
+
+    def __init__(self, threshold: float = LOOP_STALL_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = {}  # site -> {"count", "total_s", "max_s", ["stack"]}
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._heartbeat_task: asyncio.Task = None
+        self._watchdog: threading.Thread = None
+        self._stopped = threading.Event()
+        self._keep_stacks = False
+
+    # --- runs on the loop ---
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._beat = time.monotonic()
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - self.interval))
+
+    # --- runs on the watchdog thread ---
+    def _describe(self, frame) -> tuple:
+        frames = traceback.extract_stack(frame)
+        ours = [
+            f for f in frames
+            if f.filename.startswith(APP_ROOT) and "site-packages" not in f.filename
+        ]
+        culprit = (ours or frames)[-1]
+        site = f"{os.path.relpath(culprit.filename, APP_ROOT)}:{culprit.lineno} {culprit.name}"
+        return site, "".join(traceback.format_list(frames[-12:]))
+
+    def _watch(self):
+        stalled_since, site = None, None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            overdue = time.monotonic() - beat - self.interval
+
+            if overdue > self.threshold and stalled_since is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                stalled_since = beat
+                site, stack = self._describe(frame)
+                with self._lock:
+                    entry = self.stalls.setdefault(site, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+                    if self._keep_stacks:
+                        entry.setdefault("stack", stack)
+                    entry["count"] += 1
+                EVENT_LOOP_STALLS.inc()
+
+            elif stalled_since is not None and beat != stalled_since:
+                # the heartbeat ran again, the stall is over
+                duration = beat - stalled_since - self.interval
+                with self._lock:
+                    entry = self.stalls[site]
+                    entry["total_s"] += duration
+                    entry["max_s"] = max(entry["max_s"], duration)
+                logger.warning(f"Event loop blocked for {duration:.3f}s at {site}")
+                stalled_since, site = None, None
+
+    # --- public ---
+    def start(self, audit: bool = False, stacks: bool = False):
+        """Starts monitoring the running loop. Call from inside the loop (e.g. lifespan).
+
+        Args:
+            audit(bool): Also turn on asyncio debug mode.
+            stacks(bool): Keep the stack of each stall site for `snapshot`.
+        """
+        loop = asyncio.get_running_loop()
+        self._keep_stacks = stacks
+        if audit:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = loop.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    def snapshot(self) -> dict:
+        """Stall sites, most frequent first."""
+        with self._lock:
+            stalls = [
+                {"site": site, **{k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()}}
+                for site, entry in self.stalls.items()
+            ]
+        stalls.sort(key=lambda s: (s["count"], s["total_s"]), reverse=True)
+        return {"mode": LOOP_MONITOR, "threshold_s": self.threshold, "stalls": stalls}
+
+
+loop_monitor = LoopStallMonitor()
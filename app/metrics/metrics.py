@@ -0,0 +1,250 @@
+import os
+from prometheus_client import (
+    Histogram,
+    Gauge,
+    Counter,
+    CollectorRegistry,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# Set PROMETHEUS_MULTIPROC_DIR when running several uvicorn/celery processes so
+# every process' samples are aggregated.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SLOW_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120)
+
+# --- lesson loading ---
+LESSON_DB_LOAD_SECONDS = Histogram(
+    "lesson_db_load_seconds", "Time to load a lesson from the database", buckets=FAST_BUCKETS
+)
+S3_LIST_SECONDS = Histogram(
+    "s3_list_seconds", "Time to list a lesson's diagrams in object storage", buckets=FAST_BUCKETS
+)
+S3_PRESIGN_SECONDS = Histogram(
+    "s3_presign_seconds", "Time to presign all diagram urls of a lesson", buckets=FAST_BUCKETS
+)
+
+LESSON_BUNDLE_RESPONSES = Counter(
+    "lesson_bundle_responses",
+    "Lesson bundle responses by status (200 or 304) and content encoding",
+    ["status", "encoding"],
+)
+LESSON_BUNDLE_BUILD_SECONDS = Histogram(
+    "lesson_bundle_build_seconds", "Time to build a lesson bundle on a cache miss", buckets=FAST_BUCKETS
+)
+
+# --- narration ---
+TTS_FIRST_CHUNK_SECONDS = Histogram(
+    "tts_first_chunk_seconds", "Time from TTS request to the first audio chunk", buckets=FAST_BUCKETS
+)
+TTS_TOTAL_SECONDS = Histogram(
+    "tts_total_seconds", "Time to stream a whole TTS part", buckets=SLOW_BUCKETS
+)
+TTS_CLIENT_LEAD_SECONDS = Histogram(
+    "tts_client_lead_seconds",
+    "Seconds of narration the client had buffered ahead of playback after each paced audio chunk",
+    buckets=(0.1, 0.25, 0.5, 1, 1.5, 2, 3, 5, 10, 30),
+)
+TTS_AUDIO_DISCARDED_BYTES = Counter(
+    "tts_audio_discarded_bytes",
+    "Narration audio dropped when a paced stream stopped early: held server-side or sent but unplayed",
+    ["held", "reason"],
+)
+
+# --- voicebot ---
+VOICEBOT_SETUP_SECONDS = Histogram(
+    "voicebot_setup_seconds",
+    "Time from VOICEBOT request to a configured realtime session",
+    ["provider"],
+    buckets=FAST_BUCKETS,
+)
+REALTIME_UPSTREAM_RTT_SECONDS = Histogram(
+    "realtime_upstream_rtt_seconds",
+    "Websocket ping round trip to the realtime upstream",
+    ["provider"],
+    buckets=FAST_BUCKETS,
+)
+REALTIME_RESPONSE_SECONDS = Histogram(
+    "realtime_response_seconds",
+    "Time from the end of the student's speech to the first audio from the realtime upstream",
+    ["provider"],
+    buckets=FAST_BUCKETS,
+)
+REALTIME_RECONNECTS = Counter(
+    "realtime_reconnects",
+    "Realtime upstream connections that dropped mid-session, by outcome: resumed or failed",
+    ["provider", "outcome"],
+)
+REALTIME_RECONNECT_SECONDS = Histogram(
+    "realtime_reconnect_seconds",
+    "Time from an upstream drop to the resumed session (reconnect, restore, held audio sent)",
+    ["provider"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20),
+)
+REALTIME_HELD_AUDIO_DROPPED = Counter(
+    "realtime_held_audio_dropped_bytes",
+    "Student audio dropped while the upstream was reconnecting, over REALTIME_RESUME_BUFFER_BYTES",
+    ["provider"],
+)
+VOICE_PROMPT_TOKENS = Histogram(
+    "voice_prompt_tokens",
+    "Estimated tokens in the voicebot's session instructions",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000),
+)
+
+# --- diagrams ---
+DIAGRAM_END_TO_END_SECONDS = Histogram(
+    "diagram_end_to_end_seconds",
+    "Time from a generate_diagram call to the result reaching the client",
+    ["status"],
+    buckets=SLOW_BUCKETS,
+)
+DIAGRAM_STAGE_SECONDS = Histogram(
+    "diagram_stage_seconds",
+    "Time spent in each stage of the diagram worker",
+    ["stage"],
+    buckets=SLOW_BUCKETS,
+)
+DIAGRAM_CODE_REJECTED = Counter(
+    "diagram_code_rejected", "Generated diagram code rejected before reaching the sandbox"
+)
+CODEGEN_REQUESTS = Counter(
+    "codegen_requests",
+    "Diagram codegen requests per model (hedges included) by event: launched, wins, invalid, errors or busy",
+    ["model", "event"],
+)
+CODEGEN_SECONDS = Histogram(
+    "codegen_seconds", "Time for a model to answer a diagram codegen request", ["model"], buckets=SLOW_BUCKETS
+)
+DIAGRAM_JOBS_CANCELLED = Counter(
+    "diagram_jobs_cancelled",
+    "Diagram jobs cancelled because their voice session ended or the wait timed out",
+    ["stage"],
+)
+DIAGRAM_TASKS_ABORTED = Counter(
+    "diagram_tasks_aborted", "Revoked diagram tasks stopped by the worker before a stage", ["stage"]
+)
+DIAGRAM_SANDBOX_CLEANUP = Counter(
+    "diagram_sandbox_cleanup", "Diagram sandboxes torn down by the worker", ["outcome"]
+)
+DIAGRAM_CLEANUP_SECONDS = Histogram(
+    "diagram_cleanup_seconds",
+    "Time to cancel a voice session's outstanding diagram jobs",
+    buckets=FAST_BUCKETS,
+)
+
+# --- admission control ---
+ADMISSION_WAIT_SECONDS = Histogram(
+    "admission_wait_seconds",
+    "Time a request queued for a provider slot before being admitted or turned away",
+    ["resource", "priority", "outcome"],
+    buckets=FAST_BUCKETS + (10, 20, 30, 60),
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected",
+    "Requests turned away with a server busy message",
+    ["resource", "priority"],
+)
+
+# --- diagram cache ---
+DIAGRAM_CACHE_REQUESTS = Counter(
+    "diagram_cache_requests",
+    "Diagram file requests by result: hit, miss, coalesced (waited for another fill) or revalidate",
+    ["result"],
+)
+DIAGRAM_CACHE_BYTES_SERVED = Counter(
+    "diagram_cache_bytes_served", "Diagram bytes served from the local disk cache"
+)
+DIAGRAM_CACHE_FILL_SECONDS = Histogram(
+    "diagram_cache_fill_seconds", "Time to fill (or revalidate) a diagram from object storage", buckets=FAST_BUCKETS
+)
+DIAGRAM_PUSHED_BYTES = Counter(
+    "diagram_pushed_bytes", "Diagram bytes sent over the websocket ahead of their step (DIAGRAM_PUSH_COUNT)"
+)
+
+# --- session analytics ---
+ANALYTICS_EVENTS_RECORDED = Counter(
+    "analytics_events_recorded", "Session analytics events buffered for writing"
+)
+ANALYTICS_EVENTS_DROPPED = Counter(
+    "analytics_events_dropped",
+    "Session analytics events dropped: buffer full (the sink can't keep up) or write_failed",
+    ["reason"],
+)
+ANALYTICS_FLUSH_SECONDS = Histogram(
+    "analytics_flush_seconds", "Time to write one batch of session analytics events", ["sink"], buckets=FAST_BUCKETS
+)
+
+# --- event loop ---
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "How late the event loop wakes up a sleeping task", buckets=FAST_BUCKETS
+)
+EVENT_LOOP_STALLS = Counter(
+    "event_loop_stalls", "Callbacks that blocked the event loop longer than the stall threshold"
+)
+
+# --- load ---
+_gauge_mode = {"multiprocess_mode": "livesum"} if MULTIPROCESS else {}
+ACTIVE_WEBSOCKET_SESSIONS = Gauge(
+    "active_websocket_sessions", "Open client websockets", **_gauge_mode
+)
+ACTIVE_VOICEBOT_SESSIONS = Gauge(
+    "active_voicebot_sessions", "Running voicebot sessions", **_gauge_mode
+)
+DIAGRAM_CACHE_SIZE_BYTES = Gauge(
+    "diagram_cache_size_bytes",
+    "Bytes in the local diagram cache",
+    # workers share the cache directory
+    **({"multiprocess_mode": "max"} if MULTIPROCESS else {}),
+)
+INFLIGHT_DIAGRAM_TASKS = Gauge(
+    "inflight_diagram_tasks", "Diagram celery tasks waited on by voice sessions", **_gauge_mode
+)
+REPLICA_LAG_SECONDS = Gauge(
+    "replica_lag_seconds",
+    "Seconds since the lesson replica last synced, updated on every sync attempt (DB_MODE=replica)",
+    # the stalest worker counts
+    **({"multiprocess_mode": "max"} if MULTIPROCESS else {}),
+)
+
+
+class WebsocketSessionMiddleware:
+    """ASGI middleware keeping `active_websocket_sessions` up to date."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            return await self.app(scope, receive, send)
+
+        ACTIVE_WEBSOCKET_SESSIONS.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ACTIVE_WEBSOCKET_SESSIONS.dec()
+
+
+def metrics_payload() -> tuple:
+    """Returns (body, content type) for a Prometheus scrape."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int) -> None:
+    """Serves /metrics on its own port (used by celery workers)."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
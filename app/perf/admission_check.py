@@ -0,0 +1,143 @@
+"""Checks the admission limiter against a real Redis.
+
+Usage:
+    cd app
+    REDIS_ENDPOINT=redis://localhost:6379/0 python -m perf.admission_check
+    REDIS_ENDPOINT=... python -m perf.admission_check --holders 50 --cap 5
+
+Uses its own key prefix, so it can run against a shared Redis. Checks (exit status 1
+if any fails):
+- caps: many holders at once never exceed the concurrency cap, and all get through,
+- rate: acquisitions beyond the burst are paced at the bucket's rate,
+- priority: with the reserve taken, a LOW request gets ServerBusy (with a
+  retry_after) while a HIGH one is still admitted,
+- release: slots are free again once every holder is done.
+Queue waits of the caps check are printed too.
+"""
+
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+
+from admission import AdmissionController, ServerBusy, HIGH, LOW
+from admission.limiter import get_async_redis, REDIS_ENDPOINT
+
+
+def controller(limits: dict) -> AdmissionController:
+    return AdmissionController(limits=limits, enabled=True, key_prefix=f"admission-check:{uuid.uuid4().hex}")
+
+
+async def check_caps(args) -> tuple:
+    limiter = controller({"model": {"concurrency": args.cap, "rate": 0, "reserve": 0}})
+    state = {"active": 0, "peak": 0}
+    waits = []
+
+    async def hold():
+        start = time.perf_counter()
+        async with limiter.acquire(("model",), priority=HIGH, max_wait=60):
+            waits.append(time.perf_counter() - start)
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(args.hold_ms / 1000)
+            state["active"] -= 1
+
+    await asyncio.gather(*(hold() for _ in range(args.holders)))
+
+    problems = []
+    if state["peak"] > args.cap:
+        problems.append(f"caps: {state['peak']} holders at once, cap is {args.cap}")
+    if len(waits) != args.holders:
+        problems.append(f"caps: {len(waits)}/{args.holders} holders got through")
+    waits.sort()
+    summary = {
+        "holders": args.holders,
+        "cap": args.cap,
+        "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1),
+        "wait_max_ms": round(waits[-1] * 1000, 1),
+    }
+    return problems, summary
+
+
+async def check_rate(args) -> list:
+    rate, burst, count = 20, 5, 25
+    limiter = controller({"model": {"concurrency": 0, "rate": rate, "burst": burst, "reserve": 0}})
+    start = time.perf_counter()
+    for _ in range(count):
+        async with limiter.acquire(("model",), max_wait=10):
+            pass
+    elapsed = time.perf_counter() - start
+    expected = (count - burst) / rate
+    if elapsed < expected * 0.8:
+        return [f"rate: {count} acquisitions took {elapsed:.2f}s, the bucket allows no less than {expected:.2f}s"]
+    return []
+
+
+async def check_priority(args) -> list:
+    # cap 10, reserve 0.2: HIGH may use 10 slots, LOW only 6
+    limiter = controller({"model": {"concurrency": 10, "rate": 0, "reserve": 0.2}})
+    problems = []
+    release = asyncio.Event()
+    held = asyncio.Semaphore(0)
+
+    async def hold():
+        async with limiter.acquire(("model",), priority=HIGH, max_wait=5):
+            held.release()
+            await release.wait()
+
+    holders = [asyncio.create_task(hold()) for _ in range(8)]
+    for _ in range(8):
+        await held.acquire()
+
+    try:
+        async with limiter.acquire(("model",), priority=LOW, max_wait=0.5):
+            problems.append("priority: a LOW request used the capacity reserved for HIGH")
+    except ServerBusy as e:
+        message = e.to_client()
+        if message["type"] != "SERVER_BUSY" or message["retry_after"] < 1:
+            problems.append(f"priority: unexpected busy message {message}")
+    try:
+        async with limiter.acquire(("model",), priority=HIGH, max_wait=0.5):
+            pass
+    except ServerBusy:
+        problems.append("priority: a HIGH request was refused with reserved capacity left")
+
+    release.set()
+    await asyncio.gather(*holders)
+
+    leases = await get_async_redis().zcard(f"{limiter.key_prefix}:model:leases")
+    if leases:
+        problems.append(f"release: {leases} leases left after every holder finished")
+    return problems
+
+
+async def run(args) -> tuple:
+    problems, summary = await check_caps(args)
+    print(f"{'check_caps':<16} {'ok' if not problems else 'FAILED'}")
+    for check in (check_rate, check_priority):
+        found = await check(args)
+        print(f"{check.__name__:<16} {'ok' if not found else 'FAILED'}")
+        problems += found
+    return problems, summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--holders", type=int, default=30)
+    parser.add_argument("--cap", type=int, default=4)
+    parser.add_argument("--hold-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    if not REDIS_ENDPOINT:
+        parser.error("set REDIS_ENDPOINT")
+    problems, summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
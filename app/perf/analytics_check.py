@@ -0,0 +1,170 @@
+"""Checks the session analytics recorder against a slow sink and a sqlite database.
+
+Usage:
+    cd app
+    python -m perf.analytics_check
+    python -m perf.analytics_check --events 200000 --sink-latency 0.05
+
+Checks (exit status 1 if any fails):
+- hot path: `record` stays under --max-record-us per call on average, while the
+  sink is slow,
+- bounded: the buffer never holds more than its limit, and every event is either
+  written or counted as dropped,
+- failures: a failing sink drops and counts its batches, the recorder keeps going,
+- database: events land in `session_events` (migration 4) with their session, and
+  `stop` writes what's left.
+Record cost and the written/dropped split are printed too.
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+
+from metrics import ANALYTICS_EVENTS_DROPPED
+from services.analytics import EventRecorder
+from Database.events import write_session_events
+from Database.migrations import apply_migrations
+
+
+class SlowSink:
+    name = "slow"
+
+    def __init__(self, latency: float, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.rows = 0
+
+    async def write(self, rows: list) -> None:
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("sink unavailable")
+        self.rows += len(rows)
+
+
+class SqliteSink:
+    """The database sink's write path on an in-memory sqlite database."""
+
+    name = "sqlite"
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        apply_migrations(self.conn)
+
+    async def execute(self, sql: str, args: tuple = ()):
+        return self.conn.execute(sql, args).fetchall()
+
+    async def write(self, rows: list) -> None:
+        await write_session_events(self, rows)
+
+
+def dropped(reason: str) -> float:
+    return ANALYTICS_EVENTS_DROPPED.labels(reason)._value.get()
+
+
+async def produce(recorder: EventRecorder, events: int, sessions: int) -> tuple:
+    """Records `events` from `sessions` concurrent sessions; returns (seconds in record, peak buffer)."""
+    spent, peak = 0.0, 0
+
+    async def session(n: int):
+        nonlocal spent, peak
+        token = recorder.start_session(f"session-{n}", n % 7)
+        for i in range(events // sessions):
+            start = time.perf_counter()
+            recorder.record("part_requested", part="EXPLANATION_STEP", index=i)
+            spent += time.perf_counter() - start
+            peak = max(peak, recorder.pending)
+            if i % 20 == 0:
+                await asyncio.sleep(0)
+        recorder.end_session(token)
+
+    await asyncio.gather(*(session(n) for n in range(sessions)))
+    return spent, peak
+
+
+async def check_hot_path(args) -> tuple:
+    problems = []
+    sink = SlowSink(args.sink_latency)
+    recorder = EventRecorder(sink, max_events=args.max_events, batch_size=500, flush_interval=0.05)
+    recorder.start()
+    before = dropped("full")
+    spent, peak = await produce(recorder, args.events, args.sessions)
+    await recorder.stop(timeout=30)
+
+    total = args.events // args.sessions * args.sessions
+    lost = dropped("full") - before
+    per_record_us = spent / total * 1e6
+    if per_record_us > args.max_record_us:
+        problems.append(f"hot path: record took {per_record_us:.2f}us on average > {args.max_record_us}us")
+    if peak > args.max_events:
+        problems.append(f"bounded: {peak} events buffered, limit {args.max_events}")
+    if sink.rows + lost != total:
+        problems.append(f"bounded: {sink.rows} written + {int(lost)} dropped != {total} recorded")
+    return problems, {"events": total, "record_us": round(per_record_us, 3), "written": sink.rows,
+                      "dropped_full": int(lost), "peak_buffered": peak}
+
+
+async def check_failures(args) -> list:
+    recorder = EventRecorder(SlowSink(0, fail=True), batch_size=100, flush_interval=0.01)
+    recorder.start()
+    before = dropped("write_failed")
+    for i in range(1000):
+        recorder.record("error", i=i)
+    await asyncio.sleep(0.1)
+    recorder.record("after_failures")
+    await recorder.stop()
+    failed = dropped("write_failed") - before
+    return [] if failed == 1001 else [f"failures: {int(failed)} of 1001 failed events counted"]
+
+
+async def check_database(args) -> list:
+    problems = []
+    sink = SqliteSink()
+    recorder = EventRecorder(sink, batch_size=250, flush_interval=60)  # only stop() flushes
+    recorder.start()
+    token = recorder.start_session("abc", 3)
+    for i in range(1234):
+        recorder.record("part_requested", part="CONTEXT", index=i)
+    recorder.end_session(token)
+    recorder.record("outside_session")
+    await recorder.stop()
+
+    rows = sink.conn.execute("SELECT session_id, lesson_id, kind, data FROM session_events ORDER BY rowid").fetchall()
+    if len(rows) != 1235:
+        problems.append(f"database: {len(rows)} of 1235 events written")
+    elif rows[0][:2] != ("abc", 3) or json.loads(rows[1233][3])["index"] != 1233 or rows[-1][0] is not None:
+        problems.append("database: events lost their session, order or data")
+    return problems
+
+
+async def run(args) -> tuple:
+    problems, summary = [], {}
+    for check in (check_hot_path, check_failures, check_database):
+        result = await check(args)
+        found, extra = result if isinstance(result, tuple) else (result, {})
+        print(f"{check.__name__:<18} {'ok' if not found else 'FAILED'}")
+        problems += found
+        summary.update(extra)
+    return problems, summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--max-events", type=int, default=10000, help="recorder buffer limit")
+    parser.add_argument("--sink-latency", type=float, default=0.02, help="seconds every batch write takes")
+    parser.add_argument("--max-record-us", type=float, default=20.0, help="budget for one record() call")
+    args = parser.parse_args()
+
+    problems, summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
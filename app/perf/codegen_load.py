@@ -0,0 +1,116 @@
+"""Load test for diagram code generation against the local fake Gemini endpoint.
+
+Usage:
+    cd app
+    python -m perf.codegen_load --requests 200 --threads 64 --concurrency 16
+    FAKE_GEMINI_MODEL_LATENCY="gemini-3-pro-preview=6,gemini-2.5-flash=1" \
+        python -m perf.codegen_load --hedge-delay 2
+
+Simulates a Celery worker running with `--pool threads`, every thread calling
+`generate_code` the way `generate_diagram` does, and reports throughput,
+latency percentiles, per-model hedging stats and the peak number of requests
+the fake endpoint saw.
+"""
+
+import os
+import time
+import json
+import socket
+import argparse
+import threading
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_gemini(port: int):
+    import uvicorn
+    from perf.fake_gemini import app
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--hedge-delay", default="", help="empty disables hedging")
+    args = parser.parse_args()
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    # must be set before llm.clients is imported
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "fake")
+    os.environ["DIAGRAM_CODEGEN_MODE"] = args.mode
+    os.environ["DIAGRAM_CODEGEN_CONCURRENCY"] = str(args.concurrency)
+    os.environ["DIAGRAM_HEDGE_DELAY"] = args.hedge_delay
+
+    start_fake_gemini(port)
+
+    from utils import parse_code
+    from celery_tasks.codegen import generate_code, hedge_stats
+
+    latencies = []
+    errors = 0
+
+    def one(i: int):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            generate_code(
+                contents=f"Draw a right triangle\n Figure_name: fig_{i}",
+                system_prompt="You write matplotlib code.",
+                validate=lambda text: parse_code(generated_code=text),
+            )
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors += 1
+            print(f"request {i} failed: {e}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - start
+
+    with urllib.request.urlopen(f"{base_url}/stats") as resp:
+        server_stats = json.load(resp)
+
+    report = {
+        "mode": args.mode,
+        "requests": args.requests,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "p50_s": round(statistics.median(latencies), 3) if latencies else None,
+        "p95_s": round(percentile(latencies, 95), 3) if latencies else None,
+        "p99_s": round(percentile(latencies, 99), 3) if latencies else None,
+        "max_in_flight_upstream": server_stats["max_in_flight"],
+        "hedging": hedge_stats.snapshot(),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
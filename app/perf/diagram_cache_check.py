@@ -0,0 +1,142 @@
+"""Checks the web tier's diagram disk cache against the fake object storage.
+
+Usage:
+    cd app
+    python -m perf.diagram_cache_check
+    python -m perf.diagram_cache_check --requests 2000 --keys 50 --s3-latency 0.05
+
+Checks (exit status 1 if any fails):
+- single flight: concurrent misses for one diagram make one object storage GET,
+- hits: a cached diagram is served without going to object storage,
+- bounded: the cache stays under its byte limit, least recently used files go first,
+- restart: a new cache on the same directory finds the files again,
+- revalidation: an expired entry is revalidated (304) instead of downloaded again,
+- conditional GET: a matching If-None-Match is answered with 304.
+Hit and miss latencies are printed too.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from perf.codegen_load import _free_port, percentile
+
+
+def start_fake_s3(latency: float) -> object:
+    import uvicorn
+
+    os.environ["FAKE_S3_LATENCY"] = str(latency)
+    from perf import fake_s3
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_s3.app, host="127.0.0.1", port=port, ws="none", log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            sys.exit("fake object storage didn't start")
+        time.sleep(0.05)
+
+    # read by utils at import time
+    os.environ.update(
+        {
+            "TIGRIS_STORAGE_ENDPOINT": f"http://127.0.0.1:{port}",
+            "TIGRIS_STORAGE_ACCESS_KEY_ID": "fake",
+            "TIGRIS_STORAGE_SECRET_ACCESS_KEY": "fake",
+            "AWS_DEFAULT_REGION": "auto",
+            "S3_ADDRESSING_STYLE": "path",
+        }
+    )
+    return fake_s3.app
+
+
+async def check(args, s3) -> tuple:
+    from perf.fake_s3 import PNG
+    from services.lessons.diagram_cache import DiagramCache
+
+    problems = []
+    directory = tempfile.mkdtemp(prefix="diagram-cache-")
+    cache = DiagramCache(directory, max_bytes=len(PNG) * args.keys // 2)
+
+    # single flight
+    gets = s3.state.gets
+    await asyncio.gather(*(cache.get("Diagrams/1/fig_0.png") for _ in range(50)))
+    if s3.state.gets - gets != 1:
+        problems.append(f"single flight: 50 concurrent misses made {s3.state.gets - gets} GETs")
+
+    # hits and misses over a skewed key set
+    hit_times, miss_times = [], []
+    keys = [f"Diagrams/{k // 10}/fig_{k % 10}.png" for k in range(args.keys)]
+    for _ in range(args.requests):
+        key = keys[min(int(random.paretovariate(1.2)) - 1, len(keys) - 1)]
+        gets = s3.state.gets
+        start = time.perf_counter()
+        await cache.get(key)
+        (miss_times if s3.state.gets > gets else hit_times).append(time.perf_counter() - start)
+
+    gets = s3.state.gets
+    await cache.get(keys[0])
+    if s3.state.gets != gets:
+        problems.append("hits: the most used diagram was fetched from object storage again")
+
+    # bounded
+    for key in keys:
+        await cache.get(key)
+    on_disk = sum(entry.stat().st_size for entry in os.scandir(directory))
+    if cache.total_bytes > cache.max_bytes or on_disk != cache.total_bytes:
+        problems.append(f"bounded: {cache.total_bytes} bytes indexed, {on_disk} on disk, limit {cache.max_bytes}")
+    if cache._name(keys[-1]) not in cache._entries or cache._name(keys[0]) in cache._entries:
+        problems.append("bounded: eviction didn't remove the least recently used diagrams first")
+
+    # restart
+    restarted = DiagramCache(directory, max_bytes=cache.max_bytes)
+    if list(restarted._entries) != list(cache._entries) or restarted.total_bytes != cache.total_bytes:
+        problems.append("restart: the index rebuilt from disk differs")
+
+    # revalidation
+    restarted.ttl = 0
+    entry = restarted._entries[cache._name(keys[-1])]
+    before = (entry.path, entry.checked_at)
+    await restarted.get(keys[-1])
+    entry = restarted._entries[cache._name(keys[-1])]
+    if entry.path != before[0] or entry.checked_at <= before[1]:
+        problems.append("revalidation: an unchanged diagram was downloaded again")
+
+    # conditional GET
+    response = restarted.response(entry, {"if-none-match": f'"{entry.etag}"'})
+    if response.status_code != 304:
+        problems.append(f"conditional GET: If-None-Match answered with {response.status_code}")
+
+    summary = {
+        "requests": args.requests,
+        "hit_rate": round(len(hit_times) / args.requests, 3),
+        "hit_p50_ms": round(percentile(hit_times, 50) * 1000, 3) if hit_times else None,
+        "miss_p50_ms": round(percentile(miss_times, 50) * 1000, 1) if miss_times else None,
+        "cached_bytes": cache.total_bytes,
+    }
+    return problems, summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--keys", type=int, default=40, help="distinct diagrams; the cache holds half of them")
+    parser.add_argument("--s3-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    s3 = start_fake_s3(args.s3_latency)
+    problems, summary = asyncio.run(check(args, s3))
+    print(json.dumps(summary, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Checks that a voice session's diagram jobs end with the session, on fakes.
+
+Usage:
+    cd app
+    python -m perf.diagram_lifecycle_check
+    python -m perf.diagram_lifecycle_check --sessions 500 --jobs 4
+
+Simulates high churn: every session asks for --jobs diagrams (the fake task never
+finishes on its own) and ends right away. Checks (exit status 1 if any fails):
+- every task that reached the broker was revoked, none kept running,
+- no monitoring task outlives its session,
+- closing a session takes less than --max-close-ms,
+- a diagram requested after the session ended never reaches the broker.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from perf.ws_load_server import FakeDiagramTask
+from perf.ws_writer_check import FakeSocket
+from perf.codegen_load import percentile
+from services.voice import diagram_jobs, diagram_monitoring
+from utils import SocketWriter
+
+
+async def session(task: FakeDiagramTask, jobs: int, close_times: list):
+    client = SocketWriter(FakeSocket(), name="client")
+    agent = SocketWriter(FakeSocket(), name="agent")
+    manager = diagram_jobs.DiagramJobManager(client, agent)
+    for i in range(jobs):
+        await manager.submit(f"diagram {i}", call_id=f"call-{i}")
+    await asyncio.sleep(0.01)  # let the first jobs reach the broker
+
+    start = time.perf_counter()
+    await manager.close()
+    close_times.append(time.perf_counter() - start)
+
+    sent = len(task.started)
+    await manager.submit("too late", call_id="late")
+    late = len(task.started) - sent
+    await client.close()
+    await agent.close()
+    return late
+
+
+async def run(args) -> tuple:
+    task = FakeDiagramTask(latency=3600, storage_url="http://127.0.0.1")
+    diagram_jobs.generate_diagram = task
+    diagram_monitoring.generate_diagram = task
+
+    close_times = []
+    before = len(asyncio.all_tasks())
+    late = sum(await asyncio.gather(*(session(task, args.jobs, close_times) for _ in range(args.sessions))))
+    await asyncio.sleep(0)
+    leftover = len(asyncio.all_tasks()) - before
+
+    problems = []
+    running = set(task.started) - task.revoked
+    if running:
+        problems.append(f"revoke: {len(running)}/{len(task.started)} tasks kept running after their session ended")
+    if leftover > 0:
+        problems.append(f"monitors: {leftover} tasks outlived their session")
+    if late:
+        problems.append(f"late: {late} diagrams requested after the session ended were sent")
+    close_p99 = percentile(close_times, 99)
+    if close_p99 * 1000 > args.max_close_ms:
+        problems.append(f"close: p99 {close_p99 * 1000:.1f}ms > {args.max_close_ms}ms")
+
+    return problems, {
+        "sessions": args.sessions,
+        "tasks_sent": len(task.started),
+        "tasks_revoked": len(task.revoked & set(task.started)),
+        "close_p50_ms": round(percentile(close_times, 50) * 1000, 2),
+        "close_p99_ms": round(close_p99 * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--jobs", type=int, default=3, help="diagrams requested per session")
+    parser.add_argument("--max-close-ms", type=float, default=500.0)
+    args = parser.parse_args()
+
+    problems, result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Local stand-in for the Gemini REST API used by the diagram worker, and for the
+Gemini Live websocket used by the voicebot.
+
+Run it with:
+    cd app
+    uvicorn perf.fake_gemini:app --port 8090
+
+and point the worker at it with GEMINI_BASE_URL=http://127.0.0.1:8090 GOOGLE_API_KEY=fake,
+the web app with GEMINI_WS_URL=ws://127.0.0.1:8090/ws/BidiGenerateContent.
+"""
+
+import os
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+
+from perf import fake_realtime
+
+FAKE_GEMINI_LATENCY = float(os.environ.get("FAKE_GEMINI_LATENCY", 1.0))
+FAKE_GEMINI_TAIL = float(os.environ.get("FAKE_GEMINI_TAIL", 0.2))  # mean of the exponential tail
+# per-model overrides, e.g. "gemini-3-pro-preview=6,gemini-2.5-flash=1"
+FAKE_GEMINI_MODEL_LATENCY = {
+    model: float(latency)
+    for model, latency in (
+        item.split("=") for item in os.environ.get("FAKE_GEMINI_MODEL_LATENCY", "").split(",") if item
+    )
+}
+
+FAKE_CODE = """```python
+import matplotlib.pyplot as plt
+
+fig, ax = plt.subplots(figsize=(6, 6))
+ax.plot([0, 4, 0, 0], [0, 0, 3, 0], 'k-', linewidth=2)
+ax.axis('off')
+plt.savefig("./{fig_name}.png", bbox_inches='tight', dpi=300)
+plt.close(fig)
+```"""
+
+app = FastAPI()
+app.state.in_flight = 0
+app.state.max_in_flight = 0
+app.state.requests = 0
+app.state.live_sessions = 0
+app.state.audio_bytes = 0
+app.state.dropped = 0
+app.state.resumed_sessions = 0
+
+
+def _prompt_text(body: dict) -> str:
+    parts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            parts.append(part.get("text", ""))
+    return "\n".join(parts)
+
+
+@app.post("/{api_version}/models/{model_action}")
+async def generate_content(api_version: str, model_action: str, request: Request):
+    body = await request.json()
+    model = model_action.split(":")[0]
+    latency = FAKE_GEMINI_MODEL_LATENCY.get(model, FAKE_GEMINI_LATENCY)
+    prompt = _prompt_text(body)
+    fig_name = prompt.rsplit("Figure_name:", 1)[-1].strip() if "Figure_name:" in prompt else "fig"
+
+    app.state.requests += 1
+    app.state.in_flight += 1
+    app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+    try:
+        tail = random.expovariate(1 / FAKE_GEMINI_TAIL) if FAKE_GEMINI_TAIL else 0.0
+        await asyncio.sleep(latency + tail)
+    finally:
+        app.state.in_flight -= 1
+
+    return {
+        "candidates": [
+            {
+                "content": {
+                    "role": "model",
+                    "parts": [{"text": FAKE_CODE.format(fig_name=fig_name)}],
+                },
+                "finishReason": "STOP",
+            }
+        ],
+        "modelVersion": model,
+    }
+
+
+async def _live_reply(ws: WebSocket, seconds: float, allow_diagram: bool):
+    await fake_realtime.think()
+    for delta in fake_realtime.reply_chunks(seconds):
+        part = {"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": delta}}
+        await ws.send_json({"serverContent": {"modelTurn": {"parts": [part]}}})
+        await asyncio.sleep(fake_realtime.DELTA_INTERVAL)
+
+    call = fake_realtime.diagram_call() if allow_diagram else None
+    if call:
+        call_id, prompt = call
+        await ws.send_json(
+            {
+                "toolCall": {
+                    "functionCalls": [
+                        {"id": call_id, "name": "generate_diagram", "args": {"prompt": prompt}}
+                    ]
+                }
+            }
+        )
+    await ws.send_json({"serverContent": {"turnComplete": True}})
+    await ws.send_json({"sessionResumptionUpdate": {"newHandle": uuid.uuid4().hex, "resumable": True}})
+
+
+@app.websocket("/ws/{service}")
+async def live(ws: WebSocket, service: str):
+    await ws.accept()
+    app.state.live_sessions += 1
+    heard = 0
+    drop_at = fake_realtime.drop_at()
+    try:
+        while True:
+            message = json.loads(await ws.receive_text())
+
+            if "setup" in message:
+                if message["setup"].get("sessionResumption", {}).get("handle"):
+                    app.state.resumed_sessions += 1
+                await ws.send_json({"setupComplete": {}})
+
+            elif "realtime_input" in message:
+                for chunk in message["realtime_input"].get("media_chunks", []):
+                    audio = len(base64.b64decode(chunk["data"]))
+                    heard += audio
+                    app.state.audio_bytes += audio
+                if heard >= fake_realtime.TURN_BYTES:
+                    heard = 0
+                    await _live_reply(ws, fake_realtime.FAKE_REALTIME_REPLY_AUDIO, allow_diagram=True)
+
+            elif "tool_response" in message:
+                await _live_reply(ws, fake_realtime.CHUNK_SECONDS * 5, allow_diagram=False)
+
+            if time.perf_counter() >= drop_at:
+                app.state.dropped += 1
+                await ws.close(code=fake_realtime.DROP_CODE)
+                return
+
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "requests": app.state.requests,
+        "live_sessions": app.state.live_sessions,
+        "in_flight": app.state.in_flight,
+        "max_in_flight": app.state.max_in_flight,
+        "audio_bytes": app.state.audio_bytes,
+        "dropped": app.state.dropped,
+        "resumed_sessions": app.state.resumed_sessions,
+    }
@@ -0,0 +1,130 @@
+"""Local stand-in for the OpenAI speech and Realtime APIs used by the web app.
+
+Run it with:
+    cd app
+    uvicorn perf.fake_openai:app --port 8091
+
+and point the web app at it with OPENAI_BASE_URL=http://127.0.0.1:8091/v1
+OPENAI_WS_URL=ws://127.0.0.1:8091/v1/realtime OPENAI_API_KEY=fake.
+"""
+
+import os
+import json
+import time
+import base64
+import asyncio
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from perf import fake_realtime
+
+FAKE_TTS_LATENCY = float(os.environ.get("FAKE_TTS_LATENCY", 0.3))  # time to the first byte
+FAKE_TTS_SPEED = float(os.environ.get("FAKE_TTS_SPEED", 10))  # x real time
+FAKE_TTS_WORDS_PER_SECOND = 2.5
+
+app = FastAPI()
+app.state.tts_requests = 0
+app.state.realtime_sessions = 0
+app.state.diagram_calls = 0
+app.state.audio_bytes = 0
+app.state.dropped = 0
+app.state.restored_items = 0
+
+
+@app.post("/v1/audio/speech")
+async def speech(request: Request):
+    body = await request.json()
+    seconds = len(body.get("input", "").split()) / FAKE_TTS_WORDS_PER_SECOND
+    total = int(seconds * fake_realtime.BYTES_PER_SECOND)
+    chunk = bytes(4096)
+    app.state.tts_requests += 1
+
+    async def stream():
+        await asyncio.sleep(FAKE_TTS_LATENCY)
+        sent = 0
+        while sent < total:
+            yield chunk
+            sent += len(chunk)
+            await asyncio.sleep(len(chunk) / fake_realtime.BYTES_PER_SECOND / FAKE_TTS_SPEED)
+
+    return StreamingResponse(stream(), media_type="audio/pcm")
+
+
+async def _reply(ws: WebSocket, seconds: float, allow_diagram: bool):
+    await fake_realtime.think()
+    await ws.send_json({"type": "response.created"})
+    for delta in fake_realtime.reply_chunks(seconds):
+        await ws.send_json({"type": "response.audio.delta", "delta": delta})
+        await asyncio.sleep(fake_realtime.DELTA_INTERVAL)
+    await ws.send_json({"type": "response.audio_transcript.done", "transcript": f"A {seconds:.1f}s answer."})
+
+    call = fake_realtime.diagram_call() if allow_diagram else None
+    if call:
+        app.state.diagram_calls += 1
+        call_id, prompt = call
+        await ws.send_json(
+            {
+                "type": "response.function_call_arguments.done",
+                "name": "generate_diagram",
+                "call_id": call_id,
+                "arguments": json.dumps({"prompt": prompt}),
+            }
+        )
+    await ws.send_json({"type": "response.done"})
+
+
+@app.websocket("/v1/realtime")
+async def realtime(ws: WebSocket):
+    await ws.accept()
+    app.state.realtime_sessions += 1
+    heard, speaking = 0, False
+    drop_at = fake_realtime.drop_at()
+    try:
+        while True:
+            event = json.loads(await ws.receive_text())
+            kind = event.get("type")
+
+            if kind == "session.update":
+                await ws.send_json({"type": "session.created"})
+                await ws.send_json({"type": "session.updated", "session": event.get("session", {})})
+
+            elif kind == "input_audio_buffer.append":
+                if not speaking:
+                    speaking = True
+                    await ws.send_json({"type": "input_audio_buffer.speech_started"})
+                audio = len(base64.b64decode(event["audio"]))
+                heard += audio
+                app.state.audio_bytes += audio
+                if heard >= fake_realtime.TURN_BYTES:
+                    heard, speaking = 0, False
+                    await ws.send_json({"type": "input_audio_buffer.speech_stopped"})
+                    await ws.send_json(
+                        {"type": "conversation.item.input_audio_transcription.completed", "transcript": "A question."}
+                    )
+                    await _reply(ws, fake_realtime.FAKE_REALTIME_REPLY_AUDIO, allow_diagram=True)
+
+            elif kind == "conversation.item.create" and event["item"].get("type") == "message":
+                app.state.restored_items += 1  # the bridge restoring a resumed session
+
+            elif kind == "response.create":  # after a function call output
+                await _reply(ws, fake_realtime.CHUNK_SECONDS * 5, allow_diagram=False)
+
+            if time.perf_counter() >= drop_at:
+                app.state.dropped += 1
+                await ws.close(code=fake_realtime.DROP_CODE)
+                return
+
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "tts_requests": app.state.tts_requests,
+        "realtime_sessions": app.state.realtime_sessions,
+        "diagram_calls": app.state.diagram_calls,
+        "audio_bytes": app.state.audio_bytes,
+        "dropped": app.state.dropped,
+        "restored_items": app.state.restored_items,
+    }
@@ -0,0 +1,55 @@
+"""Conversation behaviour shared by the fake OpenAI Realtime and Gemini Live servers.
+
+A fake session "hears" the student until FAKE_REALTIME_TURN_AUDIO seconds of audio
+arrived, waits FAKE_REALTIME_LATENCY, then replies with FAKE_REALTIME_REPLY_AUDIO
+seconds of audio. With probability FAKE_REALTIME_DIAGRAM_RATE the reply also asks
+for a diagram, so the diagram queue is exercised too. With FAKE_REALTIME_DROP_AFTER
+every connection is closed (1012, service restart) that many seconds after it opened,
+to exercise session resumption.
+"""
+
+import os
+import time
+import base64
+import random
+import asyncio
+import itertools
+
+FAKE_REALTIME_LATENCY = float(os.environ.get("FAKE_REALTIME_LATENCY", 0.4))
+FAKE_REALTIME_TURN_AUDIO = float(os.environ.get("FAKE_REALTIME_TURN_AUDIO", 1.0))
+FAKE_REALTIME_REPLY_AUDIO = float(os.environ.get("FAKE_REALTIME_REPLY_AUDIO", 2.0))
+FAKE_REALTIME_DIAGRAM_RATE = float(os.environ.get("FAKE_REALTIME_DIAGRAM_RATE", 0.0))
+FAKE_REALTIME_DROP_AFTER = float(os.environ.get("FAKE_REALTIME_DROP_AFTER", 0))  # 0 = never
+DROP_CODE = 1012
+
+BYTES_PER_SECOND = 24000 * 2  # pcm16 mono at 24kHz
+CHUNK_SECONDS = 0.1
+# the upstreams stream audio faster than real time
+DELTA_INTERVAL = CHUNK_SECONDS / 4
+
+_CHUNK_B64 = base64.b64encode(bytes(int(BYTES_PER_SECOND * CHUNK_SECONDS))).decode("utf-8")
+_call_ids = itertools.count(1)
+
+TURN_BYTES = int(FAKE_REALTIME_TURN_AUDIO * BYTES_PER_SECOND)
+
+
+def reply_chunks(seconds: float = FAKE_REALTIME_REPLY_AUDIO) -> list:
+    """Base64 pcm chunks making up a reply of `seconds` of silence."""
+    return [_CHUNK_B64] * max(1, int(seconds / CHUNK_SECONDS))
+
+
+def diagram_call() -> tuple:
+    """(call_id, prompt) for a generate_diagram call, or None for a plain reply."""
+    if random.random() >= FAKE_REALTIME_DIAGRAM_RATE:
+        return None
+    n = next(_call_ids)
+    return f"call_{n}", f"Draw a right triangle with legs 3 and {n} and label the hypotenuse"
+
+
+async def think():
+    await asyncio.sleep(FAKE_REALTIME_LATENCY)
+
+
+def drop_at() -> float:
+    """perf_counter time at which a connection opened now is dropped, inf for never."""
+    return time.perf_counter() + FAKE_REALTIME_DROP_AFTER if FAKE_REALTIME_DROP_AFTER else float("inf")
@@ -0,0 +1,81 @@
+"""Local stand-in for the object storage (Tigris) calls made by the web app.
+
+Run it with:
+    cd app
+    uvicorn perf.fake_s3:app --port 8092
+
+and point the web app at it with TIGRIS_STORAGE_ENDPOINT=http://127.0.0.1:8092
+S3_ADDRESSING_STYLE=path (plus any access key/secret). Every lesson gets
+FAKE_S3_FIGURES diagrams (fig_0 ... fig_{n-1}) with a preview each.
+"""
+
+import os
+import asyncio
+import hashlib
+from xml.sax.saxutils import escape
+from fastapi import FastAPI, Request, Response
+
+FAKE_S3_LATENCY = float(os.environ.get("FAKE_S3_LATENCY", 0.02))
+FAKE_S3_FIGURES = int(os.environ.get("FAKE_S3_FIGURES", 3))
+
+# smallest valid png (1x1, transparent)
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082"
+)
+
+app = FastAPI()
+app.state.lists = 0
+app.state.gets = 0
+
+
+def _list_xml(bucket: str, prefix: str) -> str:
+    keys = []
+    if prefix.startswith("Diagrams/"):
+        for n in range(FAKE_S3_FIGURES):
+            keys += [f"{prefix}fig_{n}.png", f"{prefix}fig_{n}_preview.png"]
+
+    contents = "".join(
+        f"<Contents><Key>{escape(key)}</Key><LastModified>2025-01-01T00:00:00.000Z</LastModified>"
+        f"<ETag>&quot;0&quot;</ETag><Size>{len(PNG)}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+        for key in keys
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+        f"<KeyCount>{len(keys)}</KeyCount><MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>"
+        f"{contents}</ListBucketResult>"
+    )
+
+
+# registered before the bucket routes so it isn't taken for a bucket name
+@app.get("/stats")
+async def stats():
+    return {"lists": app.state.lists, "gets": app.state.gets}
+
+
+@app.get("/{bucket}")
+async def list_objects(bucket: str, request: Request):
+    await asyncio.sleep(FAKE_S3_LATENCY)
+    app.state.lists += 1
+    prefix = request.query_params.get("prefix", "")
+    return Response(content=_list_xml(bucket, prefix), media_type="application/xml")
+
+
+PNG_ETAG = f'"{hashlib.md5(PNG).hexdigest()}"'
+
+
+@app.get("/{bucket}/{key:path}")
+async def get_object(bucket: str, key: str, request: Request):
+    await asyncio.sleep(FAKE_S3_LATENCY)
+    app.state.gets += 1
+    if request.headers.get("if-none-match") == PNG_ETAG:
+        return Response(status_code=304, headers={"ETag": PNG_ETAG})
+    return Response(content=PNG, media_type="image/png", headers={"ETag": PNG_ETAG})
+
+
+@app.put("/{bucket}/{key:path}")
+async def put_object(bucket: str, key: str, request: Request):
+    await request.body()
+    return Response(status_code=200, headers={"ETag": '"0"'})
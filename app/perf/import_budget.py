@@ -0,0 +1,94 @@
+"""Import-time budget for the web app and the celery app.
+
+Usage:
+    cd app
+    python -m perf.import_budget                 # report
+    python -m perf.import_budget --check         # CI: exit 1 when over budget
+    python -m perf.import_budget --update        # set max_ms from this machine (+ headroom)
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for every
+module in perf/import_budget.json and reports the total import time and the
+heaviest imports. A module fails the check when it imports a forbidden package
+(heavy SDKs that must only load on first use) or takes longer than max_ms.
+`max_ms` is machine dependent: set it with --update on the image you deploy.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BUDGET_PATH = os.path.join(os.path.dirname(__file__), "import_budget.json")
+
+
+def measure(module: str, repeat: int = 3) -> dict:
+    """Best of `repeat` cold imports: total ms and per-module cumulative ms."""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+        cumulative = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            if cumulative_us.isdigit():
+                cumulative[name] = int(cumulative_us) / 1000
+        total = cumulative.get(module, 0.0)
+        if best is None or total < best["total_ms"]:
+            best = {"total_ms": round(total, 1), "modules": cumulative}
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--update", action="store_true", help="write max_ms = measured * (1 + headroom)")
+    parser.add_argument("--headroom", type=float, default=0.3)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(BUDGET_PATH) as file:
+        budget = json.load(file)
+
+    failures = []
+    for module, limits in budget.items():
+        result = measure(module)
+        imported = set(result["modules"])
+        heaviest = sorted(
+            ((ms, name) for name, ms in result["modules"].items() if name != module), reverse=True
+        )[: args.top]
+
+        print(f"{module}: {result['total_ms']} ms (budget {limits.get('max_ms')} ms)")
+        for ms, name in heaviest:
+            print(f"    {ms:>8.1f} ms  {name}")
+
+        for name in limits.get("forbidden", []):
+            if name in imported:
+                failures.append(f"{module} imports {name} at import time")
+        if limits.get("max_ms") and result["total_ms"] > limits["max_ms"]:
+            failures.append(f"{module} took {result['total_ms']} ms > {limits['max_ms']} ms")
+
+        if args.update:
+            limits["max_ms"] = round(result["total_ms"] * (1 + args.headroom))
+
+    if args.update:
+        with open(BUDGET_PATH, "w") as file:
+            json.dump(budget, file, indent=2)
+            file.write("\n")
+
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Compares serving lessons from the compiled snapshot against the database path.
+
+Usage:
+    cd app
+    python -m perf.lesson_source_bench --lessons 500 --steps 8
+
+Builds a synthetic lesson database in a temporary sqlite file, exports it to a
+snapshot and reports, for each source, the time to the first lesson (connect/open
++ first load), per-lesson load latency percentiles and the resident memory added.
+"""
+
+import os
+import time
+import json
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import statistics
+
+from Database.migrations import apply_migrations
+from Database.replica import EmbeddedReplica
+from Database.snapshot import LessonSnapshot, export_lessons, write_snapshot
+from Database.lessons import load_lesson
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def build_database(path: str, lessons: int, steps: int):
+    conn = sqlite3.connect(path)
+    apply_migrations(conn)
+    text = "The square of the hypotenuse equals the sum of the squares of the other two sides. " * 6
+    for lesson_id in range(1, lessons + 1):
+        conn.execute("INSERT INTO lessons VALUES (?, ?)", (lesson_id, f"Lesson {lesson_id}"))
+        conn.execute("INSERT INTO contexts VALUES (?, ?)", (lesson_id, text))
+        conn.execute("INSERT INTO conclusions VALUES (?, ?)", (lesson_id, text))
+        for n in range(3):
+            conn.execute("INSERT INTO context_snippets VALUES (?, ?, ?)", (lesson_id, n, text[:80]))
+            conn.execute("INSERT INTO conclusion_snippets VALUES (?, ?, ?)", (lesson_id, n, text[:80]))
+        for step in range(steps):
+            conn.execute("INSERT INTO explanation_steps VALUES (?, ?, ?)", (lesson_id, step, text))
+            conn.execute("INSERT INTO tts_steps VALUES (?, ?, ?)", (lesson_id, step, text))
+            for n in range(3):
+                conn.execute(
+                    "INSERT INTO step_snippets VALUES (?, ?, ?, ?)", (lesson_id, step, n, text[:80])
+                )
+    conn.commit()
+    conn.close()
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[int(0.99 * (len(latencies) - 1))] * 1000, 3),
+    }
+
+
+async def bench_db(primary: str, replica: str, ids: list) -> dict:
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    db = EmbeddedReplica(replica, primary_path=primary)
+    await load_lesson(db, ids[0])
+    first = time.perf_counter() - start
+
+    latencies = []
+    for concept_id in ids:
+        start = time.perf_counter()
+        await load_lesson(db, concept_id)
+        latencies.append(time.perf_counter() - start)
+    result = {"first_lesson_ms": round(first * 1000, 3), **summarize(latencies), "rss_added_kb": rss_kb() - rss_before}
+    await db.close()
+    return result
+
+
+def bench_snapshot(path: str, ids: list) -> dict:
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    snapshot = LessonSnapshot(path)
+    snapshot.get(ids[0])
+    first = time.perf_counter() - start
+
+    latencies = []
+    for concept_id in ids:
+        start = time.perf_counter()
+        snapshot.get(concept_id)
+        latencies.append(time.perf_counter() - start)
+    result = {"first_lesson_ms": round(first * 1000, 3), **summarize(latencies), "rss_added_kb": rss_kb() - rss_before}
+    snapshot.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lessons", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = os.path.join(tmp, "lessons.db")
+        snap = os.path.join(tmp, "lessons.snap")
+        build_database(primary, args.lessons, args.steps)
+
+        async def export():
+            db = EmbeddedReplica(os.path.join(tmp, "export.db"), primary_path=primary)
+            lessons = await export_lessons(db, with_diagrams=False)
+            await db.close()
+            return lessons
+
+        write_snapshot(snap, asyncio.run(export()))
+        ids = list(range(1, args.lessons + 1))
+
+        report = {
+            "db_bytes": os.path.getsize(primary),
+            "snapshot_bytes": os.path.getsize(snap),
+            "snapshot": bench_snapshot(snap, ids),
+            "db": asyncio.run(bench_db(primary, os.path.join(tmp, "replica.db"), ids)),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
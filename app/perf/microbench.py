@@ -0,0 +1,275 @@
+"""Microbenchmarks for the per-message audio and messaging hot paths.
+
+Usage:
+    cd app
+    python -m perf.microbench                       # run all, append to the history
+    python -m perf.microbench -k mic                # only benchmarks matching "mic"
+    python -m perf.microbench --check               # exit 1 on a regression vs the last run
+    python -m perf.microbench --no-save             # don't record this run
+
+Results (best-of-repeats time per call) are appended to a JSON lines history
+file, one record per run with the git revision, so runs can be compared over
+time. `--check` compares against the most recent record from the same Python
+version and fails if a benchmark got slower than --max-regression.
+
+Payload sizes follow what a session actually sends: TTS is streamed in 4096 byte
+chunks (`tts_openai`), the browser client posts one 128-frame pcm16 render
+quantum (256 bytes) per `audio_chunk`, and the realtime upstreams send ~100ms of
+24kHz pcm16 per audio delta.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import platform
+import subprocess
+
+TTS_CHUNK = os.urandom(4096)
+MIC_CHUNK = os.urandom(256)
+UPSTREAM_AUDIO = os.urandom(4800)
+
+MIC_MESSAGE = json.dumps({"type": "audio_chunk", "chunk": MIC_CHUNK.hex()})
+OPENAI_AUDIO_DELTA = json.dumps(
+    {
+        "type": "response.audio.delta",
+        "event_id": "event_B3nhIuDJhcVnFxu9mOyjG",
+        "response_id": "resp_B3nhHc2GJ9YUjQVgUnnjS",
+        "item_id": "item_B3nhHYmUvmKzWmgAhDbCN",
+        "output_index": 0,
+        "content_index": 0,
+        "delta": base64.b64encode(UPSTREAM_AUDIO).decode("utf-8"),
+    }
+)
+OPENAI_SMALL_EVENT = json.dumps(
+    {
+        "type": "input_audio_buffer.speech_started",
+        "event_id": "event_B3nhIuDJhcVnFxu9mOyjH",
+        "audio_start_ms": 1000,
+        "item_id": "item_B3nhHYmUvmKzWmgAhDbCN",
+    }
+)
+GEMINI_AUDIO_DELTA = json.dumps(
+    {
+        "serverContent": {
+            "modelTurn": {
+                "parts": [
+                    {
+                        "inlineData": {
+                            "mimeType": "audio/pcm;rate=24000",
+                            "data": base64.b64encode(UPSTREAM_AUDIO).decode("utf-8"),
+                        }
+                    }
+                ]
+            }
+        }
+    }
+)
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """Registers a zero-argument function (or coroutine function) as a benchmark."""
+
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+# --- narration (tts_openai / route) ---
+@benchmark("tts_chunk_hex")
+def tts_chunk_hex():
+    TTS_CHUNK.hex()
+
+
+@benchmark("tts_chunk_message")
+def tts_chunk_message():
+    # what websocket.send_json does with every AUDIO_CHUNK
+    json.dumps({"status": "connected", "type": "AUDIO_CHUNK", "data": TTS_CHUNK.hex()})
+
+
+# --- client -> upstream (client_to_ai) ---
+@benchmark("mic_chunk_to_openai")
+def mic_chunk_to_openai():
+    data = json.loads(MIC_MESSAGE)
+    b64 = base64.b64encode(bytes.fromhex(data["chunk"])).decode("utf-8")
+    json.dumps({"type": "input_audio_buffer.append", "audio": b64})
+
+
+@benchmark("mic_chunk_to_gemini")
+def mic_chunk_to_gemini():
+    data = json.loads(MIC_MESSAGE)
+    b64 = base64.b64encode(bytes.fromhex(data["chunk"])).decode("utf-8")
+    json.dumps({"realtime_input": {"media_chunks": [{"data": b64, "mime_type": "audio/pcm"}]}})
+
+
+# --- upstream -> client (ai_to_client) ---
+@benchmark("openai_event_loads_audio_delta")
+def openai_event_loads_audio_delta():
+    json.loads(OPENAI_AUDIO_DELTA)
+
+
+@benchmark("openai_event_loads_small")
+def openai_event_loads_small():
+    json.loads(OPENAI_SMALL_EVENT)
+
+
+@benchmark("gemini_audio_delta_forward")
+def gemini_audio_delta_forward():
+    response = json.loads(GEMINI_AUDIO_DELTA)
+    for part in response["serverContent"]["modelTurn"]["parts"]:
+        json.dumps({"type": "AUDIO_DELTA", "delta": part["inlineData"]["data"]})
+
+
+# --- SocketWriter ---
+class _LibSocket:
+    """Looks like a `websockets` client connection to SocketWriter."""
+
+    async def send(self, message):
+        pass
+
+
+def _fastapi_socket():
+    from starlette.websockets import WebSocket
+
+    async def receive():
+        return {"type": "websocket.connect"}
+
+    async def send(message):
+        pass
+
+    ws = WebSocket({"type": "websocket", "path": "/", "headers": []}, receive, send)
+    asyncio.get_event_loop().run_until_complete(ws.accept())
+    return ws
+
+
+_SMALL_MESSAGE = {"type": "INTERRUPT_PLAYBACK"}
+_sockets = {}
+_writers = {}
+
+
+@benchmark("socket_writer_fastapi")
+async def socket_writer_fastapi():
+    # bulk lane: the caller waits whenever the queue is full, so this includes the drain
+    await _writers["fastapi"].send(_SMALL_MESSAGE, bulk=True)
+
+
+@benchmark("socket_writer_websockets")
+async def socket_writer_websockets():
+    await _writers["lib"].send(_SMALL_MESSAGE, bulk=True)
+
+
+@benchmark("fastapi_send_text_direct")
+async def fastapi_send_text_direct():
+    # the floor socket_writer_fastapi is compared against
+    await _sockets["fastapi"].send_text(json.dumps(_SMALL_MESSAGE))
+
+
+def _prepare(names: list):
+    if any(name.startswith(("socket_writer", "fastapi_")) for name in names):
+        from utils import SocketWriter
+
+        _sockets["fastapi"] = _fastapi_socket()
+        _sockets["lib"] = _LibSocket()
+        _writers["fastapi"] = SocketWriter(_sockets["fastapi"], name="bench")
+        _writers["lib"] = SocketWriter(_sockets["lib"], name="bench")
+
+
+def _timed_batch(fn, number: int) -> float:
+    if asyncio.iscoroutinefunction(fn):
+
+        async def batch():
+            for _ in range(number):
+                await fn()
+
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        loop.run_until_complete(batch())
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+
+def measure(fn, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """Best time per call in nanoseconds, over `repeat` batches of >= `min_time` seconds."""
+    number = 1
+    while _timed_batch(fn, number) < min_time:
+        number *= 2
+    times = [_timed_batch(fn, number) / number for _ in range(repeat)]
+    return {"ns": round(min(times) * 1e9, 1), "calls": number}
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _last_record(history: str) -> dict:
+    if not os.path.exists(history):
+        return None
+    last = None
+    with open(history) as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get("python") == platform.python_version():
+                last = record
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", dest="keyword", default="", help="only run benchmarks containing this")
+    parser.add_argument("--history", default="perf/microbench_history.jsonl")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="fail on a regression vs the last run")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    names = [name for name in BENCHMARKS if args.keyword in name]
+    _prepare(names)
+    previous = _last_record(args.history)
+
+    results, regressions = {}, []
+    for name in names:
+        results[name] = measure(BENCHMARKS[name], repeat=args.repeat)
+        line = f"{name:<34} {results[name]['ns']:>10.1f} ns"
+        before = (previous or {}).get("results", {}).get(name)
+        if before:
+            change = results[name]["ns"] / before["ns"] - 1
+            line += f"  {change:+.1%} vs {previous.get('revision')}"
+            if change > args.max_regression:
+                regressions.append(name)
+        print(line)
+
+    if not args.no_save:
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "results": results,
+        }
+        with open(args.history, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+    if args.check and regressions:
+        print(f"Regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
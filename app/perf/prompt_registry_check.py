@@ -0,0 +1,97 @@
+"""Checks that the prompt registry loads and renders prompts as they are used.
+
+Usage:
+    cd app
+    python -m perf.prompt_registry_check
+
+Checks (exit status 1 if any fails):
+- shipped prompts: the prompts and session configs in the tree load,
+- verbatim: a coder prompt with literal braces (a dict and a set in a code example)
+  loads and its text is served unchanged,
+- fields: a summarizer prompt renders its {max_words} field,
+- strict: a voice prompt with a format spec or an unknown field is rejected.
+"""
+
+import sys
+import json
+import tempfile
+import importlib
+from pathlib import Path
+
+registry_module = importlib.import_module("llm.registry.registry")
+
+CODER_PROMPT = """Write a manim scene.
+Example:
+    colors = {"primary": BLUE, "accent": YELLOW}
+    seen = {1, 2, 3}
+    label = f"{name}: {value:.2f}"
+"""
+SUMMARY_PROMPT = "Summarize the lesson. Write at most {max_words} words."
+VOICE_PROMPT = "Explain {concept} using {context}. Steps so far: {steps_text}"
+
+
+def write_prompts(folder: Path, coder: str, summary: str, voice: str) -> dict:
+    files = {}
+    for type_, text in (("VOICE_AGENT", voice), ("CODER", coder), ("SUMMARIZER", summary)):
+        path = folder / f"{type_.lower()}.yaml"
+        # json is valid yaml and keeps the prompts exactly as written
+        path.write_text(json.dumps({"versions": {"1.0": {"SYSTEM_PROMPT": text}}}), encoding="utf-8")
+        files[type_] = path
+    return files
+
+
+def load_with(files: dict):
+    """A fresh registry reading `files` instead of the shipped prompts."""
+    shipped = dict(registry_module.PROMPT_FILES)
+    registry_module.PROMPT_FILES.update(files)
+    try:
+        registry = registry_module.PromptRegistry()
+        registry.load()
+        return registry
+    finally:
+        registry_module.PROMPT_FILES.update(shipped)
+
+
+def check() -> list:
+    problems = []
+
+    try:
+        registry_module.PromptRegistry().load()
+    except Exception as e:
+        problems.append(f"shipped prompts: loading failed: {e!r}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp)
+        try:
+            registry = load_with(write_prompts(folder, CODER_PROMPT, SUMMARY_PROMPT, VOICE_PROMPT))
+        except Exception as e:
+            return problems + [f"verbatim: a coder prompt with braces stopped the registry from loading: {e!r}"]
+
+        coder = registry.prompt("CODER")
+        if coder.text != CODER_PROMPT or coder.render() != CODER_PROMPT or coder.fields:
+            problems.append("verbatim: the coder prompt was changed on load")
+
+        summary = registry.prompt("SUMMARIZER").render(max_words=80)
+        if summary != "Summarize the lesson. Write at most 80 words.":
+            problems.append(f"fields: the summarizer prompt rendered as {summary!r}")
+
+        for voice in ("Explain {concept:>10}", "Explain {concept} to {student}"):
+            try:
+                load_with(write_prompts(folder, CODER_PROMPT, SUMMARY_PROMPT, voice))
+                problems.append(f"strict: the voice prompt {voice!r} was accepted")
+            except (ValueError, KeyError):
+                pass
+
+    return problems
+
+
+def main():
+    problems = check()
+    for problem in problems:
+        print(problem)
+    print("ok" if not problems else f"{len(problems)} problem(s)")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
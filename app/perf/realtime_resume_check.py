@@ -0,0 +1,242 @@
+"""Drops the realtime upstream mid-session and checks the bridges resume it.
+
+Usage:
+    cd app
+    python -m perf.realtime_resume_check
+    python -m perf.realtime_resume_check --seconds 20 --drop-after 3 --providers gemini
+
+Each bridge (`handle_voicebot_session_openai`/`_gemini`) runs against a fake student
+streaming mic audio and the fake upstream (perf/fake_openai.py, perf/fake_gemini.py),
+which closes every connection --drop-after seconds after it opened.
+
+Checks (exit status 1 if any fails):
+- session: the voicebot session lasts until the student leaves, drops or not,
+- resumed: every drop is followed by VOICEBOT_RECONNECTING and VOICEBOT_RESUMED, and
+  the upstream keeps answering afterwards,
+- restored: the new connection gets the conversation so far (OpenAI transcript items,
+  Gemini resumption handle),
+- audio: the student's audio reaches the upstream; only what was in flight at each drop
+  is lost (the fake doesn't read while it answers, so that can be a few chunks),
+- give up: an upstream that can't be reached again ends the session within the budget.
+Reconnect times are printed too.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+from perf.codegen_load import _free_port, percentile
+
+CHUNK_SECONDS = 0.1
+CHUNK_BYTES = int(24000 * 2 * CHUNK_SECONDS)
+# unread by the fake when it drops: it doesn't read while thinking and streaming a reply
+LOST_CHUNKS_PER_DROP = 4
+
+
+def start_fake_upstreams(args) -> tuple:
+    import uvicorn
+
+    # read by the fakes at import time
+    os.environ["FAKE_REALTIME_DROP_AFTER"] = str(args.drop_after)
+    os.environ["FAKE_REALTIME_LATENCY"] = "0.05"
+    os.environ["FAKE_REALTIME_TURN_AUDIO"] = "0.5"
+    os.environ["FAKE_REALTIME_REPLY_AUDIO"] = "0.3"
+    from perf import fake_openai, fake_gemini
+
+    ports = []
+    for app in (fake_openai.app, fake_gemini.app):
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                sys.exit("fake upstream didn't start")
+            time.sleep(0.05)
+        ports.append(port)
+
+    # must be set before the bridges are imported
+    os.environ["OPENAI_WS_URL"] = f"ws://127.0.0.1:{ports[0]}/v1/realtime"
+    os.environ["GEMINI_WS_URL"] = f"ws://127.0.0.1:{ports[1]}/ws/BidiGenerateContent"
+    os.environ["SESSION_RECORD_DIR"] = ""
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    return fake_openai, fake_gemini
+
+
+class Student:
+    """Fake client websocket: streams mic audio for `seconds` (at `speed` x real time),
+    then leaves the voicebot. Logs what the bridge sends it."""
+
+    def __init__(self, seconds: float, speed: float):
+        self.chunks = int(seconds / CHUNK_SECONDS)
+        self.interval = CHUNK_SECONDS / speed
+        self.sent = 0
+        self.left = False
+        self.received = []  # (time, type)
+        self._connected = False
+
+    async def receive(self):
+        if not self._connected:
+            self._connected = True
+            return {"type": "websocket.connect"}
+        if self.sent < self.chunks:
+            await asyncio.sleep(self.interval)
+            self.sent += 1
+            return {"type": "websocket.receive", "text": json.dumps({"type": "audio_chunk", "chunk": "00" * CHUNK_BYTES})}
+        self.left = True
+        return {"type": "websocket.receive", "text": json.dumps({"type": "exit_voicebot"})}
+
+    async def send(self, message):
+        if message["type"] != "websocket.send":
+            return
+        data = json.loads(message["text"])
+        for item in data["messages"] if data.get("type") == "BATCH" else [data]:
+            self.received.append((time.perf_counter(), item.get("type"), item))
+
+    def kinds(self, kind: str) -> list:
+        return [entry for entry in self.received if entry[1] == kind]
+
+
+async def run_session(args, provider: str, bridge, fake) -> tuple:
+    """One voicebot session through `bridge`; `fake` is the fake upstream's module."""
+    from starlette.websockets import WebSocket
+
+    problems = []
+    before = await fake.stats()
+    student = Student(args.seconds, args.speed)
+    client_ws = WebSocket({"type": "websocket", "path": "/resume", "headers": []}, student.receive, student.send)
+    await client_ws.accept()
+
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(bridge(client_ws, "Resumed session."), timeout=args.seconds / args.speed * 3 + 30)
+    except Exception as e:
+        problems.append(f"session: bridge failed with {type(e).__name__}: {e}")
+    took = time.perf_counter() - start
+
+    stats = {key: value - before[key] for key, value in (await fake.stats()).items()}
+    reconnecting, resumed = student.kinds("VOICEBOT_RECONNECTING"), student.kinds("VOICEBOT_RESUMED")
+    audio_kind = "response.audio.delta" if provider == "openai" else "AUDIO_DELTA"
+
+    if not student.left:
+        problems.append(f"session: ended after {took:.1f}s, before the student left")
+    if stats["dropped"] == 0:
+        problems.append("resumed: the fake upstream never dropped, use a smaller --drop-after")
+    if not len(reconnecting) == len(resumed) == stats["dropped"]:
+        problems.append(
+            f"resumed: {stats['dropped']} drops, {len(reconnecting)} RECONNECTING, {len(resumed)} RESUMED"
+        )
+    if resumed and not any(t > resumed[0][0] for t, kind, _ in student.received if kind == audio_kind):
+        problems.append("resumed: no audio from the upstream after resuming")
+
+    restored = stats["restored_items"] if provider == "openai" else stats["resumed_sessions"]
+    if stats["dropped"] and not restored:
+        problems.append("restored: the new connections didn't get the conversation so far")
+
+    sent_bytes = student.sent * CHUNK_BYTES
+    lost = sent_bytes - stats["audio_bytes"]
+    if lost < 0 or lost > CHUNK_BYTES * LOST_CHUNKS_PER_DROP * max(1, stats["dropped"]):
+        problems.append(f"audio: {stats['audio_bytes']} of {sent_bytes} bytes of student audio reached the upstream")
+
+    gaps = [entry[2]["gap_ms"] for entry in resumed]
+    summary = {
+        "provider": provider,
+        "session_s": round(took, 2),
+        "drops": stats["dropped"],
+        "restored": restored,
+        "audio_lost_chunks": lost // CHUNK_BYTES,
+        "reconnect_p50_ms": percentile(gaps, 50) if gaps else None,
+        "reconnect_max_ms": max(gaps) if gaps else None,
+    }
+    return problems, summary
+
+
+async def check_give_up(args) -> list:
+    """A reconnect that keeps failing ends the session with the original ConnectionClosed."""
+    from websockets.exceptions import ConnectionClosed
+    from services.voice.session_recording import connect_upstream
+    from services.voice.upstream_resume import ResumableUpstream, OpenAIResume
+
+    connections = []
+
+    def connect():
+        connections.append(time.perf_counter())
+        if len(connections) > 1:
+            raise ConnectionRefusedError("upstream is gone")
+        return connect_upstream("openai", os.environ["OPENAI_WS_URL"])
+
+    budget = 1.0
+    upstream = ResumableUpstream(connect, OpenAIResume('{"type": "session.update", "session": {}}'), budget=budget)
+
+    async def talk():
+        # the fake drops on a message once the connection is old enough
+        while True:
+            await upstream.send(json.dumps({"type": "input_audio_buffer.append", "audio": ""}))
+            await asyncio.sleep(0.05)
+
+    async with upstream:
+        talker = asyncio.create_task(talk())
+        try:
+            while True:
+                await asyncio.wait_for(upstream.recv(), timeout=args.drop_after + 5)
+        except ConnectionClosed:
+            took = time.perf_counter() - connections[-1]
+        except asyncio.TimeoutError:
+            return ["give up: the fake upstream never dropped"]
+        finally:
+            talker.cancel()
+            await asyncio.wait([talker])
+            if not talker.cancelled():
+                talker.exception()  # the same ConnectionClosed, once sending failed too
+
+    if len(connections) < 2:
+        return ["give up: no reconnect was attempted"]
+    if took > budget + 0.5:
+        return [f"give up: took {took:.1f}s after the drop to end the session, budget {budget}s"]
+    return []
+
+
+async def run(args, fakes: dict) -> tuple:
+    from perf.ws_load_server import FakeDiagramTask
+    from services.voice import diagram_jobs, diagram_monitoring
+    from services.voice import handle_voicebot_session_openai, handle_voicebot_session_gemini
+
+    diagram_task = FakeDiagramTask(0.0, "http://127.0.0.1")
+    diagram_jobs.generate_diagram = diagram_task
+    diagram_monitoring.generate_diagram = diagram_task
+    bridges = {"openai": handle_voicebot_session_openai, "gemini": handle_voicebot_session_gemini}
+
+    problems, summaries = [], []
+    for provider in args.providers:
+        found, summary = await run_session(args, provider, bridges[provider], fakes[provider])
+        print(f"{provider:<18} {'ok' if not found else 'FAILED'}")
+        problems += [f"{provider} {problem}" for problem in found]
+        summaries.append(summary)
+
+    found = await check_give_up(args)
+    print(f"{'give up':<18} {'ok' if not found else 'FAILED'}")
+    return problems + found, summaries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=8, help="seconds of student audio per session")
+    parser.add_argument("--speed", type=float, default=2, help="the student talks this many times faster")
+    parser.add_argument("--drop-after", type=float, default=1.5, help="the fake drops connections this old")
+    parser.add_argument("--providers", nargs="+", default=["openai", "gemini"], choices=["openai", "gemini"])
+    args = parser.parse_args()
+
+    fake_openai, fake_gemini = start_fake_upstreams(args)
+    problems, summaries = asyncio.run(run(args, {"openai": fake_openai, "gemini": fake_gemini}))
+    print(json.dumps(summaries, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
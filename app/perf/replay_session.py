@@ -0,0 +1,280 @@
+"""Replays recorded voicebot sessions through the bridges and checks latency and ordering.
+
+Record sessions by starting the web app with SESSION_RECORD_DIR=recordings (see
+services/voice/session_recording.py), then:
+    cd app
+    python -m perf.replay_session recordings/openai-20250101-120000-1a2b3c4d.jsonl
+    python -m perf.replay_session recordings/*.jsonl --speed 10 --max-p99-ms 20
+
+The bridge (`handle_voicebot_session_openai`/`_gemini`) runs against a fake client
+and a fake upstream that replay the recording:
+- client messages are sent at their recorded offsets (a student talks in real time),
+- upstream messages are sent the recorded delay after the bridge message that
+  preceded them, so the upstream reacts to the bridge like it did when recorded,
+- diagram requests are answered by a stub task with the recorded latency.
+`--speed` divides every delay. A session fails when the bridge's non-audio
+messages to either side come out in a different order than recorded, when the
+audio message counts differ, or when the p99 time the bridge takes to forward
+audio (either direction) is over --max-p99-ms. Exits with status 1 on any failure.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from perf.codegen_load import _free_port, percentile
+
+CLIENT_AUDIO = ("audio_chunk",)
+UPSTREAM_AUDIO_IN = ("response.audio.delta", "serverContent.audio")
+UPSTREAM_AUDIO_OUT = ("input_audio_buffer.append", "realtime_input")
+CLIENT_AUDIO_OUT = ("response.audio.delta", "AUDIO_DELTA")
+
+
+def event_kind(text: str) -> str:
+    """The "type" of an OpenAI/client message, the top-level key of a Gemini one."""
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return "?"
+    if not isinstance(data, dict):
+        return "?"
+    if "type" in data:
+        return data["type"]
+    if "serverContent" in data and (data["serverContent"].get("modelTurn") or {}).get("parts"):
+        return "serverContent.audio"
+    return next(iter(data), "?")
+
+
+def is_audio(side: str, direction: str, kind: str) -> bool:
+    if side == "client":
+        return kind in (CLIENT_AUDIO if direction == "in" else CLIENT_AUDIO_OUT)
+    return kind in (UPSTREAM_AUDIO_IN if direction == "in" else UPSTREAM_AUDIO_OUT)
+
+
+def load_recording(path: str) -> tuple:
+    with open(path, encoding="utf-8") as file:
+        header = json.loads(file.readline())
+        events = [json.loads(line) for line in file if line.strip()]
+    for event in events:
+        event["kind"] = event_kind(event["data"])
+    return header, events
+
+
+def recorded_diagram_latency(events: list, default: float = 3.0) -> float:
+    started, latencies = [], []
+    for event in events:
+        if event["side"] != "client" or event["dir"] != "out":
+            continue
+        if event["kind"] == "DIAGRAM_INITIATED":
+            started.append(event["t"])
+        elif event["kind"] in ("DIAGRAM_READY", "DIAGRAM_FAILED") and started:
+            latencies.append(event["t"] - started.pop(0))
+    return sorted(latencies)[len(latencies) // 2] if latencies else default
+
+
+class SessionReplay:
+    """Drives one bridge session from a recording and logs what the bridge did."""
+
+    def __init__(self, events: list, speed: float):
+        self.speed = speed
+        self.client_in = [e for e in events if e["side"] == "client" and e["dir"] == "in"]
+        self.upstream_in = []  # (anchor index, delay, event)
+        upstream_out_times = []
+        connected_at = next((e["t"] for e in events if e["dir"] == "open"), 0.0)
+        for event in events:
+            if event["side"] != "upstream":
+                continue
+            if event["dir"] == "out":
+                upstream_out_times.append(event["t"])
+            elif event["dir"] == "in":
+                anchor_time = upstream_out_times[-1] if upstream_out_times else connected_at
+                self.upstream_in.append((len(upstream_out_times), event["t"] - anchor_time, event))
+
+        self.log = []  # (time, side, dir, kind) as seen at the fakes
+        self.start = None
+        self.upstream_connected = None
+        self.upstream_out_times = []
+        self._client_events = None
+        self._upstream_out = asyncio.Condition()
+        self._upstream_replayed = asyncio.Event()
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.start
+
+    async def _sleep_until(self, at: float):
+        delay = at - self._now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # --- fake client (ASGI side of a starlette WebSocket) ---
+    async def client_receive(self):
+        if self._client_events is None:
+            self._client_events = iter(self.client_in)
+            return {"type": "websocket.connect"}
+        event = next(self._client_events, None)
+        if event is None:
+            # the recording ended without exit_voicebot, leave once the upstream is done
+            await self._upstream_replayed.wait()
+            return {"type": "websocket.disconnect", "code": 1000}
+        await self._sleep_until(event["t"] / self.speed)
+        self.log.append((self._now(), "client", "in", event["kind"]))
+        return {"type": "websocket.receive", "text": event["data"]}
+
+    async def client_send(self, message):
+        if message["type"] == "websocket.send":
+            self.log.append((self._now(), "client", "out", event_kind(message.get("text"))))
+
+    # --- fake upstream ---
+    async def upstream_handler(self, ws):
+        self.upstream_connected = self._now()
+        sender = asyncio.create_task(self._replay_upstream(ws))
+        try:
+            async for message in ws:
+                now = self._now()
+                self.log.append((now, "upstream", "out", event_kind(message)))
+                async with self._upstream_out:
+                    self.upstream_out_times.append(now)
+                    self._upstream_out.notify_all()
+        finally:
+            sender.cancel()
+
+    async def _replay_upstream(self, ws):
+        for anchor, delay, event in self.upstream_in:
+            async with self._upstream_out:
+                await self._upstream_out.wait_for(lambda: len(self.upstream_out_times) >= anchor)
+            anchor_time = self.upstream_out_times[anchor - 1] if anchor else self.upstream_connected
+            await self._sleep_until(anchor_time + delay / self.speed)
+            self.log.append((self._now(), "upstream", "in", event["kind"]))
+            await ws.send(event["data"])
+        self._upstream_replayed.set()
+
+    async def run(self, bridge, timeout: float):
+        from starlette.websockets import WebSocket
+
+        scope = {"type": "websocket", "path": "/replay", "headers": []}
+        client_ws = WebSocket(scope, self.client_receive, self.client_send)
+        await client_ws.accept()
+        self.start = time.perf_counter()
+        await asyncio.wait_for(bridge(client_ws, "Replayed session."), timeout=timeout)
+
+
+def compare(recorded: list, replayed: list, strict: bool) -> list:
+    """Ordering and audio count differences between the recording and the replay."""
+    problems = []
+    for side, direction in (("client", "out"), ("upstream", "out")):
+        expected = [k for s, d, k in recorded if s == side and d == direction]
+        actual = [k for s, d, k in replayed if s == side and d == direction]
+        if not strict:
+            audio_expected = sum(is_audio(side, direction, k) for k in expected)
+            audio_actual = sum(is_audio(side, direction, k) for k in actual)
+            if audio_expected != audio_actual:
+                problems.append(f"{side} {direction}: {audio_actual} audio messages, recorded {audio_expected}")
+            expected = [k for k in expected if not is_audio(side, direction, k)]
+            actual = [k for k in actual if not is_audio(side, direction, k)]
+        for i, (want, got) in enumerate(zip(expected, actual)):
+            if want != got:
+                problems.append(f"{side} {direction} #{i}: got {got}, recorded {want}")
+                break
+        else:
+            if len(expected) != len(actual):
+                problems.append(f"{side} {direction}: {len(actual)} messages, recorded {len(expected)}")
+    return problems
+
+
+def forwarding_latencies(log: list, source: tuple, target: tuple) -> list:
+    """Pairs the k-th audio message into the bridge with the k-th audio message out of it."""
+    into = [t for t, s, d, k in log if (s, d) == source and is_audio(s, d, k)]
+    out = [t for t, s, d, k in log if (s, d) == target and is_audio(s, d, k)]
+    return [b - a for a, b in zip(into, out)]
+
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2),
+    }
+
+
+async def replay(path: str, args, bridges: dict, diagram_task) -> dict:
+    import websockets
+
+    header, events = load_recording(path)
+    diagram_task.latency = recorded_diagram_latency(events) / args.speed
+    session = SessionReplay(events, args.speed)
+
+    async with websockets.serve(session.upstream_handler, "127.0.0.1", args.port, max_size=None):
+        error = None
+        try:
+            await session.run(bridges[header["provider"]], args.timeout)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+    recorded = [(e["t"], e["side"], e["dir"], e["kind"]) for e in events if e["dir"] in ("in", "out")]
+    recorded_span = recorded[-1][0] / args.speed if recorded else 0.0
+    upstream_to_client = forwarding_latencies(session.log, ("upstream", "in"), ("client", "out"))
+    client_to_upstream = forwarding_latencies(session.log, ("client", "in"), ("upstream", "out"))
+
+    problems = [error] if error else []
+    problems += compare(
+        [event[1:] for event in recorded], [event[1:] for event in session.log], args.strict
+    )
+    for name, values in (("upstream->client", upstream_to_client), ("client->upstream", client_to_upstream)):
+        if values and percentile(values, 99) * 1000 > args.max_p99_ms:
+            problems.append(f"{name} p99 {percentile(values, 99) * 1000:.1f}ms > {args.max_p99_ms}ms")
+
+    return {
+        "recording": path,
+        "provider": header["provider"],
+        "events": len(recorded),
+        "recorded_s": round(recorded_span, 2),
+        "replayed_s": round(session.log[-1][0], 2) if session.log else 0.0,
+        "forward_upstream_to_client": summarize(upstream_to_client),
+        "forward_client_to_upstream": summarize(client_to_upstream),
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up, 1 = real time")
+    parser.add_argument("--max-p99-ms", type=float, default=50.0, help="budget for the bridge's forwarding latency")
+    parser.add_argument("--strict", action="store_true", help="also compare the order of audio messages")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds per session")
+    args = parser.parse_args()
+    args.port = _free_port()
+
+    # must be set before the bridges are imported
+    upstream = f"ws://127.0.0.1:{args.port}"
+    os.environ["OPENAI_WS_URL"] = f"{upstream}/v1/realtime"
+    os.environ["GEMINI_WS_URL"] = f"{upstream}/ws/BidiGenerateContent"
+    os.environ["SESSION_RECORD_DIR"] = ""  # never record a replay
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("GOOGLE_API_KEY", "fake")
+
+    from perf.ws_load_server import FakeDiagramTask
+    from services.voice import diagram_jobs, diagram_monitoring
+    from services.voice import handle_voicebot_session_openai, handle_voicebot_session_gemini
+
+    diagram_task = FakeDiagramTask(0.0, "http://127.0.0.1")
+    diagram_jobs.generate_diagram = diagram_task
+    diagram_monitoring.generate_diagram = diagram_task
+    bridges = {"openai": handle_voicebot_session_openai, "gemini": handle_voicebot_session_gemini}
+
+    failed = 0
+    for path in args.recordings:
+        result = asyncio.run(replay(path, args, bridges, diagram_task))
+        failed += bool(result["problems"])
+        print(json.dumps(result, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
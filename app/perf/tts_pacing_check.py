@@ -0,0 +1,180 @@
+"""Checks AudioPacer on a fake TTS stream, run faster than real time.
+
+Usage:
+    cd app
+    python -m perf.tts_pacing_check
+    python -m perf.tts_pacing_check --audio-seconds 30 --lead 1.5 --speed 20
+
+Checks (exit status 1 if any fails):
+- lead: the client is never more than --lead seconds (plus one chunk) ahead of playback,
+  and the stream takes about as long as the audio, less the lead,
+- order: every message arrives once, in order, STREAM_EXIT last,
+- stop: cancelling mid-stream sends nothing more, closes the upstream and counts the
+  audio held server-side as discarded,
+- disconnect: a closed socket stops the stream and closes the upstream,
+- busy: an error before the first message (ServerBusy) reaches the caller.
+Bytes sent vs. unpaced streaming are printed too.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from admission import ServerBusy
+from metrics import TTS_AUDIO_DISCARDED_BYTES
+from services.voice.tts_pacing import AudioPacer, PCM_BYTE_RATE
+
+CHUNK_BYTES = 4096
+
+
+class FakeTTS:
+    """tts_openai's messages for `seconds` of audio, produced `produce_speed` times faster
+    than real time (the provider outruns playback by far)."""
+
+    def __init__(self, seconds: float, byte_rate: int, produce_speed: float = 50, fail: Exception = None):
+        self.chunks = int(seconds * byte_rate / CHUNK_BYTES)
+        self.delay = CHUNK_BYTES / byte_rate / produce_speed
+        self.fail = fail
+        self.closed = False
+
+    async def stream(self):
+        try:
+            if self.fail is not None:
+                raise self.fail
+            yield {"status": "connected", "type": "TEXT_FULL", "text": "..."}
+            for i in range(self.chunks):
+                await asyncio.sleep(self.delay)
+                yield {"status": "connected", "type": "AUDIO_CHUNK", "i": i, "data": "00" * CHUNK_BYTES}
+            yield {"status": "connected", "type": "STREAM_EXIT"}
+        finally:
+            self.closed = True
+
+
+class Client:
+    def __init__(self, open_for: int = None):
+        self.messages = []
+        self.open_for = open_for
+
+    async def send(self, message: dict) -> bool:
+        if self.open_for is not None and len(self.messages) >= self.open_for:
+            return False
+        self.messages.append((time.monotonic(), message))
+        return True
+
+
+def discarded(held: str, reason: str) -> float:
+    return TTS_AUDIO_DISCARDED_BYTES.labels(held, reason)._value.get()
+
+
+async def check_lead(args, byte_rate: int) -> tuple:
+    problems = []
+    tts, client = FakeTTS(args.audio_seconds, byte_rate), Client()
+    pacer = AudioPacer(client.send, lead=args.lead, byte_rate=byte_rate)
+
+    worst, start = 0.0, time.monotonic()
+    original_send = pacer.send
+
+    async def send(message):
+        nonlocal worst
+        worst = max(worst, pacer.client_lead())
+        return await original_send(message)
+
+    pacer.send = send
+    await pacer.run(tts.stream())
+    took = time.monotonic() - start
+
+    chunk_seconds = CHUNK_BYTES / byte_rate
+    audio = tts.chunks * chunk_seconds
+    if worst > args.lead + chunk_seconds + 0.01:
+        problems.append(f"lead: client was {worst / chunk_seconds:.1f} chunks ahead, lead is {args.lead:.3f}s")
+    if not audio - args.lead - 0.05 <= took <= audio:
+        problems.append(f"lead: streaming {audio:.2f}s of audio took {took:.2f}s (lead {args.lead:.3f}s)")
+
+    kinds = [m["type"] for _, m in client.messages]
+    indexes = [m["i"] for _, m in client.messages if m["type"] == "AUDIO_CHUNK"]
+    if kinds[0] != "TEXT_FULL" or kinds[-1] != "STREAM_EXIT" or indexes != list(range(tts.chunks)):
+        problems.append("order: messages lost, duplicated or reordered")
+    return problems, {"audio_seconds": round(audio, 2), "stream_seconds": round(took, 2)}
+
+
+async def check_stop(args, byte_rate: int) -> tuple:
+    problems = []
+    tts, client = FakeTTS(args.audio_seconds, byte_rate), Client()
+    pacer = AudioPacer(client.send, lead=args.lead, byte_rate=byte_rate)
+    before = discarded("server", "stopped")
+
+    task = asyncio.create_task(pacer.run(tts.stream()))
+    await asyncio.sleep(args.audio_seconds / 4)
+    task.cancel()
+    await asyncio.wait([task])
+    sent = len(client.messages)
+    await asyncio.sleep(0.1)
+
+    held = discarded("server", "stopped") - before
+    if len(client.messages) != sent:
+        problems.append("stop: messages were sent after the narration was stopped")
+    if not tts.closed:
+        problems.append("stop: the upstream stream wasn't closed")
+    if held <= 0:
+        problems.append("stop: no audio held server-side was counted as discarded")
+
+    total = tts.chunks * CHUNK_BYTES
+    sent_bytes = sum(CHUNK_BYTES for _, m in client.messages if m["type"] == "AUDIO_CHUNK")
+    return problems, {"stopped_after_s": round(args.audio_seconds / 4, 2), "sent_bytes": sent_bytes,
+                      "unpaced_would_send": total, "held_discarded_bytes": int(held)}
+
+
+async def check_disconnect(args, byte_rate: int) -> list:
+    tts, client = FakeTTS(args.audio_seconds, byte_rate), Client(open_for=5)
+    pacer = AudioPacer(client.send, lead=args.lead, byte_rate=byte_rate)
+    try:
+        await asyncio.wait_for(pacer.run(tts.stream()), timeout=args.audio_seconds)
+    except asyncio.TimeoutError:
+        return ["disconnect: the stream kept going after the socket closed"]
+    await asyncio.sleep(0)
+    return [] if tts.closed else ["disconnect: the upstream stream wasn't closed"]
+
+
+async def check_busy(args, byte_rate: int) -> list:
+    tts, client = FakeTTS(1, byte_rate, fail=ServerBusy(["openai:tts"], 15)), Client()
+    try:
+        await AudioPacer(client.send, lead=args.lead, byte_rate=byte_rate).run(tts.stream())
+    except ServerBusy:
+        return [] if not client.messages else ["busy: messages were sent before the error"]
+    return ["busy: ServerBusy didn't reach the caller"]
+
+
+async def run(args) -> tuple:
+    # the audio plays --speed times faster, the lead is scaled with it
+    byte_rate = int(PCM_BYTE_RATE * args.speed)
+    args.lead = args.lead / args.speed
+    args.audio_seconds = args.audio_seconds / args.speed
+
+    problems, summary = [], {}
+    for check in (check_lead, check_stop, check_disconnect, check_busy):
+        result = await check(args, byte_rate)
+        found, extra = result if isinstance(result, tuple) else (result, {})
+        print(f"{check.__name__:<18} {'ok' if not found else 'FAILED'}")
+        problems += found
+        summary.update(extra)
+    return problems, summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio-seconds", type=float, default=20, help="length of the fake narration")
+    parser.add_argument("--lead", type=float, default=1.5, help="seconds the client may be ahead")
+    parser.add_argument("--speed", type=float, default=10, help="run this many times faster than real time")
+    args = parser.parse_args()
+
+    problems, summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""Websocket load test: many simulated students against /ws/explanation/{concept_id}.
+
+Usage:
+    cd app
+    python -m perf.ws_load --clients 50 --ramp 10
+    python -m perf.ws_load --clients 10 --provider gemini --diagram-rate 0.5
+    python -m perf.ws_load --clients 5 --turns 1 --speech 0.5          # CI smoke run
+
+Every upstream is a local fake, so no network or credentials are needed:
+OpenAI TTS/Realtime (perf.fake_openai), Gemini Live (perf.fake_gemini), object
+storage (perf.fake_s3), a seeded sqlite file served through the embedded replica
+instead of Turso, and a stubbed diagram task instead of Celery. The fakes run on
+threads of this process, the web app in its own process (perf.ws_load_server).
+
+Each student walks CONTEXT -> every EXPLANATION_STEP -> VOICEBOT (streaming
+synthetic mic audio for --turns turns) -> CONCLUSION. The report has session
+throughput, time-to-first-audio percentiles for narration and for voicebot
+replies, diagram latency, the server's event-loop lag and resident memory per
+concurrent session. Exits with status 1 if any session failed.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+
+from perf.codegen_load import _free_port, percentile
+from perf.lesson_source_bench import build_database
+
+MIC_CHUNK_SECONDS = 0.1
+MIC_CHUNK_HEX = bytes(int(24000 * 2 * MIC_CHUNK_SECONDS)).hex()  # silent pcm16 at 24kHz
+REPLY_AUDIO = ("response.audio.delta", "AUDIO_DELTA")  # OpenAI events are forwarded as-is
+REPLY_DONE = ("response.done", "TURN_COMPLETE")
+
+
+class SessionStats:
+    def __init__(self):
+        self.active = 0
+        self.peak_active = 0
+        self.completed = 0
+        self.failed = 0
+        self.errors = []
+        self.narration_ttfa = []
+        self.voice_ttfa = []
+        self.diagram_latency = []
+        self.diagram_failed = 0
+        self.session_seconds = []
+        self.server_samples = []
+
+
+def fetch_json(url: str, method: str = "GET") -> dict:
+    request = urllib.request.Request(url, method=method)
+    with urllib.request.urlopen(request, timeout=5) as resp:
+        return json.load(resp)
+
+
+async def recv_json(ws, timeout: float) -> dict:
+    return json.loads(await asyncio.wait_for(ws.recv(), timeout=timeout))
+
+
+async def narrate(ws, request: dict, stats: SessionStats, timeout: float):
+    """Requests a narrated part and reads it up to STREAM_EXIT."""
+    await ws.send(json.dumps(request))
+    start = time.perf_counter()
+    first_audio = None
+    while True:
+        message = await recv_json(ws, timeout)
+        kind = message.get("type")
+        if kind == "AUDIO_CHUNK" and first_audio is None:
+            first_audio = time.perf_counter() - start
+            stats.narration_ttfa.append(first_audio)
+        elif kind == "STREAM_EXIT":
+            return
+        elif message.get("status") == "error":
+            raise RuntimeError(f"{request['part']}: {message.get('data')}")
+
+
+class Voicebot:
+    """Client side of one voicebot session: speaks, listens, tracks diagrams."""
+
+    def __init__(self, ws, stats: SessionStats, timeout: float):
+        self.ws = ws
+        self.stats = stats
+        self.timeout = timeout
+        self.diagrams = []  # start times of diagrams that haven't arrived yet
+
+    def handle(self, message: dict):
+        kind = message.get("type")
+        if kind == "DIAGRAM_INITIATED":
+            self.diagrams.append(time.perf_counter())
+        elif kind in ("DIAGRAM_READY", "DIAGRAM_FAILED") and self.diagrams:
+            started = self.diagrams.pop(0)  # results are delivered in order
+            if kind == "DIAGRAM_READY":
+                self.stats.diagram_latency.append(time.perf_counter() - started)
+            else:
+                self.stats.diagram_failed += 1
+
+    async def drain(self, idle: float):
+        """Handles whatever the server sends until it's quiet for `idle` seconds."""
+        while True:
+            try:
+                self.handle(await recv_json(self.ws, idle))
+            except asyncio.TimeoutError:
+                return
+
+    async def turn(self, speech: float):
+        await self.drain(0.2)  # leftovers of the previous reply
+        for _ in range(max(1, int(speech / MIC_CHUNK_SECONDS))):
+            await self.ws.send(json.dumps({"type": "audio_chunk", "chunk": MIC_CHUNK_HEX}))
+            await asyncio.sleep(MIC_CHUNK_SECONDS)  # a microphone delivers in real time
+        spoke_at = time.perf_counter()
+
+        first_audio = None
+        while True:
+            message = await recv_json(self.ws, self.timeout)
+            kind = message.get("type")
+            if kind in REPLY_AUDIO and first_audio is None:
+                first_audio = time.perf_counter() - spoke_at
+                self.stats.voice_ttfa.append(first_audio)
+            elif kind in REPLY_DONE and first_audio is not None:
+                return
+            self.handle(message)
+
+    async def wait_for_diagrams(self):
+        deadline = time.perf_counter() + self.timeout
+        while self.diagrams and time.perf_counter() < deadline:
+            self.handle(await recv_json(self.ws, self.timeout))
+
+
+async def student(url: str, stats: SessionStats, args):
+    import websockets
+
+    start = time.perf_counter()
+    async with websockets.connect(url, max_size=None) as ws:
+        metadata = await recv_json(ws, args.timeout)
+        if metadata.get("type") != "METADATA":
+            raise RuntimeError(f"Expected METADATA, got {metadata}")
+        num_steps = metadata["num_steps"]
+
+        await narrate(ws, {"part": "CONTEXT"}, stats, args.timeout)
+        for index in range(num_steps):
+            await narrate(ws, {"part": "EXPLANATION_STEP", "index": index}, stats, args.timeout)
+
+        if args.turns:
+            await ws.send(json.dumps({"part": "VOICEBOT", "index": num_steps - 1}))
+            voicebot = Voicebot(ws, stats, args.timeout)
+            while (await recv_json(ws, args.timeout)).get("type") != "VOICEBOT_INIT":
+                pass
+            for _ in range(args.turns):
+                await voicebot.turn(args.speech)
+            await voicebot.wait_for_diagrams()
+            await ws.send(json.dumps({"type": "exit_voicebot"}))
+            while True:
+                message = await recv_json(ws, args.timeout)
+                if message.get("type") == "VOICEBOT_EXIT":
+                    break
+                voicebot.handle(message)
+
+        await narrate(ws, {"part": "CONCLUSION"}, stats, args.timeout)
+    stats.session_seconds.append(time.perf_counter() - start)
+
+
+async def run_student(n: int, server: str, stats: SessionStats, args):
+    concept_id = n % args.lessons + 1
+    stats.active += 1
+    stats.peak_active = max(stats.peak_active, stats.active)
+    try:
+        await student(f"{server.replace('http', 'ws', 1)}/ws/explanation/{concept_id}", stats, args)
+        stats.completed += 1
+    except Exception as e:
+        stats.failed += 1
+        stats.errors.append(f"session {n}: {type(e).__name__}: {e}")
+    finally:
+        stats.active -= 1
+
+
+async def sample_server(server: str, stats: SessionStats, interval: float = 0.5):
+    while True:
+        sample = await asyncio.to_thread(fetch_json, f"{server}/perf/stats")
+        sample["active"] = stats.active
+        stats.server_samples.append(sample)
+        await asyncio.sleep(interval)
+
+
+async def run_load(server: str, args) -> tuple:
+    stats = SessionStats()
+    baseline = await asyncio.to_thread(fetch_json, f"{server}/perf/stats")
+    await asyncio.to_thread(fetch_json, f"{server}/perf/reset", "POST")
+
+    sampler = asyncio.create_task(sample_server(server, stats))
+    limit = asyncio.Semaphore(args.clients)
+
+    async def limited(n):
+        await asyncio.sleep(args.ramp * n / args.sessions)
+        async with limit:
+            await run_student(n, server, stats, args)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(n) for n in range(args.sessions)))
+    wall = time.perf_counter() - start
+    sampler.cancel()
+
+    final = await asyncio.to_thread(fetch_json, f"{server}/perf/stats")
+    return stats, baseline, final, wall
+
+
+def summarize(values: list, scale: float = 1000) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * scale, 1),
+        "p95": round(percentile(values, 95) * scale, 1),
+        "p99": round(percentile(values, 99) * scale, 1),
+    }
+
+
+def start_fakes(args) -> dict:
+    """Starts the fake upstreams on this process and returns the web app's env."""
+    import uvicorn
+    from perf.codegen_load import start_fake_gemini
+
+    # read by the fakes at import time
+    os.environ["FAKE_REALTIME_DIAGRAM_RATE"] = str(args.diagram_rate)
+    os.environ["FAKE_REALTIME_TURN_AUDIO"] = str(args.speech)
+    os.environ["FAKE_S3_FIGURES"] = str(args.steps)
+
+    from perf import fake_openai, fake_s3
+
+    ports = {"openai": _free_port(), "gemini": _free_port(), "s3": _free_port()}
+    start_fake_gemini(ports["gemini"])
+    for name, app in (("openai", fake_openai.app), ("s3", fake_s3.app)):
+        server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=ports[name], log_level="warning")
+        )
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+    return {
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{ports['openai']}/v1",
+        "OPENAI_WS_URL": f"ws://127.0.0.1:{ports['openai']}/v1/realtime",
+        "GOOGLE_API_KEY": "fake",
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{ports['gemini']}",
+        "GEMINI_WS_URL": f"ws://127.0.0.1:{ports['gemini']}/ws/BidiGenerateContent",
+        "TIGRIS_STORAGE_ENDPOINT": f"http://127.0.0.1:{ports['s3']}",
+        "TIGRIS_STORAGE_ACCESS_KEY_ID": "fake",
+        "TIGRIS_STORAGE_SECRET_ACCESS_KEY": "fake",
+        "AWS_DEFAULT_REGION": "auto",
+        "S3_ADDRESSING_STYLE": "path",
+        "VOICEBOT_PROVIDER": args.provider,
+        "FAKE_DIAGRAM_LATENCY": str(args.diagram_latency),
+    }
+
+
+def start_server(env: dict, log_path: str) -> tuple:
+    port = _free_port()
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "perf.ws_load_server", "--port", str(port)],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=log,
+    )
+    server = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Web app exited with {process.returncode}, see {log_path}")
+        try:
+            fetch_json(f"{server}/")
+            return process, server
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Web app didn't start in time, see {log_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20, help="concurrent students")
+    parser.add_argument("--sessions", type=int, default=None, help="total sessions (default: --clients)")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which sessions start")
+    parser.add_argument("--lessons", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=3, help="explanation steps per lesson")
+    parser.add_argument("--turns", type=int, default=2, help="voicebot turns, 0 skips the voicebot")
+    parser.add_argument("--speech", type=float, default=1.0, help="seconds of mic audio per turn")
+    parser.add_argument("--provider", choices=["openai", "gemini"], default="openai")
+    parser.add_argument("--diagram-rate", type=float, default=0.3, help="chance a reply asks for a diagram")
+    parser.add_argument("--diagram-latency", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    args.sessions = args.sessions or args.clients
+
+    workdir = tempfile.mkdtemp(prefix="ws-load-")
+    primary = os.path.join(workdir, "lessons.db")
+    build_database(primary, args.lessons, args.steps)
+
+    env = start_fakes(args)
+    env.update(
+        {
+            "DB_MODE": "replica",
+            "DB_PRIMARY_PATH": primary,
+            "DB_REPLICA_PATH": os.path.join(workdir, "replica.db"),
+            "LESSON_SOURCE": "db",
+        }
+    )
+    log_path = os.path.join(workdir, "server.log")
+    process, server = start_server(env, log_path)
+
+    try:
+        stats, baseline, final, wall = asyncio.run(run_load(server, args))
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    peak = max(stats.server_samples, key=lambda s: s["rss_kb"], default=final)
+    report = {
+        "provider": args.provider,
+        "sessions": args.sessions,
+        "completed": stats.completed,
+        "failed": stats.failed,
+        "peak_concurrent_sessions": stats.peak_active,
+        "wall_s": round(wall, 2),
+        "sessions_per_min": round(stats.completed / wall * 60, 2),
+        "session_s": summarize(stats.session_seconds, scale=1),
+        "narration_first_audio_ms": summarize(stats.narration_ttfa),
+        "voicebot_first_audio_ms": summarize(stats.voice_ttfa),
+        "diagram_ms": {**summarize(stats.diagram_latency), "failed": stats.diagram_failed},
+        "server_loop_lag_ms": final["loop_lag_ms"],
+        "server_loop_stalls": final["loop_stalls"],
+        "server_rss_kb": {"baseline": baseline["rss_kb"], "peak": peak["rss_kb"]},
+        "server_rss_kb_per_session": round(
+            (peak["rss_kb"] - baseline["rss_kb"]) / max(1, stats.peak_active), 1
+        ),
+        "server_log": log_path,
+    }
+    print(json.dumps(report, indent=2))
+    for error in stats.errors[:10]:
+        print(error, file=sys.stderr)
+    sys.exit(1 if stats.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""The web app as run by `perf.ws_load`: diagram worker stubbed, loop lag sampled.
+
+Usage (normally started by perf.ws_load with every upstream pointed at local fakes):
+    cd app
+    python -m perf.ws_load_server --port 8000
+
+Adds two routes to the app:
+    POST /perf/reset   starts (or restarts) the event-loop lag sampler
+    GET  /perf/stats   resident memory, loop lag percentiles, top stall sites and
+                       stubbed diagram tasks
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+
+FAKE_DIAGRAM_LATENCY = float(os.environ.get("FAKE_DIAGRAM_LATENCY", 3.0))
+FAKE_DIAGRAM_PREVIEW_AT = 0.6  # fraction of the latency at which the preview is published
+LOOP_LAG_INTERVAL = 0.05
+
+
+class FakeDiagramResult:
+    """Looks like a celery AsyncResult of `generate_diagram` to the voice services."""
+
+    def __init__(self, task: "FakeDiagramTask", task_id: str):
+        self.task = task
+        self.id = task_id
+
+    @property
+    def _elapsed(self) -> float:
+        return time.monotonic() - self.task.started[self.id]
+
+    def ready(self) -> bool:
+        return self.id in self.task.revoked or self._elapsed >= self.task.latency
+
+    @property
+    def state(self) -> str:
+        if self.ready():
+            return "SUCCESS"
+        if self._elapsed >= self.task.latency * FAKE_DIAGRAM_PREVIEW_AT:
+            return "PREVIEW"
+        return "PENDING"
+
+    @property
+    def info(self) -> dict:
+        return {"preview": self.task.url(self.id, "_preview")}
+
+    def get(self, timeout: float = None) -> dict:
+        return {
+            "status": "success",
+            "data": self.task.url(self.id),
+            "preview": self.task.url(self.id, "_preview"),
+            "formats": {},
+        }
+
+
+class FakeDiagramTask:
+    """Stands in for the `generate_diagram` celery task, no broker or worker needed.
+
+    Args:
+        latency(float): Seconds until a task's result is ready.
+        storage_url(str): Object storage endpoint the diagram urls point at.
+    """
+
+    def __init__(self, latency: float, storage_url: str):
+        self.latency = latency
+        self.storage_url = storage_url
+        self.started = {}
+        self.revoked = set()
+
+    def url(self, task_id: str, suffix: str = "") -> str:
+        return f"{self.storage_url}/explanation-dev/temp/diagrams/{task_id}{suffix}.png"
+
+    def delay(self, prompt: str) -> FakeDiagramResult:
+        return self.apply_async((prompt,))
+
+    def apply_async(self, args: tuple = (), kwargs: dict = None, task_id: str = None, **options) -> FakeDiagramResult:
+        task_id = task_id or str(uuid.uuid4())
+        self.started[task_id] = time.monotonic()
+        return FakeDiagramResult(self, task_id)
+
+    def revoke(self, task_ids: list):
+        self.revoked.update(task_ids)
+
+    def AsyncResult(self, task_id: str) -> FakeDiagramResult:
+        return FakeDiagramResult(self, task_id)
+
+
+async def sample_loop_lag(samples: list, interval: float = LOOP_LAG_INTERVAL):
+    """Records how late the event loop wakes up a sleeping task."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+def build_app():
+    from main import app
+    from perf.lesson_source_bench import rss_kb
+    from perf.codegen_load import percentile
+    from metrics import loop_monitor
+    from services.voice import diagram_jobs, diagram_monitoring
+
+    diagram_task = FakeDiagramTask(
+        FAKE_DIAGRAM_LATENCY, os.environ.get("TIGRIS_STORAGE_ENDPOINT", "")
+    )
+    diagram_jobs.generate_diagram = diagram_task
+    diagram_monitoring.generate_diagram = diagram_task
+
+    app.state.loop_lag = []
+    app.state.loop_lag_task = None
+
+    async def reset():
+        if app.state.loop_lag_task is not None:
+            app.state.loop_lag_task.cancel()
+        app.state.loop_lag = []
+        app.state.loop_lag_task = asyncio.create_task(sample_loop_lag(app.state.loop_lag))
+        return {"data": "reset", "status": 200}
+
+    async def stats():
+        lag = list(app.state.loop_lag)
+        return {
+            "rss_kb": rss_kb(),
+            "loop_lag_ms": {
+                "samples": len(lag),
+                "p50": round(statistics.median(lag) * 1000, 3) if lag else None,
+                "p99": round(percentile(lag, 99) * 1000, 3) if lag else None,
+                "max": round(max(lag) * 1000, 3) if lag else None,
+            },
+            "loop_stalls": loop_monitor.snapshot()["stalls"][:5],
+            "diagram_tasks": len(diagram_task.started),
+        }
+
+    app.add_api_route("/perf/reset", reset, methods=["POST"])
+    app.add_api_route("/perf/stats", stats, methods=["GET"])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(build_app(), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
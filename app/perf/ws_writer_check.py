@@ -0,0 +1,246 @@
+"""Ordering, priority, failure and throughput checks for SocketWriter, on fake sockets.
+
+Usage:
+    cd app
+    python -m perf.ws_writer_check
+    python -m perf.ws_writer_check --messages 50000 --producers 16 --latency-ms 0.2
+
+Checks (exit status 1 if any fails):
+- ordering: producers sending on both lanes at once; each producer's messages
+  arrive in the order it sent them, per lane, and none are lost,
+- priority: a control message queued behind a bulk backlog is sent before it,
+- interrupt: an interrupt drops the queued audio but not the other bulk messages,
+  and nothing queued before it arrives after it,
+- failures: a socket that fails transiently doesn't slow the senders down (the
+  slowest `send` stays under --max-send-ms) and every message still arrives; once
+  the socket is closed `send` returns False, also for senders waiting for room,
+- coalescing: small messages go out as BATCH frames and unpack in order.
+Throughput through the writer vs. awaiting the socket directly is printed too.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from fastapi import WebSocketDisconnect
+
+from utils import SocketWriter
+
+
+class FakeSocket:
+    """Records what a `websockets` connection would have sent.
+
+    Args:
+        latency(float): Seconds every send takes.
+        fail_every(int): Every n-th frame fails `failures` times before it goes through.
+        failures(int): Transient failures of such a frame.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_every: int = 0, failures: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.failures = failures
+        self.closed = False
+        self.frames = []
+        self._failed = 0
+
+    async def send(self, frame: str):
+        if self.closed:
+            raise WebSocketDisconnect(1000)
+        if self.fail_every and len(self.frames) % self.fail_every == 0 and self._failed < self.failures:
+            self._failed += 1
+            raise RuntimeError("transient send failure")
+        self._failed = 0
+        await asyncio.sleep(self.latency)
+        self.frames.append(frame)
+
+    def messages(self) -> list:
+        out = []
+        for frame in self.frames:
+            data = json.loads(frame)
+            out.extend(data["messages"] if data.get("type") == "BATCH" else [data])
+        return out
+
+
+async def check_ordering(args) -> list:
+    socket = FakeSocket(latency=args.latency_ms / 1000)
+    writer = SocketWriter(socket, name="ordering", max_pending=64)
+    per_producer = args.messages // args.producers
+
+    async def produce(p: int):
+        for i in range(per_producer):
+            bulk = i % 4 != 0
+            await writer.send({"p": p, "i": i, "bulk": bulk}, bulk=bulk)
+            if i % 16 == 0:
+                await asyncio.sleep(0)
+
+    await asyncio.gather(*(produce(p) for p in range(args.producers)))
+    await writer.close(timeout=60)
+
+    problems, last = [], {}
+    received = socket.messages()
+    for message in received:
+        key = (message["p"], message["bulk"])
+        if message["i"] <= last.get(key, -1):
+            problems.append(f"ordering: producer {key[0]} {'bulk' if key[1] else 'control'} #{message['i']} out of order")
+            break
+        last[key] = message["i"]
+    if len(received) != per_producer * args.producers:
+        problems.append(f"ordering: {len(received)} messages arrived, sent {per_producer * args.producers}")
+    return problems
+
+
+async def check_priority(args) -> list:
+    socket = FakeSocket(latency=0.001)
+    writer = SocketWriter(socket, name="priority", max_pending=1000)
+    for i in range(50):
+        await writer.send({"type": "response.audio.delta", "i": i}, bulk=True)
+    await writer.send({"type": "SERVER_BUSY"})
+    await writer.close(timeout=5)
+
+    kinds = [m["type"] for m in socket.messages()]
+    position = kinds.index("SERVER_BUSY")
+    # the writer may already be sending the first bulk message
+    return [] if position <= 1 else [f"priority: control message sent at position {position} of {len(kinds)}"]
+
+
+async def check_interrupt(args) -> list:
+    socket = FakeSocket(latency=0.001)
+    writer = SocketWriter(socket, name="interrupt", max_pending=1000)
+    for i in range(50):
+        await writer.send({"type": "response.audio.delta", "i": i}, bulk=True)
+        if i == 25:
+            await writer.send({"type": "response.audio_transcript.done"}, bulk=True)
+    await writer.interrupt(
+        {"type": "INTERRUPT_PLAYBACK"}, stale=lambda queued: '"response.audio.delta"' in queued
+    )
+    await writer.send({"type": "response.audio.delta", "i": "next"}, bulk=True)
+    await writer.close(timeout=5)
+
+    problems = []
+    kinds = [m["type"] for m in socket.messages()]
+    position = kinds.index("INTERRUPT_PLAYBACK")
+    stale = kinds[:position].count("response.audio.delta")
+    # the writer may already be sending the first audio message
+    if stale > 1:
+        problems.append(f"interrupt: {stale} stale audio messages were sent before INTERRUPT_PLAYBACK")
+    if "response.audio_transcript.done" not in kinds[:position]:
+        problems.append("interrupt: a queued non-audio message was dropped or overtaken")
+    if kinds[position + 1:] != ["response.audio.delta"]:
+        problems.append(f"interrupt: expected only the next response after it, got {kinds[position + 1:]}")
+    return problems
+
+
+async def check_failures(args) -> list:
+    problems = []
+    socket = FakeSocket(latency=args.latency_ms / 1000, fail_every=10, failures=2)
+    writer = SocketWriter(socket, name="failures", max_pending=args.messages)
+
+    slowest = 0.0
+    for i in range(1000):
+        start = time.perf_counter()
+        await writer.send({"i": i}, bulk=True)
+        slowest = max(slowest, time.perf_counter() - start)
+        if i % 50 == 0:
+            await asyncio.sleep(0)
+    await writer.close(timeout=30)
+
+    if slowest * 1000 > args.max_send_ms:
+        problems.append(f"failures: slowest send took {slowest * 1000:.2f}ms > {args.max_send_ms}ms")
+    received = [m["i"] for m in socket.messages()]
+    if received != list(range(1000)):
+        problems.append(f"failures: {len(received)}/1000 messages arrived after transient failures")
+
+    # closed socket: senders get False right away, also those waiting for room
+    socket = FakeSocket()
+    socket.closed = True
+    writer = SocketWriter(socket, name="closed", max_pending=2)
+    for i in range(2):
+        await writer.send({"i": i}, bulk=True)
+    waiting = asyncio.create_task(writer.send({"i": 2}, bulk=True))
+    try:
+        result = await asyncio.wait_for(waiting, timeout=1)
+        if result is not False:
+            problems.append("failures: a sender waiting for room wasn't told the socket closed")
+    except asyncio.TimeoutError:
+        problems.append("failures: a sender waiting for room hung after the socket closed")
+    if await writer.send({"i": 3}) is not False:
+        problems.append("failures: send() on a closed socket didn't return False")
+    await writer.close()
+    return problems
+
+
+async def check_coalescing(args) -> list:
+    socket = FakeSocket()
+    writer = SocketWriter(socket, name="coalescing", coalesce=True)
+    for i in range(100):
+        await writer.send({"type": "response.audio_transcript.delta", "i": i}, bulk=True)
+    await writer.close(timeout=5)
+
+    problems = []
+    if [m["i"] for m in socket.messages()] != list(range(100)):
+        problems.append("coalescing: batched messages didn't unpack in order")
+    if len(socket.frames) >= 100:
+        problems.append("coalescing: small messages weren't batched")
+    return problems
+
+
+async def throughput(args) -> dict:
+    message = {"type": "response.audio.delta", "delta": "A" * 6400}
+    latency = args.latency_ms / 1000
+    per_producer = args.messages // args.producers
+
+    socket = FakeSocket(latency=latency)
+    start = time.perf_counter()
+    for _ in range(per_producer * args.producers):
+        await socket.send(json.dumps(message))
+    direct = time.perf_counter() - start
+
+    socket = FakeSocket(latency=latency)
+    writer = SocketWriter(socket, name="throughput")
+
+    async def produce():
+        for _ in range(per_producer):
+            await writer.send(message, bulk=True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(produce() for _ in range(args.producers)))
+    await writer.close(timeout=60)
+    through_writer = time.perf_counter() - start
+
+    total = per_producer * args.producers
+    return {
+        "messages": total,
+        "direct_msgs_per_s": round(total / direct),
+        "writer_msgs_per_s": round(total / through_writer),
+    }
+
+
+async def run(args) -> tuple:
+    problems = []
+    for check in (check_ordering, check_priority, check_interrupt, check_failures, check_coalescing):
+        found = await check(args)
+        print(f"{check.__name__:<18} {'ok' if not found else 'FAILED'}")
+        problems += found
+    return problems, await throughput(args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="time every fake send takes")
+    parser.add_argument("--max-send-ms", type=float, default=5.0, help="budget for one send() call")
+    args = parser.parse_args()
+
+    problems, result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import hmac
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from Database import sqlite_client, DB_MODE
+from metrics import loop_monitor
+
+# admin and debug endpoints are only served when this is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+def require_admin(request: Request):
+    """Lets a request through only with `Authorization: Bearer <ADMIN_TOKEN>`."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if not ADMIN_TOKEN or scheme.lower() != "bearer" or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/debug/loop-stalls")
+async def loop_stalls():
+    return {"data": loop_monitor.snapshot(), "status": 200}
+
+
+@router.get("/db/replica")
+async def replica_status():
+    if DB_MODE != "replica":
+        return {"data": "Replica mode is disabled", "status": 404}
+    return {"data": {"lag_s": round(sqlite_client.lag_seconds(), 3)}, "status": 200}
+
+
+@router.post("/db/replica/sync")
+async def replica_sync():
+    if DB_MODE != "replica":
+        return {"data": "Replica mode is disabled", "status": 404}
+    sqlite_client.invalidate()  # the caches are cleared once it has synced
+    return {"data": "Sync requested", "status": 200}
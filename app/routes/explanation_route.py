@@ -1,115 +1,234 @@
+import os
+import time
+import uuid
 import asyncio
 from aiosqlite import Connection
-from fastapi import APIRouter, WebSocket, Depends, WebSocketDisconnect, Path
+from fastapi import APIRouter, WebSocket, Depends, WebSocketDisconnect, Path, Request, Response
+from fastapi.responses import JSONResponse
 
-from Database import get_db
-from utils import s3_client, build_voicebot_prompt, safe_send_ws, logger
+from Database import get_db, get_lesson, list_audio_keys
+from utils import get_s3_client, build_voicebot_prompt, logger, SocketWriter, WS_COALESCE
+from metrics import (S3_PRESIGN_SECONDS, ACTIVE_VOICEBOT_SESSIONS, VOICE_PROMPT_TOKENS,
+                     LESSON_BUNDLE_BUILD_SECONDS)
+from llm.prompts import estimate_tokens
+from admission import ServerBusy, NORMAL, HIGH
+from services.analytics import session_events
 from services.voice import (
     tts_openai,
+    AudioPacer,
+    TTS_PACING,
     handle_voicebot_session_openai,
     handle_voicebot_session_gemini,
 )
+from services.lessons import (LessonBundle, build_lesson_bundle, bundle_cache,
+                              url_epoch, DIAGRAM_URL_EXPIRY, diagram_cache, diagram_urls,
+                              build_preload_manifest, push_diagrams, DIAGRAM_PUSH_COUNT)
+
+VOICEBOT_PROVIDER = os.environ.get("VOICEBOT_PROVIDER", "openai")  # "openai" | "gemini"
 
 router = APIRouter()
 
 
+def presign_diagrams(keys: list) -> dict:
+    """file name -> {extension: presigned url} of object storage keys."""
+    s3_client = get_s3_client()
+    url_data = {}
+    for key in keys:
+        fig_name, ext = key.split("/")[-1].rsplit(".", 1)
+        url_data.setdefault(fig_name, {})[ext] = s3_client.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": "explanation-dev", "Key": key},
+            ExpiresIn=DIAGRAM_URL_EXPIRY,
+        )
+    return url_data
+
+
+async def lesson_diagram_urls(concept_id: int, keys: list) -> dict:
+    """fig name -> {extension: url}: the web tier's diagram cache when enabled, else
+    presigned object storage urls (signing is cpu bound, it runs off the event loop)."""
+    if diagram_cache is not None:
+        return diagram_urls(concept_id, keys)
+    with S3_PRESIGN_SECONDS.time():
+        return await asyncio.to_thread(presign_diagrams, keys)
+
+
+async def stream_tts(client: SocketWriter, priority: int = NORMAL, **part) -> None:
+    """Streams one narrated part to the client, or tells it to retry when the server is busy.
+
+    Args:
+        client(SocketWriter): Writer of the client socket.
+        priority(int): HIGH for a lesson under way, so it goes before new lessons
+            and voicebot sessions.
+        **part: tts_openai's arguments.
+    """
+    try:
+        if TTS_PACING:
+            pacer = AudioPacer(lambda message: client.send(message, bulk=True))
+            await pacer.run(tts_openai(priority=priority, **part))
+            return
+        messages = tts_openai(priority=priority, **part)
+        try:
+            async for chunk in messages:
+                if not await client.send(chunk, bulk=True):
+                    break  # client is gone
+        finally:
+            await messages.aclose()  # ends the upstream request and frees the provider slot
+    except ServerBusy as e:
+        logger.warning(f"Narration refused: {e}")
+        session_events.record("server_busy", where="narration", retry_after=e.retry_after)
+        await client.send(e.to_client())
+
+
+class Narrator:
+    """Plays one narrated part at a time.
+
+    Paced narration (TTS_PACING) lasts as long as the audio, so it runs in its own task
+    and the session keeps reading the client: the next part, the voicebot or the end of
+    the session stops it, and the audio still held server-side is never sent. Without
+    pacing the whole part is sent at once and `play` returns when it's queued.
+
+    Args:
+        client(SocketWriter): Writer of the client socket.
+    """
+
+    def __init__(self, client: SocketWriter):
+        self.client = client
+        self._task: asyncio.Task = None
+
+    async def play(self, priority: int = NORMAL, **part) -> None:
+        await self.stop()
+        if not TTS_PACING:
+            await stream_tts(self.client, priority, **part)
+            return
+        self._task = asyncio.create_task(stream_tts(self.client, priority, **part), name="narration")
+        self._task.add_done_callback(self._done)
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            session_events.record("part_skipped")
+            task.cancel()
+            await asyncio.wait([task])  # not `await task`, that would swallow our own cancellation
+
+    @staticmethod
+    def _done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Narration failed: {task.exception()!r}")
+
+
+@router.get("/lessons/{concept_id}")
+async def get_lesson_bundle(
+    request: Request, concept_id: int = Path(), db: Connection = Depends(get_db)
+):
+    """Text, snippets, diagram and audio urls of a whole lesson, cacheable by browsers and CDNs.
+
+    Answers conditional GETs (If-None-Match) with 304 and compresses with gzip, or
+    brotli when installed. Clients that have the bundle connect to the websocket
+    with `?bundle=1`, which then only carries audio, which part is playing and the voicebot.
+    """
+    epoch = url_epoch()
+    bundle = bundle_cache.get(concept_id, epoch)
+    if bundle is None:
+        try:
+            lesson = await get_lesson(db, concept_id)
+        except (KeyError, IndexError):
+            return JSONResponse({"data": "Lesson not found", "status": 404}, status_code=404)
+
+        with LESSON_BUNDLE_BUILD_SECONDS.time():
+            url_data = await lesson_diagram_urls(concept_id, lesson["diagram_keys"])
+            audio_urls = await asyncio.to_thread(lambda: presign_diagrams(list_audio_keys(concept_id)))
+            bundle = bundle_cache.put(
+                concept_id, LessonBundle(build_lesson_bundle(concept_id, lesson, url_data, audio_urls), epoch)
+            )
+
+    status, body, headers = bundle.response_parts(request.headers)
+    return Response(content=body, status_code=status, headers=headers, media_type="application/json")
+
+
+@router.get("/diagrams/{concept_id}/{file_name}")
+async def get_diagram(
+    request: Request,
+    concept_id: int = Path(),
+    file_name: str = Path(pattern=r"^[\w-]+\.(png|webp|svg)$"),
+):
+    """A lesson diagram from the web tier's disk cache (`DIAGRAM_CACHE_DIR`), filled
+    from object storage on a miss. Supports If-None-Match and Range."""
+    if diagram_cache is None:
+        return JSONResponse({"data": "Diagram cache is disabled", "status": 404}, status_code=404)
+    try:
+        entry = await diagram_cache.get(f"Diagrams/{concept_id}/{file_name}")
+    except FileNotFoundError:
+        return JSONResponse({"data": "Diagram not found", "status": 404}, status_code=404)
+    return diagram_cache.response(entry, request.headers)
+
+
 @router.websocket("/ws/explanation/{concept_id}")
 async def get_explanation(
     websocket: WebSocket, concept_id: int = Path(), db: Connection = Depends(get_db)
 ):
-        await websocket.accept()
-    #try:
+    await websocket.accept()
+    # every message to the client goes through one writer, so concurrent senders can't interleave
+    client = SocketWriter(websocket, name="client", coalesce=WS_COALESCE)
+    # the client fetched GET /lessons/{concept_id}, don't send the lesson text again
+    with_bundle = websocket.query_params.get("bundle") == "1"
+    narrator = Narrator(client)
+    background = []  # the session's own tasks (diagram push), cancelled when it ends
+    # events recorded anywhere in this session (narration, voicebot, diagram jobs) carry its id
+    token = session_events.start_session(uuid.uuid4().hex, concept_id)
+    session_events.record("session_started", bundle=with_bundle)
+    started, outcome = time.perf_counter(), "closed"
+    try:
+        await explanation_session(websocket, client, narrator, background, concept_id, db, with_bundle)
+    except WebSocketDisconnect:
+        outcome = "disconnected"
+        raise
+    except Exception as e:
+        outcome = "error"
+        session_events.record("error", where="session", error=repr(e)[:200])
+        raise
+    finally:
+        await narrator.stop()
+        for task in background:
+            task.cancel()
+        if background:
+            await asyncio.wait(background)
+        await client.close()
+        session_events.record("session_ended", outcome=outcome, seconds=round(time.perf_counter() - started, 1))
+        session_events.end_session(token)
 
-        # get data from the db
-        concept_name_obj = await db.execute(
-            "SELECT name FROM lessons WHERE ID=?", (concept_id,)
-        )
-        conclusion_obj = await db.execute(
-            f"SELECT conclusion_text FROM conclusions WHERE lesson_id=?", (concept_id,)
-        )
-        context_obj = await db.execute(
-            f"SELECT context_text FROM contexts WHERE lesson_id=?", (concept_id,)
-        )
-        explanation_steps_obj = await db.execute(
-            f"""SELECT step_num,step_text FROM explanation_steps 
-                            WHERE lesson_id=?ORDER BY step_num ASC""",
-            (concept_id,),
-        )
-        snippet_obj = await db.execute(
-            f"""SELECT step_num, snippet_num, snippet_text FROM step_snippets 
-                            WHERE lesson_id=? ORDER BY step_num ASC""",
-            (concept_id,),
-        )
-        tts_steps_obj = await db.execute(
-            f"""SELECT step_num,tts_text FROM tts_steps 
-                            WHERE lesson_id=? ORDER BY step_num ASC""",
-            (concept_id,),
-        )
-        tts_context_obj = await db.execute(
-            f"""SELECT snippet_text,snippet_num FROM context_snippets 
-                            WHERE lesson_id=? ORDER BY snippet_num ASC""",
-            (concept_id,),
-        )
-        tts_conclusion_obj = await db.execute(
-            f"""SELECT snippet_text,snippet_num FROM conclusion_snippets 
-                            WHERE lesson_id=? ORDER BY snippet_num ASC""",
-            (concept_id,),
-        )
 
-        concept_name = concept_name_obj[0][0]
-        conclusion = conclusion_obj[0][0]
-        context = context_obj[0][0]
-
-        # get all snippets for conclusion
-        conclusion_snippets = []
-        for snippet_text, snippet_num in tts_conclusion_obj.rows:
-            conclusion_snippets.append((snippet_num, snippet_text))
-
-        # get all snippets for context
-        context_snippets = []
-        for snippet_text, snippet_num in tts_context_obj.rows:
-            context_snippets.append((snippet_num, snippet_text))
-
-        # get the tts data for all explanation steps
-        explanation_steps = {}
-        for step_num, step_text in tts_steps_obj.rows:
-            explanation_steps.setdefault(int(step_num), {})["tts_text"] = step_text
-        print(explanation_steps)
-        # get all the steps in a list in sorted order
-        for step_num, step_text in explanation_steps_obj.rows:
-            explanation_steps[step_num]["sub_text"] = step_text
-
-        # get all snippets in a list in sorted order
-        for snippet_row in snippet_obj.rows:
-            step_num = snippet_row[0]
-            snippet_num = snippet_row[1]
-            snippet_text = snippet_row[2]
-            explanation_steps[step_num].setdefault("snippets", []).append(
-                (snippet_num, snippet_text)
-            )
+async def explanation_session(
+    websocket: WebSocket,
+    client: SocketWriter,
+    narrator: Narrator,
+    background: list,
+    concept_id: int,
+    db: Connection,
+    with_bundle: bool = False,
+):
+    #try:
 
-        # get diagram data from object storage
-        prefix = f"Diagrams/{concept_id}/"
+        # get the lesson (db or compiled snapshot) and its diagram keys
+        lesson = await get_lesson(db, concept_id)
+        concept_name = lesson["name"]
+        conclusion = lesson["conclusion"]
+        context = lesson["context"]
+        conclusion_snippets = lesson["conclusion_snippets"]
+        context_snippets = lesson["context_snippets"]
+        explanation_steps = lesson["explanation_steps"]
 
-        response = s3_client.list_objects_v2(Bucket="explanation-dev", Prefix=prefix)
-        
-        # Check if the bucket/prefix actually contains files
-        if "Contents" not in response:
-            await safe_send_ws(websocket, {"status": "error", "data": "This lesson doesn't have any diagrams"})
+        # Check if the lesson actually has diagrams
+        if not lesson["diagram_keys"]:
+            await client.send({"status": "error", "data": "This lesson doesn't have any diagrams"})
+            await client.close()
             await websocket.close()
             return
 
+        # url_data: fig name -> {extension: url}, e.g. url_data["fig_1_preview"]["png"]
+        # bundle clients have the urls already
         url_data = {}
-        for obj in response["Contents"]:
-            key = obj["Key"]
-            if key == prefix or "metadata" in key:
-                continue
-            fig_name = key.split("/")[-1].split(".")[0]
-            url_data[fig_name] = s3_client.generate_presigned_url(
-                ClientMethod="get_object",
-                Params={"Bucket": "explanation-dev", "Key": key},
-                ExpiresIn=7200,
-            )
+        if not with_bundle:
+            url_data = await lesson_diagram_urls(concept_id, lesson["diagram_keys"])
 
         # send initial metadata
         data = {
@@ -117,12 +236,24 @@ async def get_explanation(
             "type": "METADATA",
             "name": concept_name,
             "num_steps": len(explanation_steps),
+            "bundle_url": f"/lessons/{concept_id}",
         }
+        if not with_bundle:
+            # every step's diagram up front, so the client prefetches them in step order
+            # instead of starting each download when the step's TEXT_FULL arrives
+            manifest = build_preload_manifest(concept_id, lesson, url_data)
+            data["preload"] = manifest
         print("Conclusion Snippets: \n",conclusion_snippets)
         print("Context Snippets: \n",context_snippets)
         print("Explanation Steps: \n",explanation_steps)
 
-        await safe_send_ws(ws=websocket, data=data)
+        await client.send(data)
+        if not with_bundle and DIAGRAM_PUSH_COUNT:
+            # queued on the bulk lane behind METADATA; cancelled with the session so it
+            # doesn't keep reading diagrams after a disconnect
+            background.append(
+                asyncio.create_task(push_diagrams(client, concept_id, manifest), name="diagram-push")
+            )
 
         # Main Event Loop
         while True:
@@ -132,54 +263,73 @@ async def get_explanation(
 
             if "part" not in state_data:
                 continue
+            session_events.record("part_requested", part=state_data["part"], index=state_data.get("index"))
+            # bundle clients render the part from the bundle, TEXT_FULL only names it
+            ref = {"part": state_data["part"], "index": state_data.get("index")} if with_bundle else None
 
             match state_data[
                 "part"
             ]:  # check what part of the explanation needs to be streamed i.e context, conlusion or one of the explanation steps
                 case "CONTEXT":
-                    async for chunk in tts_openai(tts_text = context, snippets=context_snippets):
-                        await websocket.send_json(chunk)
+                    await narrator.play(tts_text=context, snippets=context_snippets, ref=ref)
 
                 case "CONCLUSION":
-                    async for chunk in tts_openai(tts_text = conclusion, snippets=conclusion_snippets):
-                        await websocket.send_json(chunk)
+                    await narrator.play(HIGH, tts_text=conclusion, snippets=conclusion_snippets, ref=ref)
 
                 case "EXPLANATION_STEP":
                     index = state_data["index"]
-                    async for chunk in tts_openai(
+                    image_formats = dict(url_data.get(f"fig_{index}", {}))
+                    await narrator.play(
+                        HIGH,
                         snippets=explanation_steps[index].get("snippets", None),
                         tts_text=explanation_steps[index]["tts_text"],
                         sub_text=explanation_steps[index]["sub_text"],
-                        image_url=url_data.get(f"fig_{index}", None),
-                    ):
-                        await websocket.send_json(chunk)
+                        image_url=image_formats.pop("png", None),
+                        image_preview_url=url_data.get(f"fig_{index}_preview", {}).get("png"),
+                        image_formats=image_formats,
+                        ref=ref,
+                    )
 
                 case "VOICEBOT":
                     index = state_data["index"]
-                    explained_steps = [
-                        explanation_steps[i]["sub_text"] for i in range(index + 1)
-                    ]  # [r for r in explained_steps[: index + 1]["text"]]
-                    voice_prompt = build_voicebot_prompt(
-                        concept_name, context, explained_steps
-                    )
+                    await narrator.stop()  # the tutor talks now, drop the rest of the narration
+                    voice_prompt = build_voicebot_prompt(concept_id, index, lesson)
+                    VOICE_PROMPT_TOKENS.observe(estimate_tokens(voice_prompt))
 
                     data = {
                         "type": "VOICEBOT_INIT",
                         "status": "starting",
                         "message": "Initializing interactive tutor...",
                     }
-                    await safe_send_ws(ws=websocket, data=data)
+                    await client.send(data)
 
                     # start the voicebot flow
-                    await handle_voicebot_session_openai(websocket, voice_prompt)
-                    #await handle_voicebot_session_gemini(websocket, voice_prompt)
+                    # new sessions are the first to be refused when the providers are at capacity
+                    voicebot_started, voicebot_outcome = time.perf_counter(), "ended"
+                    try:
+                        with ACTIVE_VOICEBOT_SESSIONS.track_inprogress():
+                            if VOICEBOT_PROVIDER == "gemini":
+                                await handle_voicebot_session_gemini(websocket, voice_prompt, client)
+                            else:
+                                await handle_voicebot_session_openai(websocket, voice_prompt, client)
+                    except ServerBusy as e:
+                        logger.warning(f"Voicebot session refused: {e}")
+                        voicebot_outcome = "busy"
+                        session_events.record("server_busy", where="voicebot", retry_after=e.retry_after)
+                        await client.send(e.to_client())
+                    session_events.record(
+                        "voicebot_ended",
+                        provider=VOICEBOT_PROVIDER,
+                        outcome=voicebot_outcome,
+                        seconds=round(time.perf_counter() - voicebot_started, 1),
+                    )
 
                     data = {
                         "type": "VOICEBOT_EXIT",
                         "status": "ended",
                         "message": "Voicebot session ended",
                     }
-                    await safe_send_ws(ws=websocket, data=data)
+                    await client.send(data, bulk=True)  # after the bridge's last audio
 
     # except WebSocketDisconnect:
     #     logger.warning("Client Websocket closed/Disconnected.")
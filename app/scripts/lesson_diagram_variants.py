@@ -0,0 +1,109 @@
+"""Builds the preview (and optional extra formats) for lesson diagrams.
+
+Usage:
+    cd app
+    python -m scripts.lesson_diagram_variants                 # every lesson
+    python -m scripts.lesson_diagram_variants --concept-id 3 --formats webp
+
+Lesson figures live at `Diagrams/{concept_id}/fig_{step}.png` at 300 dpi. For
+every figure this uploads `fig_{step}_preview.png` downscaled to the preview dpi,
+plus a copy in each requested format, and reports sizes and upload times.
+Only raster formats can be made from the png: svg comes from the worker's render
+(`DIAGRAM_EXTRA_FORMATS`) and can't be backfilled here.
+"""
+
+import io
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from utils import get_s3_client, CONTENT_TYPES, DIAGRAM_DPI, DIAGRAM_PREVIEW_DPI
+
+S3_BUCKET = "explanation-dev"
+PIL_FORMATS = {"png": "PNG", "webp": "WEBP"}  # what PIL can write; no svg
+
+
+def list_lesson_figures(concept_id: int = None) -> list:
+    prefix = f"Diagrams/{concept_id}/" if concept_id is not None else "Diagrams/"
+    keys = []
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith(".png") and not key.endswith("_preview.png") and "metadata" not in key:
+                keys.append(key)
+    return keys
+
+
+def encode(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=PIL_FORMATS[fmt], optimize=True)
+    return buffer.getvalue()
+
+
+def upload(key: str, content: bytes) -> float:
+    start = time.perf_counter()
+    get_s3_client().upload_fileobj(
+        io.BytesIO(content),
+        Bucket=S3_BUCKET,
+        Key=key,
+        ExtraArgs={"ContentType": CONTENT_TYPES[key.rsplit(".", 1)[-1]]},
+    )
+    return time.perf_counter() - start
+
+
+def build_variants(key: str, formats: list, pool: ThreadPoolExecutor) -> dict:
+    body = get_s3_client().get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+    image = Image.open(io.BytesIO(body))
+    base = key.rsplit(".", 1)[0]
+
+    scale = DIAGRAM_PREVIEW_DPI / DIAGRAM_DPI
+    preview = image.resize(
+        (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+        Image.LANCZOS,
+    )
+    outputs = {"preview": (f"{base}_preview.png", encode(preview, "png"))}
+    for fmt in formats:
+        outputs[fmt] = (f"{base}.{fmt}", encode(image, fmt))
+
+    futures = {label: pool.submit(upload, k, content) for label, (k, content) in outputs.items()}
+    metrics = {"full": {"bytes": len(body)}}
+    for label, future in futures.items():
+        metrics[label] = {
+            "bytes": len(outputs[label][1]),
+            "upload_s": round(future.result(), 3),
+        }
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concept-id", type=int, default=None)
+    parser.add_argument(
+        "--formats",
+        default="",
+        help=f"comma separated, any of {', '.join(PIL_FORMATS)} (svg can't be made from a png)",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unsupported = [f for f in formats if f not in PIL_FORMATS]
+    if unsupported:
+        parser.error(f"unsupported format(s): {', '.join(unsupported)}, choose from {', '.join(PIL_FORMATS)}")
+    totals = {}
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for key in list_lesson_figures(args.concept_id):
+            metrics = build_variants(key, formats, pool)
+            print(key, metrics)
+            for label, data in metrics.items():
+                totals.setdefault(label, 0)
+                totals[label] += data["bytes"]
+
+    print("Total bytes per format:", totals)
+
+
+if __name__ == "__main__":
+    main()
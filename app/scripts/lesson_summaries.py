@@ -0,0 +1,127 @@
+"""Precomputes the lesson summaries the voicebot uses to keep its prompt small.
+
+Usage:
+    cd app
+    python -m scripts.lesson_summaries --sqlite lessons.db                # every lesson
+    python -m scripts.lesson_summaries --turso --concept-id 3
+    python -m scripts.lesson_summaries --turso --force                    # redo all
+
+Summarizes each lesson's context and every explanation step into
+`lesson_summaries` (migration 3, run `python -m Database.migrations migrate` first),
+with token counts of the source and the summary. A summary is only regenerated
+when the text it was made from changed (or with --force), so reruns are cheap.
+Parts already under --min-tokens are skipped, the voicebot uses them verbatim.
+Rebuild lesson snapshots afterwards to ship the summaries with them.
+"""
+
+import os
+import asyncio
+import sqlite3
+import argparse
+
+from llm.clients import get_google_client
+from llm.registry import registry
+from llm.prompts import estimate_tokens, source_hash
+from Database import queries
+from Database.migrations import _rows
+
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gemini-2.5-flash")
+
+
+def lesson_parts(conn, concept_id: int) -> list:
+    """(part, step_num, text) for the context and every explanation step of a lesson."""
+    parts = [("context", -1, row[0]) for row in _rows(conn, queries.CONTEXT, (concept_id,))]
+    parts += [("step", int(num), text) for num, text in _rows(conn, queries.EXPLANATION_STEPS, (concept_id,))]
+    return parts
+
+
+def stored_hashes(conn, concept_id: int) -> dict:
+    return {
+        (part, step_num): hash_
+        for part, step_num, _, _, hash_ in _rows(conn, queries.SUMMARIES, (concept_id,))
+    }
+
+
+async def summarize(text: str, max_words: int, semaphore: asyncio.Semaphore, model: str) -> str:
+    system_prompt = registry.prompt("SUMMARIZER").render(max_words=max_words)
+    async with semaphore:
+        response = await get_google_client().aio.models.generate_content(
+            model=model, contents=text, config={"system_instruction": system_prompt}
+        )
+    return response.text.strip()
+
+
+async def summarize_all(jobs: list, args) -> list:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(job):
+        concept_id, part, step_num, text = job
+        # aim for about a third of the source, a word is ~1.3 tokens
+        max_words = max(20, int(estimate_tokens(text) / 3 / 1.3))
+        summary = await summarize(text, max_words, semaphore, args.model)
+        return concept_id, part, step_num, text, summary
+
+    return await asyncio.gather(*(run(job) for job in jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sqlite", help="path to a local sqlite file")
+    parser.add_argument("--turso", action="store_true", help="use the Turso database")
+    parser.add_argument("--concept-id", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="regenerate up to date summaries too")
+    parser.add_argument("--min-tokens", type=int, default=80, help="don't summarize shorter parts")
+    parser.add_argument("--model", default=SUMMARY_MODEL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.turso:
+        from libsql_client import create_client_sync
+
+        conn = create_client_sync(
+            url=os.environ.get("TURSO_EXPLANATION_DB_URL"),
+            auth_token=os.environ.get("TURSO_EXPLANATION_DB_TOKEN"),
+        )
+    elif args.sqlite:
+        conn = sqlite3.connect(args.sqlite)
+    else:
+        parser.error("needs --sqlite or --turso")
+
+    if args.concept_id is not None:
+        concept_ids = [args.concept_id]
+    else:
+        concept_ids = [row[0] for row in _rows(conn, "SELECT ID FROM lessons ORDER BY ID")]
+
+    jobs, up_to_date, short = [], 0, 0
+    for concept_id in concept_ids:
+        hashes = stored_hashes(conn, concept_id)
+        for part, step_num, text in lesson_parts(conn, concept_id):
+            if estimate_tokens(text) < args.min_tokens:
+                short += 1
+            elif not args.force and hashes.get((part, step_num)) == source_hash(text):
+                up_to_date += 1
+            else:
+                jobs.append((concept_id, part, step_num, text))
+    print(f"{len(jobs)} parts to summarize, {up_to_date} up to date, {short} too short")
+
+    source_tokens, summary_tokens = 0, 0
+    for concept_id, part, step_num, text, summary in asyncio.run(summarize_all(jobs, args)):
+        _rows(
+            conn,
+            """INSERT OR REPLACE INTO lesson_summaries
+               (lesson_id, part, step_num, summary_text, summary_tokens, source_tokens, source_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (concept_id, part, step_num, summary, estimate_tokens(summary), estimate_tokens(text), source_hash(text)),
+        )
+        source_tokens += estimate_tokens(text)
+        summary_tokens += estimate_tokens(summary)
+
+    if hasattr(conn, "commit"):
+        conn.commit()
+    conn.close()
+    if jobs:
+        print(f"Summarized {source_tokens} tokens into {summary_tokens} ({summary_tokens / source_tokens:.0%})")
+
+
+if __name__ == "__main__":
+    main()
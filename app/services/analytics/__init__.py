@@ -0,0 +1 @@
+from .recorder import EventRecorder, DatabaseSink, FileSink, session_events, ANALYTICS_SINK
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import asyncio
+import contextvars
+from collections import deque
+from datetime import datetime, timezone
+
+from utils import logger
+from metrics import ANALYTICS_EVENTS_RECORDED, ANALYTICS_EVENTS_DROPPED, ANALYTICS_FLUSH_SECONDS
+
+ANALYTICS_SINK = os.environ.get("ANALYTICS_SINK", "off")  # "off" | "db" | "file"
+ANALYTICS_DIR = os.environ.get("ANALYTICS_DIR", "analytics")  # "file" sink: one jsonl per process and day
+ANALYTICS_MAX_EVENTS = int(os.environ.get("ANALYTICS_MAX_EVENTS", 10000))  # buffered, newer ones are dropped
+ANALYTICS_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", 500))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get("ANALYTICS_FLUSH_INTERVAL", 5))
+
+# (session_id, lesson_id) of the client session the current task belongs to
+_current_session = contextvars.ContextVar("analytics_session", default=None)
+
+
+class DatabaseSink:
+    """Writes batches to `session_events` through the Database module (migration 4)."""
+
+    name = "db"
+
+    async def write(self, rows: list) -> None:
+        from Database import write_session_events, get_events_db
+
+        await write_session_events(get_events_db(), rows)
+
+
+class FileSink:
+    """Appends batches as JSON lines to `{directory}/events-{date}-{pid}.jsonl`, off the event loop.
+
+    Args:
+        directory(str): Where the files are written.
+    """
+
+    name = "file"
+
+    def __init__(self, directory: str = ANALYTICS_DIR):
+        self.directory = directory
+
+    def _append(self, rows: list):
+        os.makedirs(self.directory, exist_ok=True)
+        day = datetime.now(timezone.utc).strftime("%Y%m%d")
+        path = os.path.join(self.directory, f"events-{day}-{os.getpid()}.jsonl")
+        lines = [
+            json.dumps({"session_id": s, "lesson_id": l, "kind": k, "ts": ts, "data": json.loads(d)})
+            for s, l, k, ts, d in rows
+        ]
+        with open(path, "a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    async def write(self, rows: list) -> None:
+        await asyncio.to_thread(self._append, rows)
+
+
+class EventRecorder:
+    """Write-behind log of what students do in a session (parts played, skips, voicebot
+    sessions, diagrams, errors), for usage and capacity planning.
+
+    `record` only appends to an in-memory buffer, it never waits or does I/O; a flush
+    task writes the buffer to the sink in batches every `flush_interval` seconds, or
+    sooner once `batch_size` events are waiting. The buffer holds at most `max_events`:
+    when the sink can't keep up new events are dropped and counted, a failed batch is
+    dropped and counted too. Without a sink `record` does nothing.
+
+    Args:
+        sink: Object with an async `write(rows)` and a `name`, or None.
+        max_events(int): Events buffered before new ones are dropped.
+        batch_size(int): Events per write.
+        flush_interval(float): Seconds between flushes.
+    """
+
+    def __init__(
+        self,
+        sink=None,
+        max_events: int = ANALYTICS_MAX_EVENTS,
+        batch_size: int = ANALYTICS_BATCH_SIZE,
+        flush_interval: float = ANALYTICS_FLUSH_INTERVAL,
+    ):
+        self.sink = sink
+        self.max_events = max_events
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque()
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+        self._stopping = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    # --- sessions ---
+    def start_session(self, session_id: str, lesson_id: int = None) -> contextvars.Token:
+        """Makes `session_id` the session of events recorded from this task (and tasks it
+        starts from now on). Returns the token for `end_session`."""
+        return _current_session.set((session_id, lesson_id))
+
+    def end_session(self, token: contextvars.Token):
+        _current_session.reset(token)
+
+    # --- hot path ---
+    def record(self, kind: str, **data) -> None:
+        """Buffers one event of the current session. Never blocks.
+
+        Args:
+            kind(str): What happened, e.g. "part_played" or "voicebot_ended".
+            **data: JSON serializable details.
+        """
+        if self.sink is None:
+            return
+        if len(self._buffer) >= self.max_events:
+            ANALYTICS_EVENTS_DROPPED.labels("full").inc()
+            return
+        session_id, lesson_id = _current_session.get() or (None, None)
+        self._buffer.append((session_id, lesson_id, kind, round(time.time(), 3), data))
+        ANALYTICS_EVENTS_RECORDED.inc()
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- flushing ---
+    def start(self):
+        """Starts the flush task, in the web server's lifespan."""
+        if self.sink is None or self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop(), name="analytics-flush")
+
+    async def stop(self, timeout: float = 5.0):
+        """Writes what's left (for at most `timeout` seconds) and stops the flush task."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logger.warning(f"Analytics: {self.pending} events not written at shutdown")
+        self._task = None
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+        await self.flush()  # what was recorded since, stop() is waiting for it
+
+    async def flush(self) -> int:
+        """Writes every buffered event, in batches. Returns the number written."""
+        written = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            rows = [(s, l, k, ts, json.dumps(d, default=str)) for s, l, k, ts, d in batch]
+            start = time.perf_counter()
+            try:
+                await self.sink.write(rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analytics: dropping {len(rows)} events, {self.sink.name} write failed: {e}")
+                ANALYTICS_EVENTS_DROPPED.labels("write_failed").inc(len(rows))
+                continue
+            ANALYTICS_FLUSH_SECONDS.labels(self.sink.name).observe(time.perf_counter() - start)
+            written += len(rows)
+        return written
+
+
+def _sink():
+    if ANALYTICS_SINK == "db":
+        return DatabaseSink()
+    if ANALYTICS_SINK == "file":
+        return FileSink(ANALYTICS_DIR)
+    return None
+
+
+session_events = EventRecorder(_sink())
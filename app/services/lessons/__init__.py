@@ -0,0 +1,4 @@
+from .bundle import (LessonBundle, build_lesson_bundle, bundle_cache, url_epoch,
+                     DIAGRAM_URL_EXPIRY, LESSON_BUNDLE_MAX_AGE)
+from .diagram_cache import DiagramCache, diagram_cache, diagram_urls
+from .preload import build_preload_manifest, push_diagrams, DIAGRAM_PUSH_COUNT
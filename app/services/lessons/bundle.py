@@ -0,0 +1,180 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:  # optional, gzip is used without it
+    import brotli
+except ImportError:
+    brotli = None
+
+from metrics import LESSON_BUNDLE_RESPONSES
+
+LESSON_BUNDLE_MAX_AGE = int(os.environ.get("LESSON_BUNDLE_MAX_AGE", 600))  # Cache-Control max-age
+LESSON_BUNDLE_CACHE_SIZE = int(os.environ.get("LESSON_BUNDLE_CACHE_SIZE", 256))
+DIAGRAM_URL_EXPIRY = 7200  # presigned url lifetime
+COMPRESS_MIN_BYTES = 1024
+
+# Presigned urls change every time they're signed, so a bundle is built once per
+# epoch and reused until the next one. Urls signed anywhere in an epoch stay valid
+# for at least DIAGRAM_URL_EXPIRY - URL_EPOCH seconds after it ends.
+URL_EPOCH = DIAGRAM_URL_EXPIRY // 2
+
+
+def url_epoch(now: float = None) -> int:
+    return int((now or time.time()) // URL_EPOCH)
+
+
+def build_lesson_bundle(concept_id: int, lesson: dict, url_data: dict, audio_urls: dict) -> dict:
+    """Everything the client shows during a lesson, in one document.
+
+    Args:
+        concept_id(int): id of the lesson.
+        lesson(dict): Lesson as returned by `get_lesson`.
+        url_data(dict): fig name -> {extension: url} of the lesson's diagrams.
+        audio_urls(dict): part ("context", "step_{n}", "conclusion") -> {extension: url}
+            of pre-rendered narration, empty when there is none.
+
+    Returns:
+        dict: name, context, conclusion, steps (in order, with their images) and audio.
+    """
+
+    def snippet_texts(snippets) -> list:
+        return [text for _, text in sorted(snippets or [])]
+
+    steps = []
+    for index in sorted(lesson["explanation_steps"]):
+        step = lesson["explanation_steps"][index]
+        formats = dict(url_data.get(f"fig_{index}", {}))
+        steps.append(
+            {
+                "index": index,
+                "text": step["sub_text"],
+                "snippets": snippet_texts(step.get("snippets")),
+                "image": {
+                    "url": formats.pop("png", None),
+                    "preview_url": url_data.get(f"fig_{index}_preview", {}).get("png"),
+                    "formats": formats,
+                },
+            }
+        )
+
+    return {
+        "id": concept_id,
+        "name": lesson["name"],
+        "num_steps": len(steps),
+        "context": {"text": lesson["context"], "snippets": snippet_texts(lesson["context_snippets"])},
+        "conclusion": {"text": lesson["conclusion"], "snippets": snippet_texts(lesson["conclusion_snippets"])},
+        "steps": steps,
+        "audio": audio_urls,
+    }
+
+
+class LessonBundle:
+    """A lesson bundle serialized and compressed once, served with conditional GET.
+
+    Every encoding is its own representation with its own strong ETag (the hash of
+    the uncompressed body, suffixed with the encoding).
+
+    Args:
+        bundle(dict): As returned by `build_lesson_bundle`.
+        epoch(int): Url epoch the bundle's urls were signed in.
+    """
+
+    def __init__(self, bundle: dict, epoch: int):
+        self.epoch = epoch
+        body = json.dumps({"data": bundle, "status": 200}, separators=(",", ":")).encode("utf-8")
+        self.tag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {"identity": body}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            self.bodies["gzip"] = gzip.compress(body, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body, quality=9)
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.tag}"' if encoding == "identity" else f'"{self.tag}-{encoding}"'
+
+    def choose_encoding(self, accept_encoding: str) -> str:
+        accepted = set()
+        for item in (accept_encoding or "").split(","):
+            name, _, params = item.partition(";")
+            params = params.replace(" ", "")
+            try:
+                q = float(params[2:]) if params.startswith("q=") else 1.0
+            except ValueError:
+                q = 0.0
+            if q > 0:
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def not_modified(self, if_none_match: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # weak comparison (RFC 9110): any encoding of the same body matches
+        for tag in if_none_match.split(","):
+            tag = tag.strip().removeprefix("W/").strip('"')
+            if tag.split("-", 1)[0] == self.tag:
+                return True
+        return False
+
+    def response_parts(self, headers, now: float = None) -> tuple:
+        """(status code, body, headers) answering a GET with `headers`."""
+        now = now or time.time()
+        encoding = self.choose_encoding(headers.get("accept-encoding"))
+        # a cached copy must not outlive the urls in it
+        max_age = max(0, min(LESSON_BUNDLE_MAX_AGE, int((self.epoch + 1) * URL_EPOCH - now)))
+        response_headers = {
+            "ETag": self.etag(encoding),
+            "Cache-Control": f"public, max-age={max_age}",
+            "Vary": "Accept-Encoding",
+        }
+
+        if self.not_modified(headers.get("if-none-match")):
+            LESSON_BUNDLE_RESPONSES.labels("304", encoding).inc()
+            return 304, b"", response_headers
+
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        LESSON_BUNDLE_RESPONSES.labels("200", encoding).inc()
+        return 200, self.bodies[encoding], response_headers
+
+
+class BundleCache:
+    """Built bundles by lesson, for the current url epoch (LRU, thread safe)."""
+
+    def __init__(self, size: int = LESSON_BUNDLE_CACHE_SIZE):
+        self.size = size
+        self._bundles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, concept_id: int, epoch: int):
+        with self._lock:
+            bundle = self._bundles.get(concept_id)
+            if bundle is None or bundle.epoch != epoch:
+                return None
+            self._bundles.move_to_end(concept_id)
+            return bundle
+
+    def put(self, concept_id: int, bundle: LessonBundle) -> LessonBundle:
+        with self._lock:
+            self._bundles[concept_id] = bundle
+            self._bundles.move_to_end(concept_id)
+            if len(self._bundles) > self.size:
+                self._bundles.popitem(last=False)
+        return bundle
+
+    def clear(self):
+        """Drops every bundle, e.g. after lesson content changed."""
+        with self._lock:
+            self._bundles.clear()
+
+
+bundle_cache = BundleCache()
@@ -0,0 +1,225 @@
+import os
+import time
+import asyncio
+import hashlib
+import functools
+from pathlib import Path
+from dataclasses import dataclass
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.responses import FileResponse
+
+from utils import get_s3_client, logger, CONTENT_TYPES
+from metrics import (DIAGRAM_CACHE_REQUESTS, DIAGRAM_CACHE_BYTES_SERVED,
+                     DIAGRAM_CACHE_FILL_SECONDS, DIAGRAM_CACHE_SIZE_BYTES)
+
+S3_BUCKET = "explanation-dev"
+DIAGRAM_CACHE_DIR = os.environ.get("DIAGRAM_CACHE_DIR")  # unset = clients use presigned urls
+DIAGRAM_CACHE_MAX_BYTES = int(os.environ.get("DIAGRAM_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+DIAGRAM_CACHE_TTL = float(os.environ.get("DIAGRAM_CACHE_TTL", 3600))  # revalidate with object storage after
+DIAGRAM_CACHE_MAX_AGE = int(os.environ.get("DIAGRAM_CACHE_MAX_AGE", 3600))  # Cache-Control for clients
+# served by nginx (sendfile) when set: an `internal` location aliased to DIAGRAM_CACHE_DIR
+DIAGRAM_CACHE_ACCEL_PREFIX = os.environ.get("DIAGRAM_CACHE_ACCEL_PREFIX")
+# prefix of the diagram urls handed to clients, e.g. "https://api.example.com"
+DIAGRAM_PUBLIC_BASE_URL = os.environ.get("DIAGRAM_PUBLIC_BASE_URL", "")
+FILL_CHUNK_BYTES = 64 * 1024
+
+
+@dataclass
+class CachedDiagram:
+    path: Path
+    size: int
+    etag: str  # object storage ETag, without quotes
+    content_type: str
+    checked_at: float  # last fill or revalidation
+
+
+class DiagramCache:
+    """Size-bounded LRU of diagram files on local disk, filled from object storage.
+
+    Concurrent misses for the same key share one download. Files are named
+    `{sha1(key)}.{etag}.{ext}` so the index is rebuilt from the directory on start.
+    Entries older than `ttl` are revalidated with a conditional GET before use.
+
+    Args:
+        directory(str): Where the files are kept.
+        max_bytes(int): Total size above which the least recently used files are removed.
+        ttl(float): Seconds before an entry is revalidated with object storage.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DIAGRAM_CACHE_MAX_BYTES, ttl: float = DIAGRAM_CACHE_TTL):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, CachedDiagram] = OrderedDict()
+        self._fills: dict[str, asyncio.Task] = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _scan(self):
+        files = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp":
+                path.unlink(missing_ok=True)  # a fill that didn't finish
+                continue
+            parts = path.name.split(".")
+            if len(parts) != 3:
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, parts, path, stat.st_size))
+
+        # oldest first, the LRU order is approximated by fill time
+        for mtime, (name, etag, ext), path, size in sorted(files):
+            content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+            self._entries[name] = CachedDiagram(path, size, etag, content_type, mtime)
+            self.total_bytes += size
+        self._evict()
+        DIAGRAM_CACHE_SIZE_BYTES.set(self.total_bytes)
+
+    # --- lookups ---
+    async def get(self, key: str) -> CachedDiagram:
+        """The cached file of an object storage key. Raises FileNotFoundError if there is none."""
+        name = self._name(key)
+        entry = self._entries.get(name)
+        if entry is not None and not entry.path.exists():  # removed by another worker
+            self._drop(name)
+            entry = None
+
+        if entry is not None and time.time() - entry.checked_at < self.ttl:
+            self._entries.move_to_end(name)
+            DIAGRAM_CACHE_REQUESTS.labels("hit").inc()
+            return entry
+
+        fill = self._fills.get(name)
+        if fill is not None:
+            DIAGRAM_CACHE_REQUESTS.labels("coalesced").inc()
+        else:
+            DIAGRAM_CACHE_REQUESTS.labels("revalidate" if entry is not None else "miss").inc()
+            # its own task: a requester going away doesn't cancel the download for the others
+            fill = asyncio.create_task(self._fill(key, name, entry))
+            self._fills[name] = fill
+            fill.add_done_callback(functools.partial(self._fill_done, name))
+        return await asyncio.shield(fill)
+
+    def _fill_done(self, name: str, task: asyncio.Task):
+        self._fills.pop(name, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here, the requesters re-raise it
+
+    async def _fill(self, key: str, name: str, current: CachedDiagram) -> CachedDiagram:
+        start = time.perf_counter()
+        entry = await asyncio.to_thread(self._fetch, key, name, current)
+        DIAGRAM_CACHE_FILL_SECONDS.observe(time.perf_counter() - start)
+        self._store(name, entry)
+        return entry
+
+    # --- filling (worker threads) ---
+    def _fetch(self, key: str, name: str, current: CachedDiagram) -> CachedDiagram:
+        from botocore.exceptions import ClientError
+
+        params = {"Bucket": S3_BUCKET, "Key": key}
+        if current is not None:
+            params["IfNoneMatch"] = f'"{current.etag}"'
+        try:
+            response = get_s3_client().get_object(**params)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if current is not None and code in ("304", "NotModified"):
+                os.utime(current.path)
+                current.checked_at = time.time()
+                return current
+            if code in ("404", "NoSuchKey"):
+                raise FileNotFoundError(key) from e
+            raise
+
+        etag = response["ETag"].strip('"')
+        ext = key.rsplit(".", 1)[-1].lower()
+        path = self.directory / f"{name}.{etag}.{ext}"
+        tmp = self.directory / f"{name}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        size = 0
+        try:
+            with open(tmp, "wb") as file:
+                for chunk in response["Body"].iter_chunks(FILL_CHUNK_BYTES):
+                    file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return CachedDiagram(path, size, etag, CONTENT_TYPES.get(ext, "application/octet-stream"), time.time())
+
+    # --- index (event loop only) ---
+    def _store(self, name: str, entry: CachedDiagram):
+        previous = self._entries.pop(name, None)
+        if previous is not None:
+            self.total_bytes -= previous.size
+            if previous.path != entry.path:
+                previous.path.unlink(missing_ok=True)
+        self._entries[name] = entry
+        self.total_bytes += entry.size
+        self._evict()
+        DIAGRAM_CACHE_SIZE_BYTES.set(self.total_bytes)
+
+    def _drop(self, name: str):
+        entry = self._entries.pop(name)
+        self.total_bytes -= entry.size
+        entry.path.unlink(missing_ok=True)
+        DIAGRAM_CACHE_SIZE_BYTES.set(self.total_bytes)
+
+    def _evict(self):
+        # keep at least the newest file, even when it alone is over the limit
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            entry.path.unlink(missing_ok=True)
+            logger.info(f"Diagram cache evicted {entry.path.name} ({entry.size} bytes)")
+
+    # --- serving ---
+    def response(self, entry: CachedDiagram, headers) -> Response:
+        """Serves a cached file: 304 on a matching If-None-Match, Range requests,
+        and nginx sendfile through X-Accel-Redirect when configured."""
+        etag = f'"{entry.etag}"'
+        response_headers = {"ETag": etag, "Cache-Control": f"public, max-age={DIAGRAM_CACHE_MAX_AGE}"}
+
+        if_none_match = headers.get("if-none-match") or ""
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers=response_headers)
+
+        DIAGRAM_CACHE_BYTES_SERVED.inc(served_bytes(headers.get("range"), entry.size))
+        if DIAGRAM_CACHE_ACCEL_PREFIX:
+            response_headers["X-Accel-Redirect"] = f"{DIAGRAM_CACHE_ACCEL_PREFIX.rstrip('/')}/{entry.path.name}"
+            return Response(headers=response_headers, media_type=entry.content_type)
+        # sent with the ASGI pathsend extension (zero copy) where the server supports it
+        return FileResponse(entry.path, media_type=entry.content_type, headers=response_headers)
+
+
+def served_bytes(range_header: str, size: int) -> int:
+    """Bytes a response sends: the whole file, or a single `bytes=a-b` range."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return size
+    start, _, end = range_header[len("bytes="):].partition("-")
+    try:
+        if not start:
+            return min(size, int(end))
+        return max(0, min(size - 1, int(end) if end else size - 1) - int(start) + 1)
+    except ValueError:
+        return size
+
+
+def diagram_urls(concept_id: int, keys: list) -> dict:
+    """fig name -> {extension: url} of a lesson's diagrams, served by the diagram cache."""
+    url_data = {}
+    for key in keys:
+        file_name = key.split("/")[-1]
+        fig_name, ext = file_name.rsplit(".", 1)
+        url_data.setdefault(fig_name, {})[ext] = f"{DIAGRAM_PUBLIC_BASE_URL}/diagrams/{concept_id}/{file_name}"
+    return url_data
+
+
+diagram_cache = DiagramCache(DIAGRAM_CACHE_DIR) if DIAGRAM_CACHE_DIR else None
@@ -0,0 +1,102 @@
+import os
+import base64
+import asyncio
+
+from utils import get_s3_client, logger, CONTENT_TYPES
+from metrics import DIAGRAM_PUSHED_BYTES
+
+from .diagram_cache import diagram_cache, S3_BUCKET
+
+# images of the first steps sent over the websocket right after METADATA, 0 = off
+DIAGRAM_PUSH_COUNT = int(os.environ.get("DIAGRAM_PUSH_COUNT", 0))
+# larger images are left to the client's prefetch, base64 inflates them by a third
+DIAGRAM_PUSH_MAX_BYTES = int(os.environ.get("DIAGRAM_PUSH_MAX_BYTES", 256 * 1024))
+
+
+def build_preload_manifest(concept_id: int, lesson: dict, url_data: dict) -> list:
+    """The diagrams of every explanation step, in step order, for the client to prefetch.
+
+    Args:
+        concept_id(int): id of the lesson.
+        lesson(dict): Lesson as returned by `get_lesson`.
+        url_data(dict): fig name -> {extension: url} of the lesson's diagrams.
+
+    Returns:
+        list: {"index", "url", "size", "preview_url", "preview_size", "formats"} per step
+            that has a diagram. Sizes are in bytes, None when unknown (older snapshots).
+    """
+    sizes = lesson.get("diagram_sizes") or {}
+
+    def size(fig_name: str, ext: str):
+        return sizes.get(f"Diagrams/{concept_id}/{fig_name}.{ext}")
+
+    manifest = []
+    for index in sorted(lesson["explanation_steps"]):
+        fig_name = f"fig_{index}"
+        formats = dict(url_data.get(fig_name, {}))
+        if not formats:
+            continue
+        url = formats.pop("png", None)
+        preview_url = url_data.get(f"{fig_name}_preview", {}).get("png")
+        manifest.append(
+            {
+                "index": index,
+                "url": url,
+                "size": size(fig_name, "png") if url else None,
+                "preview_url": preview_url,
+                "preview_size": size(f"{fig_name}_preview", "png") if preview_url else None,
+                "formats": {ext: {"url": u, "size": size(fig_name, ext)} for ext, u in formats.items()},
+            }
+        )
+    return manifest
+
+
+def _read_object(key: str) -> bytes:
+    return get_s3_client().get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+
+
+async def read_diagram(key: str) -> bytes:
+    """A diagram's bytes, through the disk cache when it's enabled (which also fills it)."""
+    if diagram_cache is not None:
+        entry = await diagram_cache.get(key)
+        return await asyncio.to_thread(entry.path.read_bytes)
+    return await asyncio.to_thread(_read_object, key)
+
+
+async def push_diagrams(client, concept_id: int, manifest: list, count: int = DIAGRAM_PUSH_COUNT) -> int:
+    """Sends the png of the first `count` steps in the manifest as DIAGRAM_DATA messages
+    (base64), so the first steps render without a round trip. Images over
+    DIAGRAM_PUSH_MAX_BYTES or of unknown size are skipped. Stops once the socket closes.
+
+    Args:
+        client(SocketWriter): Writer of the client socket; pushes go on the bulk lane.
+        concept_id(int): id of the lesson.
+        manifest(list): As returned by `build_preload_manifest`.
+        count(int): Number of steps to push.
+
+    Returns:
+        int: Bytes pushed.
+    """
+    pushed = 0
+    for item in manifest[:count]:
+        if item["url"] is None or item["size"] is None or item["size"] > DIAGRAM_PUSH_MAX_BYTES:
+            continue
+        key = f"Diagrams/{concept_id}/fig_{item['index']}.png"
+        try:
+            data = await read_diagram(key)
+        except Exception as e:
+            logger.warning(f"Couldn't push {key}: {e}")
+            continue
+
+        message = {
+            "type": "DIAGRAM_DATA",
+            "index": item["index"],
+            "url": item["url"],
+            "content_type": CONTENT_TYPES["png"],
+            "data": base64.b64encode(data).decode("ascii"),
+        }
+        if not await client.send(message, bulk=True):
+            break
+        pushed += len(data)
+        DIAGRAM_PUSHED_BYTES.inc(len(data))
+    return pushed
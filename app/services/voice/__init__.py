@@ -1,3 +1,4 @@
 from .tts_service import tts_openai
+from .tts_pacing import AudioPacer, TTS_PACING
 from .voice_agent_openai_service import handle_voicebot_session_openai
 from .voice_agent_gemini_service import handle_voicebot_session_gemini
\ No newline at end of file
@@ -0,0 +1,201 @@
+import os
+import time
+import uuid
+import asyncio
+from typing import Optional
+
+from utils import logger, SocketWriter
+from metrics import (INFLIGHT_DIAGRAM_TASKS, DIAGRAM_END_TO_END_SECONDS,
+                     DIAGRAM_JOBS_CANCELLED, DIAGRAM_CLEANUP_SECONDS)
+from celery_tasks import generate_diagram
+from services.analytics import session_events
+from services.voice.diagram_monitoring import (
+    wait_for_diagram,
+    deliver_diagram_result,
+    send_function_response,
+)
+
+DIAGRAM_SESSION_CONCURRENCY = int(os.environ.get("DIAGRAM_SESSION_CONCURRENCY", 2))
+DIAGRAM_CLOSE_TIMEOUT = float(os.environ.get("DIAGRAM_CLOSE_TIMEOUT", 5))  # seconds a session end waits for cleanup
+
+
+class DiagramJob:
+    def __init__(self, prompt: str, call_id, fn_name: str, previous: Optional["DiagramJob"]):
+        self.prompt = prompt
+        self.call_id = call_id
+        self.fn_name = fn_name
+        self.previous = previous
+        self.task_id: Optional[str] = None
+        self.delivered = asyncio.Event()
+        self.monitor: Optional[asyncio.Task] = None
+        self.submitted_at = time.perf_counter()
+
+
+class DiagramJobManager:
+    """Runs the diagram requests of one voice session.
+
+    Accepts any number of outstanding requests, runs at most `max_concurrency`
+    celery tasks at once, ignores prompts that are already being generated and
+    delivers results to the client in the order they were requested.
+    Jobs live as long as the session: `close` cancels them and revokes their tasks.
+    """
+
+    def __init__(
+        self,
+        client: SocketWriter,
+        agent: SocketWriter,
+        provider: str = "openai",
+        max_concurrency: int = DIAGRAM_SESSION_CONCURRENCY,
+    ):
+        self.client = client
+        self.agent = agent
+        self.provider = provider
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._jobs: dict[str, DiagramJob] = {}  # outstanding jobs by normalized prompt
+        self._last: Optional[DiagramJob] = None
+        self._closed = False
+
+    @staticmethod
+    def _key(prompt: str) -> str:
+        return " ".join(prompt.lower().split())
+
+    async def submit(self, prompt: str, call_id, fn_name: str = "generate_diagram") -> None:
+        """Queues a diagram request and acknowledges it to the AI & client.
+
+        Args:
+            prompt (str): Description of the diagram.
+            call_id: id for the function call (OpenAI) or tool call (Gemini).
+            fn_name (str): The name of the function called (Required for Gemini).
+        """
+        if self._closed:
+            logger.warning("Diagram requested after the session ended, ignoring it")
+            return
+        key = self._key(prompt)
+
+        session_events.record("diagram_requested", duplicate=key in self._jobs)
+        if key in self._jobs:
+            logger.info("Identical diagram already in progress, skipping duplicate")
+            await send_function_response(
+                self.agent,
+                call_id,
+                success=True,
+                message="This diagram is already being generated.",
+                provider=self.provider,
+                fn_name=fn_name,
+            )
+            return
+
+        job = DiagramJob(prompt, call_id, fn_name, previous=self._last)
+        self._jobs[key] = job
+        self._last = job
+        job.monitor = asyncio.create_task(self._run(key, job))
+
+        await send_function_response(
+            self.agent,
+            call_id,
+            success=True,
+            message="Diagram generation has started.",
+            data={"queued": len(self._jobs)},
+            provider=self.provider,
+            fn_name=fn_name,
+        )
+        await self.client.send({"type": "DIAGRAM_INITIATED"})
+
+    async def _run(self, key: str, job: DiagramJob) -> None:
+        try:
+            async with self._semaphore:
+                INFLIGHT_DIAGRAM_TASKS.inc()
+                try:
+                    # the id is known before sending, so `close` can revoke a task
+                    # that is still on its way to the broker
+                    job.task_id = uuid.uuid4().hex
+                    await asyncio.to_thread(generate_diagram.apply_async, (job.prompt,), task_id=job.task_id)
+                    logger.info(f"Started celery task {job.task_id}")
+                    diagram_result = await wait_for_diagram(
+                        job.task_id, on_preview=lambda url: self._send_preview(job, url)
+                    )
+                    if diagram_result.get("status") == "timeout":
+                        DIAGRAM_JOBS_CANCELLED.labels("timeout").inc()
+                        await asyncio.to_thread(generate_diagram.revoke, [job.task_id])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error Generating Diagram: {e}")
+                    diagram_result = {"status": "error", "data": str(e)}
+                finally:
+                    INFLIGHT_DIAGRAM_TASKS.dec()
+
+            # keep delivery in request order even if a later job finishes first
+            if job.previous is not None:
+                await job.previous.delivered.wait()
+                job.previous = None
+
+            await deliver_diagram_result(
+                self.client,
+                self.agent,
+                job.call_id,
+                diagram_result,
+                provider=self.provider,
+                fn_name=job.fn_name,
+            )
+            DIAGRAM_END_TO_END_SECONDS.labels(diagram_result.get("status", "success")).observe(
+                time.perf_counter() - job.submitted_at
+            )
+            session_events.record(
+                "diagram_delivered",
+                status=diagram_result.get("status", "success"),
+                seconds=round(time.perf_counter() - job.submitted_at, 1),
+            )
+
+        except asyncio.CancelledError:
+            logger.info(f"Task monitoring cancelled for {job.task_id}")
+            raise
+
+        except Exception as e:
+            logger.fatal(f"Unexpected error in diagram job: {e}")
+            await self.client.send(
+                {
+                    "type": "DIAGRAM_FAILED",
+                    "error": "Internal error monitoring diagram generation",
+                }
+            )
+
+        finally:
+            job.delivered.set()
+            self._jobs.pop(key, None)
+            logger.info(f"Cleaned up state for task {job.task_id}")
+
+    async def _send_preview(self, job: DiagramJob, url: str) -> None:
+        # only the job at the head of the queue may show something on the board
+        if job.previous is None or job.previous.delivered.is_set():
+            await self.client.send({"type": "DIAGRAM_PREVIEW", "url": url})
+
+    async def close(self, timeout: float = DIAGRAM_CLOSE_TIMEOUT) -> None:
+        """Cancels every outstanding job and revokes its celery task. Call on session end.
+
+        Jobs still waiting for a slot never reach the broker. Submitted tasks are revoked
+        in one broadcast: the worker drops queued ones, and running ones stop at their
+        next stage and kill their sandbox. Returns within about `timeout` seconds.
+        """
+        self._closed = True
+        jobs = list(self._jobs.values())
+        if not jobs:
+            return
+
+        start = time.perf_counter()
+        for job in jobs:
+            DIAGRAM_JOBS_CANCELLED.labels("submitted" if job.task_id else "waiting").inc()
+            job.monitor.cancel()
+
+        task_ids = [job.task_id for job in jobs if job.task_id is not None]
+        if task_ids:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(generate_diagram.revoke, task_ids), timeout)
+            except Exception as e:
+                logger.error(f"Couldn't revoke diagram tasks {task_ids}: {e!r}")
+
+        _, pending = await asyncio.wait([job.monitor for job in jobs], timeout=timeout)
+        if pending:
+            logger.warning(f"{len(pending)} diagram monitors didn't stop within {timeout}s")
+        DIAGRAM_CLEANUP_SECONDS.observe(time.perf_counter() - start)
+        logger.info(f"Cancelled {len(jobs)} outstanding diagram jobs, revoked {len(task_ids)} tasks")
@@ -0,0 +1,25 @@
+import asyncio
+
+from utils import logger
+from metrics import REALTIME_UPSTREAM_RTT_SECONDS
+
+
+async def sample_upstream_rtt(agent_ws, provider: str, interval: float = 5.0) -> None:
+    """Pings the realtime upstream every `interval` seconds and records the round trip.
+
+    Args:
+        agent_ws: The websocket instance for the Agent (websockets library).
+        provider (str): "openai" or "gemini".
+        interval (float): Seconds between pings.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            pong_waiter = await agent_ws.ping()
+            latency = await asyncio.wait_for(pong_waiter, timeout=interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Couldn't ping {provider} upstream: {e}")
+            return
+        REALTIME_UPSTREAM_RTT_SECONDS.labels(provider).observe(latency)
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import uuid
+import random
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+
+from utils import logger
+
+SESSION_RECORD_DIR = os.environ.get("SESSION_RECORD_DIR")  # unset disables recording
+SESSION_RECORD_RATE = float(os.environ.get("SESSION_RECORD_RATE", 1.0))  # fraction of sessions
+SESSION_RECORD_AUDIO = os.environ.get("SESSION_RECORD_AUDIO", "anonymized")  # "anonymized" | "raw"
+
+RECORDING_FORMAT = 1
+FLUSH_EVERY = 256
+
+# one writer thread for every recording, keeps file writes off the event loop and in order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-recorder")
+_current_tap = contextvars.ContextVar("session_tap", default=None)
+
+
+def _silence_hex(value: str) -> str:
+    return "0" * len(value)
+
+
+def _silence_b64(value: str) -> str:
+    # same length, same padding, decodes to zero bytes
+    return "".join("=" if c == "=" else "A" for c in value)
+
+
+def anonymize(text: str) -> str:
+    """Replaces the audio in a client or upstream message with silence of the same size."""
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return text
+    if not isinstance(data, dict):
+        return text
+
+    kind = data.get("type")
+    if kind == "audio_chunk" and "chunk" in data:
+        data["chunk"] = _silence_hex(data["chunk"])
+    elif kind == "AUDIO_CHUNK" and "data" in data:
+        data["data"] = _silence_hex(data["data"])
+    elif kind == "input_audio_buffer.append" and "audio" in data:
+        data["audio"] = _silence_b64(data["audio"])
+    elif kind in ("response.audio.delta", "AUDIO_DELTA") and "delta" in data:
+        data["delta"] = _silence_b64(data["delta"])
+    elif "realtime_input" in data:
+        for chunk in data["realtime_input"].get("media_chunks", []):
+            chunk["data"] = _silence_b64(chunk["data"])
+    elif "serverContent" in data:
+        for part in (data["serverContent"].get("modelTurn") or {}).get("parts", []):
+            if "inlineData" in part:
+                part["inlineData"]["data"] = _silence_b64(part["inlineData"]["data"])
+    else:
+        return text
+    return json.dumps(data)
+
+
+def _append_lines(path: str, lines: list):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+class SessionRecording:
+    """Writes both sides of one voicebot session to a JSON lines file.
+
+    The first line is a header, every other line is an event:
+    {"t": seconds since start, "side": "client" | "upstream", "dir": "in" | "out", "data": text}
+    where "in" means towards the server. "open"/"close" events mark the upstream connection.
+
+    Args:
+        path(str): File to write.
+        provider(str): "openai" or "gemini".
+        anonymize_audio(bool): Replace audio payloads with silence of the same size.
+    """
+
+    def __init__(self, path: str, provider: str, anonymize_audio: bool = True):
+        self.path = path
+        self.anonymize_audio = anonymize_audio
+        self.start = time.perf_counter()
+        self._buffer = [
+            json.dumps(
+                {
+                    "format": RECORDING_FORMAT,
+                    "provider": provider,
+                    "started": time.time(),
+                    "audio": "anonymized" if anonymize_audio else "raw",
+                }
+            )
+        ]
+
+    def record(self, side: str, direction: str, data: str):
+        if self.anonymize_audio:
+            data = anonymize(data)
+        event = {"t": round(time.perf_counter() - self.start, 6), "side": side, "dir": direction, "data": data}
+        self._buffer.append(json.dumps(event))
+        if len(self._buffer) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        lines, self._buffer = self._buffer, []
+        if lines:
+            _writer.submit(_append_lines, self.path, lines)
+
+
+class SessionTap:
+    """Per client websocket hook the recording middleware feeds; records while a bridge runs."""
+
+    def __init__(self):
+        self.recording: SessionRecording = None
+
+
+class SessionRecordingMiddleware:
+    """ASGI middleware exposing client websocket traffic to session recordings.
+
+    Only active when SESSION_RECORD_DIR is set. Messages are recorded only while
+    a voicebot bridge has a recording open (see `connect_upstream`).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket" or not SESSION_RECORD_DIR:
+            return await self.app(scope, receive, send)
+
+        tap = SessionTap()
+        token = _current_tap.set(tap)
+
+        async def tapped_receive():
+            message = await receive()
+            if tap.recording and message["type"] == "websocket.receive" and message.get("text"):
+                tap.recording.record("client", "in", message["text"])
+            return message
+
+        async def tapped_send(message):
+            if tap.recording and message["type"] == "websocket.send" and message.get("text"):
+                tap.recording.record("client", "out", message["text"])
+            await send(message)
+
+        try:
+            await self.app(scope, tapped_receive, tapped_send)
+        finally:
+            _current_tap.reset(token)
+
+
+class RecordingConnection:
+    """Wraps an upstream websocket connection and records what goes through it."""
+
+    def __init__(self, ws, recording: SessionRecording):
+        self._ws = ws
+        self._recording = recording
+
+    async def send(self, message):
+        self._recording.record("upstream", "out", message)
+        await self._ws.send(message)
+
+    async def recv(self, *args, **kwargs):
+        message = await self._ws.recv(*args, **kwargs)
+        self._recording.record("upstream", "in", message)
+        return message
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+
+@asynccontextmanager
+async def connect_upstream(provider: str, url: str, **kwargs):
+    """`websockets.connect` for the realtime upstreams, recorded when recording is on.
+
+    Args:
+        provider(str): "openai" or "gemini".
+        url(str): Upstream websocket url.
+        **kwargs: Passed on to `websockets.connect`.
+    """
+    tap = _current_tap.get()
+    recording = None
+    if tap is not None and random.random() < SESSION_RECORD_RATE:
+        path = os.path.join(
+            SESSION_RECORD_DIR, f"{provider}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"
+        )
+        recording = SessionRecording(path, provider, anonymize_audio=SESSION_RECORD_AUDIO != "raw")
+        recording.record("upstream", "open", url.split("?", 1)[0])  # drop api keys in the query
+        tap.recording = recording
+
+    try:
+        async with websockets.connect(url, **kwargs) as ws:
+            yield RecordingConnection(ws, recording) if recording else ws
+    finally:
+        if recording:
+            recording.record("upstream", "close", "")
+            recording.flush()
+            tap.recording = None
+            logger.info(f"Recorded voicebot session to {recording.path}")
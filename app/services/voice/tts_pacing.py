@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+from utils import logger
+from metrics import TTS_CLIENT_LEAD_SECONDS, TTS_AUDIO_DISCARDED_BYTES
+
+TTS_PACING = os.environ.get("TTS_PACING", "0") == "1"
+TTS_PACING_LEAD = float(os.environ.get("TTS_PACING_LEAD", 1.5))  # seconds of audio ahead of playback
+PCM_BYTE_RATE = 24000 * 2  # OpenAI "pcm": 24 kHz, 16-bit mono
+
+
+class AudioPacer:
+    """Sends a TTS stream to the client no further ahead of its playback than `lead` seconds.
+
+    The upstream is read as fast as it produces (so the provider slot is released as
+    early as before) into a server-side buffer. AUDIO_CHUNK messages leave the buffer
+    once the client has less than `lead` seconds left to play; other messages keep
+    their place in the stream. Cancelling `run` drops what's still held server-side.
+
+    Args:
+        send: async callable sending one message, returning False once the socket is closed.
+        lead(float): Seconds of audio the client may have buffered.
+        byte_rate(int): Bytes of PCM per second of audio.
+    """
+
+    def __init__(self, send, lead: float = TTS_PACING_LEAD, byte_rate: int = PCM_BYTE_RATE):
+        self.send = send
+        self.lead = lead
+        self.byte_rate = byte_rate
+        self.held_bytes = 0
+        self._buffer = deque()
+        self._ready = asyncio.Event()
+        self._playback_end = 0.0  # monotonic time the client runs out of audio
+
+    @staticmethod
+    def _audio_bytes(message: dict) -> int:
+        return len(message["data"]) // 2 if message.get("type") == "AUDIO_CHUNK" else 0  # hex encoded
+
+    def client_lead(self) -> float:
+        """Seconds of audio sent but not played yet, assuming playback started on arrival."""
+        return max(0.0, self._playback_end - time.monotonic())
+
+    async def _read(self, messages):
+        try:
+            async for message in messages:
+                self._buffer.append(message)
+                self.held_bytes += self._audio_bytes(message)
+                self._ready.set()
+        finally:
+            await messages.aclose()  # ends the upstream request and frees the provider slot
+
+    async def run(self, messages) -> None:
+        """Streams `messages` (tts_openai's output) to the client, paced.
+
+        Raises:
+            Whatever reading `messages` raises, e.g. ServerBusy before anything was sent.
+        """
+        reader = asyncio.create_task(self._read(messages), name="tts-reader")
+        reader.add_done_callback(lambda _: self._ready.set())
+        reason = "stopped"
+        try:
+            while True:
+                if not self._buffer:
+                    if reader.done():
+                        reader.result()  # re-raises the upstream's error
+                        return
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                message = self._buffer[0]
+                size = self._audio_bytes(message)
+                if size:
+                    wait = self._playback_end - time.monotonic() - self.lead
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                self._buffer.popleft()
+                self.held_bytes -= size
+                if not await self.send(message):
+                    reason = "disconnect"
+                    return
+                if size:
+                    now = time.monotonic()
+                    self._playback_end = max(self._playback_end, now) + size / self.byte_rate
+                    TTS_CLIENT_LEAD_SECONDS.observe(self._playback_end - now)
+        finally:
+            complete = reader.done() and not self._buffer
+            if not reader.done():
+                reader.cancel()
+            elif not reader.cancelled():
+                reader.exception()  # retrieved, run() re-raised it or was stopped first
+            if not complete:
+                self._discard(reason)
+
+    def _discard(self, reason: str):
+        """Counts what a stopped stream wasted: audio held here, and audio the client
+        was sent but drops when it moves on (estimated from the playback clock)."""
+        if self.held_bytes:
+            TTS_AUDIO_DISCARDED_BYTES.labels("server", reason).inc(self.held_bytes)
+        unplayed = int(self.client_lead() * self.byte_rate)
+        if unplayed and reason != "disconnect":
+            TTS_AUDIO_DISCARDED_BYTES.labels("client", reason).inc(unplayed)
+        if self.held_bytes:
+            logger.info(f"Narration stopped ({reason}), dropped {self.held_bytes} bytes held server-side")
+        self._buffer.clear()
+        self.held_bytes = 0
@@ -1,8 +1,21 @@
+import time
+
 from utils import logger
-from llm.clients import async_openai_client
+from llm.clients import get_openai_client
+from metrics import TTS_FIRST_CHUNK_SECONDS, TTS_TOTAL_SECONDS
+from admission import admission, TTS_RESOURCES, NORMAL
 
 
-async def tts_openai(tts_text: str, sub_text: str = None, snippets: list = None, image_url: str = None):
+async def tts_openai(
+    tts_text: str,
+    sub_text: str = None,
+    snippets: list = None,
+    image_url: str = None,
+    image_preview_url: str = None,
+    image_formats: dict = None,
+    priority: int = NORMAL,
+    ref: dict = None,
+):
     """stream tts data from OpenAI
 
     Args:
@@ -10,43 +23,63 @@ async def tts_openai(tts_text: str, sub_text: str = None, snippets: list = None,
         sub_text(str): data to be sent to the client for subtitles.
         snippets(list): snippets to be shown on the board.
         image_url(str): image to be displayed.
+        image_preview_url(str): low-dpi version of the image, shown while the full one loads.
+        image_formats(dict): other formats of the image, e.g. {"webp": url}.
+        priority(int): admission priority, HIGH for narration of a lesson already under way.
+        ref(dict): for clients that have the lesson bundle, TEXT_FULL only carries this
+            reference to the part (e.g. {"part": "EXPLANATION_STEP", "index": 2}).
 
+    Raises:
+        ServerBusy: no TTS slot freed up in time, nothing was yielded.
     """
-    initial_data = {
-        "status": "connected",
-        "type": "TEXT_FULL",
-        "img_url": image_url,
-        "text": tts_text if not sub_text else sub_text,
-    }
-
-    if snippets:
-        initial_data["snippet"] = [s[1] for s in sorted(snippets)]
-
-    yield initial_data  # send step information in the beginning
-
-    async with async_openai_client.audio.speech.with_streaming_response.create(
-        model="gpt-4o-mini-tts",
-        voice="shimmer",
-        input=tts_text,
-        instructions="Speak like you are an O-level Maths instructor. You should try to induce curiosity within the student.",
-        response_format="pcm",
-    ) as response_stream:
-        chunk_count = 0
-        async for chunk in response_stream.iter_bytes(chunk_size=4096):
-            if chunk:
-                chunk_count += 1
-                try:
-                    yield {
-                        "status": "connected",
-                        "type": "AUDIO_CHUNK",
-                        "data": chunk.hex(),
-                    }
-                except Exception as e:
-                    logger.error(f"Error sending chunk: {e}")
-                    continue
-
-        # Once streaming has ended
-        yield {
+    if ref is not None:
+        initial_data = {"status": "connected", "type": "TEXT_FULL", **ref}
+    else:
+        initial_data = {
             "status": "connected",
-            "type": "STREAM_EXIT",
+            "type": "TEXT_FULL",
+            "img_url": image_url,
+            "img_preview_url": image_preview_url,
+            "text": tts_text if not sub_text else sub_text,
         }
+
+        if image_formats:
+            initial_data["img_formats"] = image_formats
+
+        if snippets:
+            initial_data["snippet"] = [s[1] for s in sorted(snippets)]
+
+    # hold the slot for the whole stream, it's what the provider counts
+    async with admission.acquire(TTS_RESOURCES, priority=priority):
+        yield initial_data  # send step information in the beginning
+
+        start = time.perf_counter()
+        async with get_openai_client().audio.speech.with_streaming_response.create(
+            model="gpt-4o-mini-tts",
+            voice="shimmer",
+            input=tts_text,
+            instructions="Speak like you are an O-level Maths instructor. You should try to induce curiosity within the student.",
+            response_format="pcm",
+        ) as response_stream:
+            chunk_count = 0
+            async for chunk in response_stream.iter_bytes(chunk_size=4096):
+                if chunk:
+                    chunk_count += 1
+                    if chunk_count == 1:
+                        TTS_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start)
+                    try:
+                        yield {
+                            "status": "connected",
+                            "type": "AUDIO_CHUNK",
+                            "data": chunk.hex(),
+                        }
+                    except Exception as e:
+                        logger.error(f"Error sending chunk: {e}")
+                        continue
+
+            # Once streaming has ended
+            TTS_TOTAL_SECONDS.observe(time.perf_counter() - start)
+            yield {
+                "status": "connected",
+                "type": "STREAM_EXIT",
+            }
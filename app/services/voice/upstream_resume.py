@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from contextlib import AsyncExitStack
+
+from websockets.exceptions import ConnectionClosed
+
+from utils import logger
+from metrics import REALTIME_RECONNECTS, REALTIME_RECONNECT_SECONDS, REALTIME_HELD_AUDIO_DROPPED
+from services.analytics import session_events
+
+REALTIME_RESUME = os.environ.get("REALTIME_RESUME", "1") == "1"
+REALTIME_RECONNECT_ATTEMPTS = int(os.environ.get("REALTIME_RECONNECT_ATTEMPTS", 5))
+REALTIME_RECONNECT_BUDGET = float(os.environ.get("REALTIME_RECONNECT_BUDGET", 15))  # seconds before giving up
+REALTIME_RESUME_ITEMS = int(os.environ.get("REALTIME_RESUME_ITEMS", 20))  # transcript turns restored
+# student audio held while reconnecting, ~15 s of 24 kHz pcm16 as base64 json; older audio goes first
+REALTIME_RESUME_BUFFER_BYTES = int(os.environ.get("REALTIME_RESUME_BUFFER_BYTES", 1_000_000))
+RECONNECT_BASE_DELAY = 0.25
+RECONNECT_MAX_DELAY = 4.0
+SETUP_TIMEOUT = 10.0
+POLICY_VIOLATION = 1008  # bad key or config, a new connection would be refused the same way
+
+
+class OpenAIResume:
+    """What an OpenAI Realtime session needs on a new connection: the session config and
+    the last transcript turns, re-created as conversation items.
+
+    Args:
+        setup(str): The session.update message.
+        max_items(int): Transcript turns kept.
+    """
+
+    provider = "openai"
+
+    def __init__(self, setup: str, max_items: int = REALTIME_RESUME_ITEMS):
+        self.setup = setup
+        self.items = deque(maxlen=max_items)  # (role, text)
+
+    @staticmethod
+    def is_audio(message: str) -> bool:
+        return message.startswith('{"type": "input_audio_buffer.append"')
+
+    def observe(self, message: str) -> None:
+        """Keeps the transcripts out of an upstream message (cheap for everything else)."""
+        if "transcription.completed" not in message and "audio_transcript.done" not in message:
+            return
+        event = json.loads(message)
+        kind, text = event.get("type"), (event.get("transcript") or "").strip()
+        if not text:
+            return
+        if kind == "conversation.item.input_audio_transcription.completed":
+            self.items.append(("user", text))
+        elif kind == "response.audio_transcript.done":
+            self.items.append(("assistant", text))
+
+    async def start(self, ws) -> None:
+        """Configures a new connection, and gives it the conversation so far."""
+        await ws.send(self.setup)
+        for role, text in self.items:
+            content_type = "input_text" if role == "user" else "text"
+            item = {"type": "message", "role": role, "content": [{"type": content_type, "text": text}]}
+            await ws.send(json.dumps({"type": "conversation.item.create", "item": item}))
+
+    def restored(self) -> int:
+        return len(self.items)
+
+
+class GeminiResume:
+    """What a Gemini Live session needs on a new connection: the setup with the latest
+    session resumption handle, so the server restores the conversation itself. Without a
+    handle (none received yet, or not resumable) the transcript turns, when the setup
+    asks for transcriptions, are sent as context instead.
+
+    Args:
+        setup(str): The setup message.
+        max_items(int): Transcript turns kept.
+    """
+
+    provider = "gemini"
+
+    def __init__(self, setup: str, max_items: int = REALTIME_RESUME_ITEMS):
+        self.config = json.loads(setup)
+        self.config["setup"].setdefault("sessionResumption", {})  # ask for resumption handles
+        self.handle = None
+        self.items = deque(maxlen=max_items)  # (role, text)
+        self._turn = {"user": [], "model": []}
+
+    @staticmethod
+    def is_audio(message: str) -> bool:
+        return message.startswith('{"realtime_input"')
+
+    def observe(self, message: str) -> None:
+        """Keeps the resumption handle and transcripts out of an upstream message."""
+        if "sessionResumptionUpdate" in message:
+            update = json.loads(message)["sessionResumptionUpdate"]
+            if update.get("resumable") and update.get("newHandle"):
+                self.handle = update["newHandle"]
+            return
+        if "Transcription" in message:
+            content = json.loads(message).get("serverContent", {})
+            for key, role in (("inputTranscription", "user"), ("outputTranscription", "model")):
+                if content.get(key, {}).get("text"):
+                    self._turn[role].append(content[key]["text"])
+        if "turnComplete" in message:
+            for role, parts in self._turn.items():
+                text = "".join(parts).strip()
+                if text:
+                    self.items.append((role, text))
+                parts.clear()
+
+    async def start(self, ws) -> None:
+        """Sets up a new connection (resuming the session when there's a handle) and waits
+        for setupComplete, which isn't passed on to the bridge."""
+        config = json.loads(json.dumps(self.config))
+        if self.handle:
+            config["setup"]["sessionResumption"]["handle"] = self.handle
+        await ws.send(json.dumps(config))
+        await asyncio.wait_for(ws.recv(), SETUP_TIMEOUT)
+
+        if not self.handle and self.items:
+            turns = [{"role": role, "parts": [{"text": text}]} for role, text in self.items]
+            await ws.send(json.dumps({"clientContent": {"turns": turns, "turnComplete": False}}))
+
+    def restored(self) -> int:
+        return 1 if self.handle else len(self.items)
+
+
+class ResumableUpstream:
+    """Realtime upstream connection that reconnects when it drops mid-session.
+
+    Stands in for the `websockets` connection in the bridges (`send`, `recv`, `close`,
+    `ping`). When the connection drops, and the bridge didn't close it, `recv` and `send`
+    don't fail: a new connection is made with backoff (the first attempt right away),
+    `state.start` restores the session on it, and the student audio and other messages
+    sent in the meantime follow in order. Audio held beyond REALTIME_RESUME_BUFFER_BYTES
+    is dropped, oldest first. The client is told with VOICEBOT_RECONNECTING and
+    VOICEBOT_RESUMED. Once the attempts or the time budget run out, the original
+    ConnectionClosed is raised, as without resumption.
+
+    Args:
+        connect: Callable returning an async context manager that yields a connected
+            websocket (`connect_upstream`).
+        state(OpenAIResume | GeminiResume): The provider's session state.
+        notify: Async callable sending a message to the client, or None.
+        enabled(bool): Reconnect at all.
+        attempts(int): Connection attempts per drop.
+        budget(float): Seconds per drop before giving up.
+    """
+
+    def __init__(
+        self,
+        connect,
+        state,
+        notify=None,
+        enabled: bool = REALTIME_RESUME,
+        attempts: int = REALTIME_RECONNECT_ATTEMPTS,
+        budget: float = REALTIME_RECONNECT_BUDGET,
+    ):
+        self._connect = connect
+        self.state = state
+        self.provider = state.provider
+        self.notify = notify
+        self.enabled = enabled
+        self.attempts = attempts
+        self.budget = budget
+        self.ws = None
+        self.reconnects = 0
+        self._stack: AsyncExitStack = None
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._reconnect_task: asyncio.Task = None
+        self._failure: ConnectionClosed = None
+        self._held = deque()
+        self._held_audio_bytes = 0
+
+    async def __aenter__(self):
+        await self._open()
+        self._connected.set()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._closing = True
+        if self._reconnect_task is not None and not self._reconnect_task.done():
+            self._reconnect_task.cancel()
+            await asyncio.wait([self._reconnect_task])
+        await self._close_connection()
+
+    # --- the bridge's side ---
+    async def send(self, message: str) -> None:
+        while self._connected.is_set():
+            ws = self.ws
+            try:
+                await ws.send(message)
+                return
+            except ConnectionClosed as e:
+                # clears `_connected` unless `ws` was replaced already, then it's sent again
+                self._dropped(ws, e)
+        if self._failure is not None:
+            raise self._failure
+        self._hold(message)  # sent once the reconnect is through
+
+    async def recv(self) -> str:
+        while True:
+            if not self._connected.is_set():
+                await self._wait_reconnected()
+            ws = self.ws
+            try:
+                message = await ws.recv()
+            except ConnectionClosed as e:
+                self._dropped(ws, e)
+                continue
+            self.state.observe(message)
+            return message
+
+    async def close(self) -> None:
+        """Closes for good: the bridge is done, nothing is resumed."""
+        self._closing = True
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def ping(self):
+        if not self._connected.is_set():
+            await self._wait_reconnected()
+        return await self.ws.ping()
+
+    # --- reconnecting ---
+    def _dropped(self, ws, error: ConnectionClosed) -> None:
+        """Starts a reconnect for a drop of `ws`, or raises if the session is over."""
+        if self._closing or not self.enabled or getattr(error.rcvd, "code", None) == POLICY_VIOLATION:
+            raise error
+        if ws is not self.ws or (self._reconnect_task is not None and not self._reconnect_task.done()):
+            return  # that connection was replaced already, or is being replaced
+        self._connected.clear()
+        self._reconnect_task = asyncio.create_task(self._reconnect(error), name=f"{self.provider}-reconnect")
+
+    async def _wait_reconnected(self) -> None:
+        if self._reconnect_task is not None:
+            await asyncio.wait([self._reconnect_task])
+        if self._failure is not None:
+            raise self._failure
+        if not self._connected.is_set():
+            raise ConnectionClosed(None, None)
+
+    async def _reconnect(self, error: ConnectionClosed) -> None:
+        start = time.perf_counter()
+        logger.warning(f"{self.provider} upstream dropped ({error}), reconnecting")
+        await self._notify({"type": "VOICEBOT_RECONNECTING"})
+        await self._close_connection()
+
+        for attempt in range(self.attempts):
+            remaining = start + self.budget - time.perf_counter()
+            delay = 0 if attempt == 0 else min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+            delay *= random.uniform(0.5, 1.0)
+            if delay >= remaining:
+                break
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.wait_for(self._open(), remaining - delay)
+                await self._send_held()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"{self.provider} reconnect attempt {attempt + 1} failed: {e!r}")
+                await self._close_connection()
+                continue
+
+            seconds = time.perf_counter() - start
+            self.reconnects += 1
+            self._connected.set()
+            REALTIME_RECONNECTS.labels(self.provider, "resumed").inc()
+            REALTIME_RECONNECT_SECONDS.labels(self.provider).observe(seconds)
+            session_events.record("voicebot_reconnected", provider=self.provider, seconds=round(seconds, 2))
+            logger.info(f"{self.provider} session resumed after {seconds:.2f}s ({self.state.restored()} restored)")
+            await self._notify({"type": "VOICEBOT_RESUMED", "gap_ms": round(seconds * 1000)})
+            return
+
+        REALTIME_RECONNECTS.labels(self.provider, "failed").inc()
+        session_events.record("voicebot_reconnect_failed", provider=self.provider)
+        logger.error(f"Couldn't reconnect to {self.provider}, ending the voicebot session")
+        self._failure = error
+        self._held.clear()
+
+    async def _open(self) -> None:
+        stack = AsyncExitStack()
+        try:
+            ws = await stack.enter_async_context(self._connect())
+            await self.state.start(ws)
+        except BaseException:
+            await stack.aclose()
+            raise
+        self._stack, self.ws = stack, ws
+
+    async def _close_connection(self) -> None:
+        stack, self._stack, self.ws = self._stack, None, None
+        if stack is not None:
+            try:
+                await stack.aclose()
+            except Exception as e:
+                logger.debug(f"Closing the dropped {self.provider} connection: {e!r}")
+
+    def _hold(self, message: str) -> None:
+        self._held.append(message)
+        if not self.state.is_audio(message):
+            return
+        self._held_audio_bytes += len(message)
+        while self._held_audio_bytes > REALTIME_RESUME_BUFFER_BYTES:
+            oldest = next(m for m in self._held if self.state.is_audio(m))
+            self._held.remove(oldest)
+            self._held_audio_bytes -= len(oldest)
+            REALTIME_HELD_AUDIO_DROPPED.labels(self.provider).inc(len(oldest))
+
+    async def _send_held(self) -> None:
+        # messages the bridge sends meanwhile are held too, so this drains them in order
+        while self._held:
+            message = self._held[0]
+            await self.ws.send(message)
+            self._held.popleft()
+            if self.state.is_audio(message):
+                self._held_audio_bytes -= len(message)
+
+    async def _notify(self, message: dict) -> None:
+        if self.notify is None:
+            return
+        try:
+            await self.notify(message)
+        except Exception as e:
+            logger.warning(f"Couldn't tell the client about the {self.provider} reconnect: {e!r}")
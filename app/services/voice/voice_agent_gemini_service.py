@@ -1,38 +1,53 @@
 import os
 import json
-import copy
+import time
 import base64
 import asyncio
-import websockets
 from fastapi import WebSocket, WebSocketDisconnect
 
-from llm.config import ConfigManager
-from utils import logger, safe_send_ws
-from celery_tasks import generate_diagram
-from services.voice.diagram_monitoring import handle_diagram_result
+from llm.registry import registry
+from utils import logger, SocketWriter, WS_COALESCE
+from metrics import VOICEBOT_SETUP_SECONDS
+from services.voice.session_metrics import sample_upstream_rtt
+from services.voice.session_recording import connect_upstream
+from services.voice.upstream_resume import ResumableUpstream, GeminiResume
+from admission import admission, REALTIME_RESOURCES, LOW
+from services.voice.diagram_jobs import DiagramJobManager
 
 GEMINI_WS_URL = os.environ.get("GEMINI_WS_URL")
 
 
 async def handle_voicebot_session_gemini(
-    client_ws: WebSocket, voice_prompt: str
+    client_ws: WebSocket, voice_prompt: str, client: SocketWriter = None
 ) -> None:
     """Bridges the client and gemini Realtime websocket session.
 
     Args:
         client_ws(fastapi.Websocket): Websocket for the frontend/client
         voice_prompt(str): System prompt for the voice agent.
+        client(SocketWriter): Writer of client_ws, one is created for the session if missing.
+
+    Raises:
+        ServerBusy: no realtime slot freed up in time, the upstream wasn't contacted.
     """
-    diagram_state = {"in_progress": False, "task_id": None}
-    cm = ConfigManager(provider="gemini")
-    session_cfg = copy.deepcopy(cm.get_config())
-    session_cfg["setup"]["systemInstruction"]["parts"][0]["text"] = voice_prompt
-    
-    async with websockets.connect(
-        GEMINI_WS_URL, additional_headers={"Content-Type": "application/json"}
+    setup_start = time.perf_counter()
+    session_setup = registry.session_config("gemini").render(voice_prompt)
+    own_client = client is None
+    if own_client:
+        client = SocketWriter(client_ws, name="client", coalesce=WS_COALESCE)
+
+    def connect():
+        return connect_upstream("gemini", GEMINI_WS_URL, additional_headers={"Content-Type": "application/json"})
+
+    # new sessions yield to the narration of lessons already running.
+    # Connecting sends the setup and waits for setupComplete; a dropped connection is
+    # made again with the session resumption handle.
+    async with admission.acquire(REALTIME_RESOURCES["gemini"], priority=LOW), ResumableUpstream(
+        connect, GeminiResume(session_setup), notify=client.send
     ) as gemini_ws:
-        await gemini_ws.send(json.dumps(session_cfg))
-        await gemini_ws.recv()
+        VOICEBOT_SETUP_SECONDS.labels("gemini").observe(time.perf_counter() - setup_start)
+        upstream = SocketWriter(gemini_ws, name="gemini")
+        diagram_jobs = DiagramJobManager(client, upstream, provider="gemini")
 
         # send data from client/frontent to gemini
         async def client_to_ai():
@@ -59,7 +74,7 @@ async def handle_voicebot_session_gemini(
                                     ]
                                 }
                             }
-                            await gemini_ws.send(json.dumps(message))
+                            await upstream.send(message, bulk=True)
 
                         else:
                             logger.warning(
@@ -102,18 +117,18 @@ async def handle_voicebot_session_gemini(
                                 for part in model_turn.get("parts", []):
                                     if "inlineData" in part:  # Handle Audio
                                         audio_b64 = part["inlineData"]["data"]
-                                        await client_ws.send_text(
-                                            json.dumps(
-                                                {  # Send to frontend
-                                                    "type": "AUDIO_DELTA",
-                                                    "delta": audio_b64,
-                                                }
-                                            )
+                                        await client.send(
+                                            {"type": "AUDIO_DELTA", "delta": audio_b64},
+                                            bulk=True,
                                         )
                                     # Handle Text
                                     # if "text" in part:
                                     #     logger.info(f"Gemini Text: {part['text']}")
 
+                            # gemini reports the end of a turn inside serverContent
+                            if gemini_response["serverContent"].get("turnComplete"):
+                                await client.send({"type": "TURN_COMPLETE"}, bulk=True)
+
                         # for function call from gemini
                         elif "toolCall" in gemini_response:
                             function_calls = gemini_response["toolCall"][
@@ -132,9 +147,7 @@ async def handle_voicebot_session_gemini(
                                             "function": fn_name,
                                             "args": json.dumps(args),
                                         }
-                                        await safe_send_ws(
-                                            client_ws, data=function_data
-                                        )
+                                        await client.send(function_data)
 
                                         # send acknowledgement to Gemini
                                         gemini_data = {
@@ -152,7 +165,7 @@ async def handle_voicebot_session_gemini(
                                                 ]
                                             }
                                         }
-                                        await safe_send_ws(gemini_ws, data=gemini_data)
+                                        await upstream.send(gemini_data)
 
                                     except Exception as e:
                                         logger.error(
@@ -176,95 +189,23 @@ async def handle_voicebot_session_gemini(
                                                 ]
                                             }
                                         }
-                                        await safe_send_ws(
-                                            gemini_ws, data=error_payload
-                                        )
+                                        await upstream.send(error_payload)
                                         continue  # Continue the loop, don't break
 
                                 elif fn_name == "generate_diagram":
                                     logger.info(f"DIAGRAM Args: {args}")
                                     prompt = args.get("prompt")
 
-                                    if diagram_state.get(
-                                        "in_progress"
-                                    ):  # check if a diagram is already being generated
-                                        logger.info(
-                                            "Already generating, rejecting new request"
-                                        )
-
-                                        # inform Gemini that a diagram is being generated already
-                                        error_payload = {
-                                            "tool_response": {
-                                                "function_responses": [
-                                                    {
-                                                        "id": call_id,
-                                                        "name": fn_name,
-                                                        "response": {
-                                                            "result": {
-                                                                "success": False,
-                                                                "error": f"A diagram is already being generated.",
-                                                            }
-                                                        },
-                                                    }
-                                                ]
-                                            }
-                                        }
-                                        await safe_send_ws(
-                                            gemini_ws, data=error_payload
-                                        )
-                                        continue  # Continue the loop, don't break
-
-                                    # Start diagram generation
+                                    # Queue diagram generation
                                     try:
-                                        task = generate_diagram.delay(prompt)
-
-                                        diagram_state["in_progress"] = True
-                                        diagram_state["task_id"] = task.id
-                                        logger.info(f"Started celery task {task.id}")
-
-                                        # Monitor celery task result
-                                        asyncio.create_task(
-                                            handle_diagram_result(
-                                                client_ws,
-                                                gemini_ws,
-                                                call_id,
-                                                diagram_state,
-                                                provider="gemini",
-                                            )
-                                        )
-
-                                        # Tell gemini diagram generaion has initiated
-                                        gemini_data = {
-                                            "tool_response": {
-                                                "function_responses": [
-                                                    {
-                                                        "id": call_id,
-                                                        "name": fn_name,
-                                                        "response": {
-                                                            "result": {
-                                                                "success": True,
-                                                                "message": "Diagram generation has started",
-                                                            }
-                                                        },
-                                                    }
-                                                ]
-                                            }
-                                        }
-                                        await safe_send_ws(gemini_ws, data=gemini_data)
-
-                                        # tell cient has diagram generation has started
-                                        await safe_send_ws(
-                                            client_ws,
-                                            data={"type": "DIAGRAM_INITIATED"},
+                                        await diagram_jobs.submit(
+                                            prompt, call_id, fn_name=fn_name
                                         )
                                         logger.info(
                                             "Continuing to listen for more events"
                                         )
 
                                     except Exception as e:
-                                        diagram_state["in_progress"] = False
-                                        diagram_state["task_id"] = None
-
                                         logger.error(f"Error Generating Diagram: {e}")
 
                                         # Send error back to Gemini and continue
@@ -284,52 +225,44 @@ async def handle_voicebot_session_gemini(
                                                 ]
                                             }
                                         }
-                                        await safe_send_ws(
-                                            gemini_ws, data=error_payload
-                                        )
+                                        await upstream.send(error_payload)
 
                                         # send error info to the client
                                         diagram_error = {
                                             "status": "error",
                                             "data": str(e),
                                         }
-                                        await safe_send_ws(
-                                            client_ws, data=diagram_error
-                                        )
+                                        await client.send(diagram_error)
 
                                         continue
 
-                                    else:  # unknown function
-                                        logger.error(
-                                            f"Function {fn_name} doesn't exist."
-                                        )
-
-                                        # tell Gemini that the function doesn't exist.
-                                        error_payload = {
-                                            "tool_response": {
-                                                "function_responses": [
-                                                    {
-                                                        "id": call_id,
-                                                        "name": fn_name,
-                                                        "response": {
-                                                            "result": {
-                                                                "success": False,
-                                                                "error": f"The function {fn_name} doesn't exist.",
-                                                            }
-                                                        },
-                                                    }
-                                                ]
-                                            }
+                                else:  # unknown function
+                                    logger.error(
+                                        f"Function {fn_name} doesn't exist."
+                                    )
+
+                                    # tell Gemini that the function doesn't exist.
+                                    error_payload = {
+                                        "tool_response": {
+                                            "function_responses": [
+                                                {
+                                                    "id": call_id,
+                                                    "name": fn_name,
+                                                    "response": {
+                                                        "result": {
+                                                            "success": False,
+                                                            "error": f"The function {fn_name} doesn't exist.",
+                                                        }
+                                                    },
+                                                }
+                                            ]
                                         }
-                                        await safe_send_ws(
-                                            gemini_ws, data=error_payload
-                                        )
-                                        continue  # Continue the loop, don't break
+                                    }
+                                    await upstream.send(error_payload)
+                                    continue  # Continue the loop, don't break
 
                         elif "turnComplete" in gemini_response:
-                            await safe_send_ws(
-                                client_ws, data={"type": "TURN_COMPLETE"}
-                            )
+                            await client.send({"type": "TURN_COMPLETE"}, bulk=True)
 
                     except WebSocketDisconnect:
                         break
@@ -353,13 +286,22 @@ async def handle_voicebot_session_gemini(
         # function breaks) both functions are stopped.
         recv_task = asyncio.create_task(ai_to_client(), name="recv_task")
         send_task = asyncio.create_task(client_to_ai(), name="send_task")
+        rtt_task = asyncio.create_task(sample_upstream_rtt(gemini_ws, "gemini"))
 
-        done, pending = await asyncio.wait(
-            [recv_task, send_task], return_when=asyncio.FIRST_COMPLETED
-        )
-
-        for task in pending:
-            logger.info(
-                f"Task: {task.get_name()} was closed later after the other task completed."
+        try:
+            done, pending = await asyncio.wait(
+                [recv_task, send_task], return_when=asyncio.FIRST_COMPLETED
             )
-            task.cancel()
+
+            for task in pending:
+                logger.info(
+                    f"Task: {task.get_name()} was closed later after the other task completed."
+                )
+                task.cancel()
+        finally:
+            rtt_task.cancel()
+            # the session is over, don't keep generating diagrams nobody will see
+            await diagram_jobs.close()
+            await upstream.close()
+            if own_client:
+                await client.close()
@@ -1,45 +1,62 @@
 import os
 import json
-import copy
+import time
 import base64
 import asyncio
 import websockets
 from fastapi import WebSocket, WebSocketDisconnect
 
-from services.voice.diagram_monitoring import safe_send_ws
-from celery_tasks import generate_diagram
-from services.voice.diagram_monitoring import handle_diagram_result
-from llm.config import ConfigManager
-from utils import logger
+from services.voice.diagram_jobs import DiagramJobManager
+from llm.registry import registry
+from utils import logger, SocketWriter, WS_COALESCE
+from metrics import VOICEBOT_SETUP_SECONDS, REALTIME_RESPONSE_SECONDS
+from services.voice.session_metrics import sample_upstream_rtt
+from services.voice.session_recording import connect_upstream
+from services.voice.upstream_resume import ResumableUpstream, OpenAIResume
+from admission import admission, REALTIME_RESOURCES, LOW
 
 OPENAI_WS_URL = os.environ.get("OPENAI_WS_URL")
 OPENAI_KEY = os.environ.get("OPENAI_API_KEY")
 
 
 async def handle_voicebot_session_openai(
-    client_ws: WebSocket, voice_prompt: str
+    client_ws: WebSocket, voice_prompt: str, client: SocketWriter = None
 ) -> None:
     """Bridges the client and OpenAI Realtime websocket session.
 
     Args:
         client_ws(fastapi.Websocket): Websocket for the frontend/client
         voice_prompt(str): System prompt for the voice agent.
+        client(SocketWriter): Writer of client_ws, one is created for the session if missing.
+
+    Raises:
+        ServerBusy: no realtime slot freed up in time, the upstream wasn't contacted.
     """
-    diagram_state = {"in_progress": False, "task_id": None}
-    cm = ConfigManager(provider="openai")
-    session_cfg = copy.deepcopy(cm.get_config())
-    session_cfg["session"]["instructions"] = voice_prompt
-
-    async with websockets.connect(
-        OPENAI_WS_URL,
-        additional_headers={
-            "Authorization": f"Bearer {OPENAI_KEY}",
-            "Content-Type": "application/json",
-            "OpenAI-Beta": "realtime=v1",
-        },
+    timing = {"setup_start": time.perf_counter(), "speech_stopped": None}
+    session_setup = registry.session_config("openai").render(voice_prompt)
+    own_client = client is None
+    if own_client:
+        client = SocketWriter(client_ws, name="client", coalesce=WS_COALESCE)
+
+    def connect():
+        return connect_upstream(
+            "openai",
+            OPENAI_WS_URL,
+            additional_headers={
+                "Authorization": f"Bearer {OPENAI_KEY}",
+                "Content-Type": "application/json",
+                "OpenAI-Beta": "realtime=v1",
+            },
+        )
+
+    # new sessions yield to the narration of lessons already running.
+    # The session config is sent on connecting, and again with the recent transcript
+    # if the connection drops and is made again.
+    async with admission.acquire(REALTIME_RESOURCES["openai"], priority=LOW), ResumableUpstream(
+        connect, OpenAIResume(session_setup), notify=client.send
     ) as openai_ws:
-        # send session config to OpenAI
-        await openai_ws.send(json.dumps(session_cfg))
+        upstream = SocketWriter(openai_ws, name="openai")
+        diagram_jobs = DiagramJobManager(client, upstream, provider="openai")
 
         # Forward client audio to OpenAI
         async def client_to_ai():
@@ -61,20 +78,10 @@ async def handle_voicebot_session_openai(
                             b64 = base64.b64encode(bytes.fromhex(data["chunk"])).decode(
                                 "utf-8"
                             )
-                            try:
-                                await openai_ws.send(
-                                    json.dumps(
-                                        {
-                                            "type": "input_audio_buffer.append",
-                                            "audio": b64,
-                                        }
-                                    )
-                                )
-                            except Exception as e:
-                                logger.error(
-                                    f"Couldn't send audio chunks from the client to openai"
-                                )
-                                continue
+                            await upstream.send(
+                                {"type": "input_audio_buffer.append", "audio": b64},
+                                bulk=True,
+                            )
 
                         else:
                             logger.warning(
@@ -110,13 +117,27 @@ async def handle_voicebot_session_openai(
                         event = json.loads(msg)
                         event_type = event.get("type")
 
+                        # session setup & response latency metrics
+                        if event_type == "session.updated" and timing["setup_start"]:
+                            VOICEBOT_SETUP_SECONDS.labels("openai").observe(
+                                time.perf_counter() - timing["setup_start"]
+                            )
+                            timing["setup_start"] = None
+                        elif event_type == "input_audio_buffer.speech_stopped":
+                            timing["speech_stopped"] = time.perf_counter()
+                        elif event_type == "response.audio.delta" and timing["speech_stopped"]:
+                            REALTIME_RESPONSE_SECONDS.labels("openai").observe(
+                                time.perf_counter() - timing["speech_stopped"]
+                            )
+                            timing["speech_stopped"] = None
+
                         if (
                             event_type == "input_audio_buffer.speech_started"
                         ):  # user has started speaking
-                            await safe_send_ws(
-                                ws=client_ws,
-                                data={"type": "INTERRUPT_PLAYBACK"},
-                                initial_delay=0.2,
+                            # audio still queued for the client is stale now
+                            await client.interrupt(
+                                {"type": "INTERRUPT_PLAYBACK"},
+                                stale=lambda queued: '"response.audio.delta"' in queued,
                             )
 
                         elif (
@@ -135,7 +156,7 @@ async def handle_voicebot_session_openai(
                                         "args": args,  # is a json str
                                     }
                                     # send function data to client
-                                    await safe_send_ws(client_ws, data=function_data)
+                                    await client.send(function_data)
 
                                     # iform OpneAI that a successfull function call has been made.
                                     openai_data = {
@@ -146,10 +167,8 @@ async def handle_voicebot_session_openai(
                                             "output": json.dumps({"success": True}),
                                         },
                                     }
-                                    await safe_send_ws(openai_ws, data=openai_data)
-                                    await safe_send_ws(
-                                        openai_ws, data={"type": "response.create"}
-                                    )
+                                    await upstream.send(openai_data)
+                                    await upstream.send({"type": "response.create"})
 
                                 except Exception as e:
                                     logger.error(f"Failed to handle show_on_board: {e}")
@@ -168,10 +187,8 @@ async def handle_voicebot_session_openai(
                                             ),
                                         },
                                     }
-                                    await safe_send_ws(openai_ws, data=error_payload)
-                                    await safe_send_ws(
-                                        openai_ws, {"type": "response.create"}
-                                    )
+                                    await upstream.send(error_payload)
+                                    await upstream.send({"type": "response.create"})
                                     continue  # Continue the loop, don't break
 
                             elif fn_name == "generate_diagram":
@@ -197,77 +214,13 @@ async def handle_voicebot_session_openai(
                                             ),
                                         },
                                     }
-                                    await safe_send_ws(openai_ws, data=error_payload)
-                                    await safe_send_ws(
-                                        openai_ws, {"type": "response.create"}
-                                    )
+                                    await upstream.send(error_payload)
+                                    await upstream.send({"type": "response.create"})
                                     continue
 
-                                if diagram_state.get(
-                                    "in_progress"
-                                ):  # check if a diagram is already being generated
-                                    logger.info(
-                                        "Already generating, rejecting new request"
-                                    )
-
-                                    # inform OpenAI that a diagram is being generated
-                                    error_payload = {
-                                        "type": "conversation.item.create",
-                                        "item": {
-                                            "type": "function_call_output",
-                                            "call_id": call_id,
-                                            "output": json.dumps(
-                                                {
-                                                    "success": False,
-                                                    "message": "Already generating a diagram. Please wait.",
-                                                }
-                                            ),
-                                        },
-                                    }
-                                    await safe_send_ws(openai_ws, data=error_payload)
-                                    await safe_send_ws(
-                                        openai_ws, {"type": "response.create"}
-                                    )
-                                    continue  # Continue the loop, don't break
-
-                                # Start diagram generation
+                                # Queue diagram generation
                                 try:
-                                    task = generate_diagram.delay(prompt)
-
-                                    diagram_state["in_progress"] = True
-                                    diagram_state["task_id"] = task.id
-                                    logger.info(f"Started celery task {task.id}")
-
-                                    # Monitor celery task result
-                                    asyncio.create_task(
-                                        handle_diagram_result(
-                                            client_ws, openai_ws, call_id, diagram_state
-                                        )
-                                    )
-
-                                    # send acknowledgement to openai that diagram generation has started.
-                                    openai_data = {
-                                        "type": "conversation.item.create",
-                                        "item": {
-                                            "type": "function_call_output",
-                                            "call_id": call_id,
-                                            "output": json.dumps(
-                                                {
-                                                    "success": False,
-                                                    "message": "Diagram generation has started.",
-                                                }
-                                            ),
-                                        },
-                                    }
-                                    await safe_send_ws(openai_ws, data=openai_data)
-                                    await safe_send_ws(
-                                        openai_ws, {"type": "response.create"}
-                                    )
-
-                                    # tell cient has diagram generation has started
-                                    await safe_send_ws(
-                                        client_ws, data={"type": "DIAGRAM_INITIATED"}
-                                    )
+                                    await diagram_jobs.submit(prompt, call_id)
                                     logger.info("Continuing to listen for more events")
 
                                 except Exception as e:
@@ -287,14 +240,12 @@ async def handle_voicebot_session_openai(
                                             ),
                                         },
                                     }
-                                    await safe_send_ws(openai_ws, data=error_payload)
-                                    await safe_send_ws(
-                                        openai_ws, {"type": "response.create"}
-                                    )
+                                    await upstream.send(error_payload)
+                                    await upstream.send({"type": "response.create"})
 
                                     # send error info to the client
                                     diagram_error = {"status": "error", "data": str(e)}
-                                    await safe_send_ws(client_ws, data=diagram_error)
+                                    await client.send(diagram_error)
                                     continue
 
                             else:
@@ -313,20 +264,15 @@ async def handle_voicebot_session_openai(
                                         ),
                                     },
                                 }
-                                await safe_send_ws(openai_ws, data=openai_data)
-                                await safe_send_ws(
-                                    openai_ws, {"type": "response.create"}
-                                )
+                                await upstream.send(openai_data)
+                                await upstream.send({"type": "response.create"})
 
                         else:
                             # Forward all other messages(i.e audio chunks from OpenAI) to client
-                            try:
-                                await client_ws.send_text(msg)
-                            except Exception as e:
-                                print(f"Failed to forward message: {e}")
-                                continue
+                            await client.send(msg, bulk=True)
 
                     except websockets.exceptions.ConnectionClosed:
+                        # closed by exit_voicebot, or dropped and couldn't be resumed
                         logger.fatal("OpenAI WebSocket closed")
                         break
                     except json.JSONDecodeError as e:
@@ -352,13 +298,22 @@ async def handle_voicebot_session_openai(
         # function breaks) both functions are stopped.
         send_task = asyncio.create_task(client_to_ai(), name="client_to_ai")
         recv_task = asyncio.create_task(ai_to_client(), name="ai_to_client")
+        rtt_task = asyncio.create_task(sample_upstream_rtt(openai_ws, "openai"))
 
-        done, pending = await asyncio.wait(
-            [send_task, recv_task], return_when=asyncio.FIRST_COMPLETED
-        )
-
-        for task in pending:
-            logger.info(
-                f"Task: {task.get_name()} was closed later after the other task completed."
+        try:
+            done, pending = await asyncio.wait(
+                [send_task, recv_task], return_when=asyncio.FIRST_COMPLETED
             )
-            task.cancel()
+
+            for task in pending:
+                logger.info(
+                    f"Task: {task.get_name()} was closed later after the other task completed."
+                )
+                task.cancel()
+        finally:
+            rtt_task.cancel()
+            # the session is over, don't keep generating diagrams nobody will see
+            await diagram_jobs.close()
+            await upstream.close()
+            if own_client:
+                await client.close()
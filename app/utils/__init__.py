@@ -1,3 +1,7 @@
-from .utils import (build_voicebot_prompt, safe_send_ws,
-                    s3_client, parse_code, logger)
-
+from .utils import (build_voicebot_prompt, get_s3_client,
+                    parse_code, logger, lazy_singleton)
+from .ws_writer import SocketWriter, WS_COALESCE
+from .code_validation import (validate_code, CodeValidationError,
+                              validation_stats)
+from .diagram_variants import (diagram_variants, CONTENT_TYPES,
+                               DIAGRAM_DPI, DIAGRAM_PREVIEW_DPI)
@@ -0,0 +1,200 @@
+import ast
+import copy
+import threading
+
+# plotting libraries and side-effect free stdlib modules; no os/sys/subprocess
+ALLOWED_IMPORTS = {
+    "matplotlib",
+    "numpy",
+    "math",
+    "cmath",
+    "mpl_toolkits",
+    "fractions",
+    "decimal",
+    "itertools",
+    "functools",
+    "operator",
+    "collections",
+    "random",
+    "statistics",
+    "string",
+    "re",
+    "textwrap",
+    "colorsys",
+    "copy",
+    "enum",
+    "dataclasses",
+    "typing",
+    "warnings",
+}
+# calls after which the figure is gone, an injected savefig must come before them
+CLOSING_CALLS = {"close", "clf", "cla"}
+FORBIDDEN_CALLS = {"open", "exec", "eval", "compile", "__import__", "input", "breakpoint"}
+DEFAULT_DPI = 300
+
+
+class CodeValidationError(Exception):
+    """Raised when generated code can't be fixed up and should be re-prompted."""
+
+
+class _Normalizer(ast.NodeTransformer):
+    def __init__(self, save_path: str, dpi: int, extra_outputs: list):
+        self.save_path = save_path
+        self.dpi = dpi
+        self.extra_outputs = extra_outputs
+        self.savefig_count = 0
+        self.imports_matplotlib = False
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._check_module(alias.name)
+        return node
+
+    def visit_ImportFrom(self, node):
+        self._check_module(node.module or "")
+        return node
+
+    def visit_Expr(self, node):
+        # drop `plt.show()` and backend switches, the Agg backend is forced on top
+        if isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Attribute):
+            func = node.value.func
+            is_backend_switch = func.attr == "use" and getattr(func.value, "id", None) == "matplotlib"
+            if func.attr == "show" or is_backend_switch:
+                return ast.Pass()
+
+        node = self.generic_visit(node)
+        if isinstance(node.value, ast.Call) and _call_name(node.value) == "savefig":
+            # save the extra variants (previews, other formats) right after the main figure
+            return [node] + [
+                ast.Expr(_with_target(copy.deepcopy(node.value), path, dpi))
+                for path, dpi in self.extra_outputs
+            ]
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        name = _call_name(node)
+
+        if isinstance(node.func, ast.Name) and name in FORBIDDEN_CALLS:
+            raise CodeValidationError(f"Call to '{name}' is not allowed")
+
+        if name == "savefig":
+            self.savefig_count += 1
+            _with_target(node, self.save_path, self.dpi)
+        return node
+
+    def _check_module(self, module: str):
+        root = module.split(".")[0]
+        if root not in ALLOWED_IMPORTS:
+            raise CodeValidationError(f"Import of '{module}' is not allowed")
+        if root == "matplotlib":
+            self.imports_matplotlib = True
+
+
+def _with_target(node: ast.Call, path: str, dpi: int) -> ast.Call:
+    node.args = [ast.Constant(path)] + node.args[1:]
+    node.keywords = [
+        kw for kw in node.keywords if kw.arg not in {"fname", "dpi", "format"}
+    ] + [ast.keyword(arg="dpi", value=ast.Constant(dpi))]
+    return node
+
+
+def _call_name(node: ast.Call) -> str:
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    return ""
+
+
+def validate_code(
+    code: str, fig_name: str, dpi: int = DEFAULT_DPI, extra_outputs: list = None
+) -> str:
+    """Statically checks and normalizes generated matplotlib code before sandbox execution.
+
+    Forces the Agg backend, strips `show()`, points every `savefig` at
+    `./{fig_name}.png` with the given dpi (injecting one if missing, before the
+    first top-level `close()`) and rejects code that can never produce the figure.
+
+    Args:
+        code(str): Parsed python code from the LLM.
+        fig_name(str): Name the figure must be saved as (without extension).
+        dpi(int): Resolution the figure is saved at.
+        extra_outputs(list): (file name, dpi) pairs saved next to the main figure,
+            e.g. a low-dpi preview or a webp/svg copy. The format follows the extension.
+
+    Returns:
+        str: The normalized code, ready to run in the sandbox.
+
+    Raises:
+        CodeValidationError: If the code is invalid or uses disallowed imports/calls.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise CodeValidationError(f"Syntax error on line {e.lineno}: {e.msg}")
+
+    extra_outputs = [(f"./{name}", extra_dpi) for name, extra_dpi in extra_outputs or []]
+    normalizer = _Normalizer(save_path=f"./{fig_name}.png", dpi=dpi, extra_outputs=extra_outputs)
+    tree = normalizer.visit(tree)
+
+    if not normalizer.imports_matplotlib:
+        raise CodeValidationError("Code doesn't draw a matplotlib figure")
+
+    body = list(tree.body)
+    if normalizer.savefig_count == 0:
+        save = ast.parse("import matplotlib.pyplot as plt\n").body
+        for path, out_dpi in [(normalizer.save_path, dpi)] + extra_outputs:
+            save += ast.parse(f"plt.savefig({path!r}, bbox_inches='tight', dpi={out_dpi})\n").body
+        # saving after `plt.close(fig)` would write an empty figure
+        at = next(
+            (
+                i for i, stmt in enumerate(body)
+                if isinstance(stmt, ast.Expr)
+                and isinstance(stmt.value, ast.Call)
+                and _call_name(stmt.value) in CLOSING_CALLS
+            ),
+            len(body),
+        )
+        body[at:at] = save
+
+    tree.body = ast.parse("import matplotlib\nmatplotlib.use('Agg')\n").body + body
+    return ast.unparse(ast.fix_missing_locations(tree))
+
+
+class ValidationStats:
+    """Process-wide counters for the pre-validation stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.validated = 0
+        self.rejected = 0
+        self.sandbox_runs = 0
+        self.sandbox_seconds = 0.0
+
+    def record_validation(self, passed: bool):
+        with self._lock:
+            if passed:
+                self.validated += 1
+            else:
+                self.rejected += 1
+
+    def record_sandbox_run(self, seconds: float):
+        with self._lock:
+            self.sandbox_runs += 1
+            self.sandbox_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            avg_run = self.sandbox_seconds / self.sandbox_runs if self.sandbox_runs else 0.0
+            return {
+                "validated": self.validated,
+                "rejected": self.rejected,
+                "sandbox_runs": self.sandbox_runs,
+                "avg_sandbox_s": round(avg_run, 3),
+                # every rejection is a sandbox run we didn't pay for
+                "est_sandbox_s_saved": round(self.rejected * avg_run, 3),
+            }
+
+
+validation_stats = ValidationStats()
@@ -0,0 +1,29 @@
+import os
+
+DIAGRAM_DPI = 300
+DIAGRAM_PREVIEW_DPI = int(os.environ.get("DIAGRAM_PREVIEW_DPI", 72))
+# optional extra formats rendered next to the png, e.g. "webp,svg"
+DIAGRAM_EXTRA_FORMATS = [
+    f.strip() for f in os.environ.get("DIAGRAM_EXTRA_FORMATS", "").split(",") if f.strip()
+]
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "svg": "image/svg+xml",
+}
+
+
+def diagram_variants(fig_name: str) -> dict:
+    """Files rendered for a diagram besides the full-size png.
+
+    Args:
+        fig_name(str): Name of the figure (without extension).
+
+    Returns:
+        dict: label -> (file name, dpi), e.g. {"preview": ("fig_1_preview.png", 72)}.
+    """
+    variants = {"preview": (f"{fig_name}_preview.png", DIAGRAM_PREVIEW_DPI)}
+    for fmt in DIAGRAM_EXTRA_FORMATS:
+        variants[fmt] = (f"{fig_name}.{fmt}", DIAGRAM_DPI)
+    return variants
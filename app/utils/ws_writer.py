@@ -0,0 +1,201 @@
+import os
+import json
+import asyncio
+from collections import deque
+from fastapi import WebSocketDisconnect
+from starlette.websockets import WebSocketState
+from websockets.exceptions import ConnectionClosed
+
+from .utils import logger
+
+WS_WRITER_MAX_PENDING = int(os.environ.get("WS_WRITER_MAX_PENDING", 256))  # bulk messages before send() waits
+WS_COALESCE = os.environ.get("WS_COALESCE", "0") == "1"  # the client understands BATCH frames
+WS_COALESCE_MAX_BYTES = int(os.environ.get("WS_COALESCE_MAX_BYTES", 1024))
+WS_SEND_RETRIES = 2
+WS_RETRY_DELAY = 0.05
+WS_FLUSH_TIMEOUT = 1.0
+
+CONTROL, BULK = 0, 1
+
+
+class SocketWriter:
+    """Serializes every write to one websocket through a single writer task.
+
+    Callers queue a message and return right away; only the writer task touches the
+    socket, so concurrent senders (session loop, upstream forwarding, diagram jobs)
+    can't interleave writes. There are two lanes, each in FIFO order:
+    - control (default): short messages, sent before any queued bulk message,
+    - bulk: audio and everything that must stay in order with it (TTS streams,
+      forwarded upstream events, turn ends). `send` waits while more than
+      `max_pending` bulk messages are queued, like awaiting the socket did.
+    A control message overtakes queued bulk ones, so anything that must not arrive
+    before queued audio goes on the bulk lane too; `interrupt` drops the stale audio
+    instead of letting a "stop playback" overtake it. A failed send is retried by the
+    writer task, never in the caller's path. Once the socket is closed the queue is
+    dropped and `send` returns False.
+
+    With `coalesce`, a run of small queued messages in one lane goes out as a single
+    {"type": "BATCH", "messages": [...]} frame. Only for the client socket, and only
+    when the client unpacks BATCH frames.
+
+    Args:
+        ws: FastAPI WebSocket or `websockets` connection.
+        name(str): Used in logs.
+        max_pending(int): Queued bulk messages before `send` waits.
+        coalesce(bool): Batch small messages into one frame.
+    """
+
+    def __init__(
+        self,
+        ws,
+        name: str = "socket",
+        max_pending: int = WS_WRITER_MAX_PENDING,
+        coalesce: bool = False,
+    ):
+        self.ws = ws
+        self.name = name
+        self.max_pending = max_pending
+        self.coalesce = coalesce
+        self.closed = False
+        self.stats = {"sent": 0, "frames": 0, "retried": 0, "dropped": 0, "discarded": 0}
+        self._send = ws.send_text if hasattr(ws, "send_text") else ws.send
+        self._lanes = (deque(), deque())
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._closing = False
+        self._task: asyncio.Task = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._lanes[CONTROL]) + len(self._lanes[BULK])
+
+    async def send(self, data, bulk: bool = False) -> bool:
+        """Queues a message.
+
+        Args:
+            data: dict (sent as JSON) or an already serialized str.
+            bulk(bool): Use the bulk lane instead of the control lane.
+
+        Returns:
+            bool: False if the socket is closed, True once the message is queued.
+        """
+        if self.closed or self._closing:
+            return False
+        message = data if isinstance(data, str) else json.dumps(data)
+
+        lane = self._lanes[BULK if bulk else CONTROL]
+        while bulk and len(lane) >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+            if self.closed:
+                return False
+
+        lane.append(message)
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-writer")
+        return True
+
+    async def interrupt(self, data, stale) -> bool:
+        """Discards the queued bulk messages `stale` matches (e.g. audio the student just
+        talked over) and queues `data` on the bulk lane, after the bulk messages that
+        are kept. Nothing queued before it arrives after it.
+
+        Args:
+            data: dict (sent as JSON) or an already serialized str.
+            stale(Callable): Takes a queued (serialized) message, True to discard it.
+
+        Returns:
+            bool: False if the socket is closed, True once the message is queued.
+        """
+        if self.closed or self._closing:
+            return False
+        bulk = self._lanes[BULK]
+        kept = [message for message in bulk if not stale(message)]
+        self.stats["discarded"] += len(bulk) - len(kept)
+        bulk.clear()
+        bulk.extend(kept)
+        if len(bulk) < self.max_pending:
+            self._space.set()
+        return await self.send(data, bulk=True)
+
+    async def close(self, timeout: float = WS_FLUSH_TIMEOUT):
+        """Sends what's queued (for at most `timeout` seconds) and stops the writer."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None and not self._task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+        self._shutdown()
+
+    # --- writer task ---
+    def _socket_closed(self) -> bool:
+        return getattr(self.ws, "client_state", None) == WebSocketState.DISCONNECTED
+
+    def _next_frame(self, lane: deque) -> str:
+        message = lane.popleft()
+        if not self.coalesce or len(message) > WS_COALESCE_MAX_BYTES or not lane:
+            return message
+
+        batch, size = [message], len(message)
+        while lane and size + len(lane[0]) <= WS_COALESCE_MAX_BYTES:
+            size += len(lane[0])
+            batch.append(lane.popleft())
+        if len(batch) == 1:
+            return message
+        return '{"type": "BATCH", "messages": [' + ", ".join(batch) + "]}"
+
+    async def _write(self, frame: str, count: int) -> bool:
+        """Sends one frame of `count` messages. False once the socket is closed."""
+        for attempt in range(WS_SEND_RETRIES + 1):
+            if self._socket_closed():
+                return False
+            try:
+                await self._send(frame)
+                self.stats["sent"] += count
+                self.stats["frames"] += 1
+                return True
+            except (WebSocketDisconnect, ConnectionClosed):
+                return False
+            except Exception as e:
+                if attempt == WS_SEND_RETRIES:
+                    logger.error(f"{self.name}: dropping {count} message(s) after {WS_SEND_RETRIES} retries: {e}")
+                    self.stats["dropped"] += count
+                    return True
+                self.stats["retried"] += 1
+                await asyncio.sleep(WS_RETRY_DELAY * 2**attempt)
+
+    async def _run(self):
+        control, bulk = self._lanes
+        try:
+            while True:
+                if not control and not bulk:
+                    if self._closing:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                lane = control if control else bulk
+                before = len(lane)
+                frame = self._next_frame(lane)
+                if len(bulk) < self.max_pending:
+                    self._space.set()
+
+                if not await self._write(frame, before - len(lane)):
+                    logger.warning(f"{self.name} socket closed, dropping {self.pending} queued messages")
+                    return
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stats["dropped"] += self.pending
+        for lane in self._lanes:
+            lane.clear()
+        self._space.set()  # release senders waiting for room